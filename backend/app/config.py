@@ -26,6 +26,141 @@ MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
 MAX_CONCURRENT_GENERATIONS = 5
 
+# Process-wide in-flight provider calls (shared by all users / tasks)
+PROVIDER_CONCURRENCY = {
+    "gemini": int(os.getenv("GEMINI_MAX_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS))),
+    "kimi": int(os.getenv("KIMI_MAX_CONCURRENCY", str(MAX_CONCURRENT_GENERATIONS))),
+}
+
+# Background removal (see app.services.background_removal). REMBG_MODEL is
+# the speed / quality tier: u2netp (fastest), silueta, u2net, isnet (best edges)
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_SESSIONS = int(os.getenv("REMBG_SESSIONS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+REMBG_INTRA_OP_THREADS = int(os.getenv("REMBG_INTRA_OP_THREADS", str(max(1, (os.cpu_count() or 2) // REMBG_SESSIONS))))
+REMBG_WARMUP = os.getenv("REMBG_WARMUP", "1") not in ("0", "false", "False")
+# Images per inference call, and the resident size at which a rembg worker
+# process is replaced (sessions grow their memory arenas with large batches)
+REMBG_BATCH_SIZE = max(1, int(os.getenv("REMBG_BATCH_SIZE", "4")))
+REMBG_WORKER_MAX_MB = int(os.getenv("REMBG_WORKER_MAX_MB", "2048"))
+
+# Dedicated thread pools per class of blocking work (see app.services.executors)
+EXECUTOR_WORKERS = {
+    "default": int(os.getenv("EXECUTOR_DEFAULT_WORKERS", "4")),
+    "copywriting": int(os.getenv("EXECUTOR_COPYWRITING_WORKERS", "4")),
+    "rembg": int(os.getenv("EXECUTOR_REMBG_WORKERS", str(REMBG_SESSIONS))),  # one per session
+    "export": int(os.getenv("EXECUTOR_EXPORT_WORKERS", str(os.cpu_count() or 2))),
+    "thumbnail": int(os.getenv("EXECUTOR_THUMBNAIL_WORKERS", str(max(2, (os.cpu_count() or 2) // 2)))),
+    "storage": int(os.getenv("EXECUTOR_STORAGE_WORKERS", "2")),  # ZIP extraction, recompress fallback
+}
+# Process pools for CPU-heavy work that holds the GIL (decode / resample /
+# encode). 0 runs that work on the thread pool of the same name instead.
+PROCESS_EXECUTOR_WORKERS = {
+    "export": int(os.getenv("EXPORT_PROCESS_WORKERS", str(os.cpu_count() or 2))),
+    "storage": int(os.getenv("STORAGE_PROCESS_WORKERS", "2")),
+    "rembg": int(os.getenv("REMBG_PROCESS_WORKERS", str(REMBG_SESSIONS))),  # one session each
+}
+
+# Shared keep-alive HTTP pools used by the async provider clients
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "60"))
+PROVIDER_REQUEST_TIMEOUT = float(os.getenv("PROVIDER_REQUEST_TIMEOUT", "180"))
+
+# Content-addressed cache of provider results (see app.services.result_cache)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") not in ("0", "false", "False")
+RESULT_CACHE_DIR = OUTPUT_DIR / ".cache"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# Resized platform renditions of outputs (downloads / exports), LRU on disk
+RENDITION_CACHE_DIR = OUTPUT_DIR / ".renditions"
+RENDITION_CACHE_MAX_BYTES = int(os.getenv("RENDITION_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+# Storage encoding of generated outputs (see app.services.output_storage):
+# "png" keeps provider bytes as returned; "webp" is lossless; "avif" / "jpeg"
+# are high-quality lossy. PNG is then produced only when asked for.
+OUTPUT_STORAGE_FORMAT = os.getenv("OUTPUT_STORAGE_FORMAT", "webp")
+OUTPUT_RECOMPRESS_EXISTING = os.getenv("OUTPUT_RECOMPRESS_EXISTING", "1") not in ("0", "false", "False")
+OUTPUT_RECOMPRESS_MIN_AGE_SECONDS = int(os.getenv("OUTPUT_RECOMPRESS_MIN_AGE_SECONDS", "600"))
+
+# On-demand output thumbnails (see app.services.thumbnails)
+THUMBNAIL_WIDTHS = (64, 128, 256, 512, 1024, 2048)  # requested widths round up to these
+THUMBNAIL_DEFAULT_WIDTH = int(os.getenv("THUMBNAIL_DEFAULT_WIDTH", "256"))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_CACHE_DIR = OUTPUT_DIR / ".thumbnails"
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "256")) * 1024 * 1024
+THUMBNAIL_MAX_PENDING = int(os.getenv("THUMBNAIL_MAX_PENDING", "32"))  # beyond this, serve the original
+OUTPUT_IMMUTABLE_MAX_AGE = int(os.getenv("OUTPUT_IMMUTABLE_MAX_AGE", str(365 * 24 * 3600)))  # seconds
+
+# Provider retry policy (see app.services.retry_policy)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))  # seconds
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20.0"))  # seconds
+
+# Per-provider circuit breaker (see app.services.provider_registry)
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_MIN_SAMPLES = int(os.getenv("CIRCUIT_MIN_SAMPLES", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_CONSECUTIVE_FAILURES = int(os.getenv("CIRCUIT_CONSECUTIVE_FAILURES", "3"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+# Hedged provider requests (see app.services.hedging) — off by default
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "0") in ("1", "true", "True")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))  # hedges per call, per user
+HEDGE_MAX_PER_USER_HOUR = int(os.getenv("HEDGE_MAX_PER_USER_HOUR", "30"))
+HEDGE_ALTERNATE_PROVIDER = os.getenv("HEDGE_ALTERNATE_PROVIDER", "0") in ("1", "true", "True")
+
+# Write-behind DB persistence of generation progress (terminal states flush immediately)
+PERSIST_FLUSH_INTERVAL_MS = int(os.getenv("PERSIST_FLUSH_INTERVAL_MS", "250"))
+# Failed flushes after which a row's update is dropped (logged) instead of retried
+PERSIST_MAX_ATTEMPTS = int(os.getenv("PERSIST_MAX_ATTEMPTS", "5"))
+
+# File durability for outputs/uploads: "off", "always" (fsync per file) or "batch"
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "off").lower()
+STORAGE_FSYNC_INTERVAL_MS = int(os.getenv("STORAGE_FSYNC_INTERVAL_MS", "500"))
+
+# Prepared product-image inputs (see app.services.prepared_input)
+PREPARED_INPUT_CACHE_SIZE = int(os.getenv("PREPARED_INPUT_CACHE_SIZE", "32"))
+PREPARED_JPEG_QUALITY = int(os.getenv("PREPARED_JPEG_QUALITY", "92"))
+# Largest input side worth sending to each provider; bigger uploads are downscaled
+PROVIDER_MAX_INPUT_SIDE = {
+    "gemini": int(os.getenv("GEMINI_MAX_INPUT_SIDE", "2048")),
+    "kimi": int(os.getenv("KIMI_MAX_INPUT_SIDE", "1536")),
+}
+
+# Events kept per task for late / reconnecting SSE subscribers (Last-Event-ID)
+TASK_EVENT_REPLAY_SIZE = int(os.getenv("TASK_EVENT_REPLAY_SIZE", "64"))
+# Progress SSE: full snapshot every N image deltas; keep-alive comment interval
+SSE_SNAPSHOT_EVERY = int(os.getenv("SSE_SNAPSHOT_EVERY", "20"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# Work queue (see app.services.job_queue / app.worker).
+# "inline": this process runs generation and batches itself (single process).
+# "queue": API processes enqueue; `python -m app.worker` processes run the work.
+JOB_QUEUE_MODE = os.getenv("JOB_QUEUE_MODE", "inline").lower()
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# How often SSE re-reads task state that another process is producing
+SSE_POLL_SECONDS = float(os.getenv("SSE_POLL_SECONDS", "1.0"))
+
+# Batches: SKUs generated at once per batch (their images share the provider
+# slots above); per-SKU duration assumed for ETAs until one has finished
+BATCH_SKUS_IN_FLIGHT = int(os.getenv("BATCH_SKUS_IN_FLIGHT", "3"))
+BATCH_SKU_SECONDS_ESTIMATE = float(os.getenv("BATCH_SKU_SECONDS_ESTIMATE", "120"))
+
+# In-memory task store: running tasks are never evicted; finished ones are
+# kept LRU within these limits and re-read from the DB after eviction
+TASK_STORE_MAX_TASKS = int(os.getenv("TASK_STORE_MAX_TASKS", "10000"))
+TASK_STORE_MAX_BYTES = int(os.getenv("TASK_STORE_MAX_MB", "64")) * 1024 * 1024
+
+# What startup does with jobs / batches interrupted by a restart:
+# "resume" (continue unfinished work), "fail", or "refund" (fail + refund credits)
+INTERRUPTED_JOB_POLICY = os.getenv("INTERRUPTED_JOB_POLICY", "resume").lower()
+
 # API Key persistence file
 API_KEYS_FILE = BASE_DIR / ".api_keys.json"
 
@@ -4,7 +4,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from app.config import CORS_ORIGINS, OUTPUT_DIR, UPLOAD_DIR
+from app.config import CORS_ORIGINS, OUTPUT_DIR, OUTPUT_RECOMPRESS_EXISTING, REMBG_WARMUP, UPLOAD_DIR
 from app.routers import (
     analysis,
     atmosphere,
@@ -15,6 +15,7 @@ from app.routers import (
     generate,
     history,
     optimization,
+    outputs,
     projects,
     scenes,
     settings,
@@ -53,7 +54,9 @@ app.add_middleware(RateLimitMiddleware)
 app.add_middleware(AuditLogMiddleware)
 app.add_middleware(ErrorHandlerMiddleware)
 
-# Serve uploaded and generated images
+# Serve uploaded and generated images (outputs through the router first:
+# ETags, immutable caching and ?w= thumbnails)
+app.include_router(outputs.router)
 app.mount("/api/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 app.mount("/api/outputs", StaticFiles(directory=str(OUTPUT_DIR)), name="outputs")
 
@@ -80,6 +83,8 @@ app.include_router(themes.router)
 async def startup():
     """Initialize database and recover stale tasks on startup."""
     from app.database import init_db
+    from app.services import background_removal, job_queue, output_storage
+    from app.routers.batch import recover_interrupted_batches
     from app.services.generation_service import recover_stale_tasks
 
     logger = logging.getLogger("app.startup")
@@ -87,11 +92,156 @@ async def startup():
     await init_db()
     logger.info("Database initialized successfully")
 
-    recovered = await recover_stale_tasks()
-    if recovered:
-        logger.info(f"Recovered {recovered} stale tasks from previous run")
+    # With the work queue, in-progress jobs belong to worker processes and
+    # are recovered through lease expiry — not by whichever API starts next.
+    if not job_queue.queue_enabled():
+        recovered = await recover_stale_tasks()
+        if recovered:
+            logger.info(f"Recovered {recovered} stale tasks from previous run")
+        await recover_interrupted_batches()
+
+    # Load background-removal sessions before the first request needs them
+    if REMBG_WARMUP:
+        background_removal.start_warm_up()
+
+    # Re-encode PNG outputs stored before the storage format policy
+    if OUTPUT_RECOMPRESS_EXISTING:
+        output_storage.start_recompress()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flush pending DB writes, then release worker and connection pools."""
+    from app.services import executors, http_pool, output_storage
+    from app.services.job_persistence import write_behind
+
+    output_storage.stop_recompress()
+    await write_behind.close()
+    await http_pool.close_all()
+    executors.shutdown_all()
 
 
 @app.get("/api/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/api/health/providers")
+async def providers_health():
+    """Per-provider circuit state, rolling success rate and latency."""
+    from app.services.provider_registry import ProviderRegistry, register_builtin_providers
+
+    register_builtin_providers()
+    return {"providers": ProviderRegistry.health_snapshot()}
+
+
+@app.get("/api/health/scheduler")
+async def scheduler_health():
+    """Provider slot utilisation, queue depth and wait times."""
+    from app.services.scheduler import scheduler
+
+    return {"providers": scheduler.stats()}
+
+
+@app.get("/api/health/executors")
+async def executors_health():
+    """Per-pool worker utilisation and queueing for blocking work."""
+    from app.services import executors
+
+    return {"executors": executors.stats()}
+
+
+@app.get("/api/health/result-cache")
+async def result_cache_health():
+    """Generation result cache size and hit / coalescing counters."""
+    from app.services import result_cache
+
+    return result_cache.stats()
+
+
+@app.get("/api/health/retries")
+async def retries_health():
+    """Retry / failover counters and latency split by attempt count."""
+    from app.services.retry_policy import retry_engine
+
+    return retry_engine.stats()
+
+
+@app.get("/api/health/hedging")
+async def hedging_health():
+    """Hedged request counts, wins and per-user budget usage."""
+    from app.services.hedging import hedger
+
+    return hedger.stats()
+
+
+@app.get("/api/health/prepared-inputs")
+async def prepared_inputs_health():
+    """Prepared product-image cache size and hit counts."""
+    from app.services import prepared_input
+
+    return prepared_input.stats()
+
+
+@app.get("/api/health/renditions")
+async def renditions_health():
+    """Platform rendition cache size and hit counts."""
+    from app.services import rendition_cache
+
+    return rendition_cache.stats()
+
+
+@app.get("/api/health/rembg")
+async def rembg_health():
+    """Background-removal sessions, warm-up time and latency per model."""
+    from app.services import background_removal
+
+    return background_removal.stats()
+
+
+@app.get("/api/health/storage")
+async def storage_health():
+    """Output storage format, byte savings and encode time per image."""
+    from app.services import output_storage
+
+    return output_storage.stats()
+
+
+@app.get("/api/health/thumbnails")
+async def thumbnails_health():
+    """Thumbnail cache size, hit counts and pending / shed renders."""
+    from app.services import thumbnails
+
+    return thumbnails.stats()
+
+
+@app.get("/api/health/exports")
+async def exports_health():
+    """Timing of recent multi-platform exports."""
+    from app.services import export_engine
+
+    return export_engine.stats()
+
+
+@app.get("/api/health/jobs")
+async def jobs_health():
+    """Running generation jobs, task store and SSE subscriber counts."""
+    from app.services import generation_service
+
+    return generation_service.job_stats()
+
+
+@app.get("/api/health/queue")
+async def queue_health():
+    """Work queue mode and item counts by kind / status."""
+    from app.services import job_queue
+
+    return await job_queue.stats()
+
+
+@app.get("/api/health/persistence")
+async def persistence_health():
+    """Write-behind queue depth and flush counts."""
+    from app.services.job_persistence import write_behind
+
+    return write_behind.stats()
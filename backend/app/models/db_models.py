@@ -7,12 +7,13 @@ Tables:
 - generated_images: Individual generated images per job
 - credit_transactions: Audit trail for all credit changes
 - uploaded_images: Uploaded product images metadata
+- work_items: Durable queue of generation / batch work claimed by workers
 """
 
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database import Base
@@ -265,3 +266,25 @@ class StyleReference(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=_utcnow)
 
     user: Mapped["User"] = relationship()
+
+
+# ---------------------------------------------------------------------------
+# Work queue (generation / batch items claimed by workers under a lease)
+# ---------------------------------------------------------------------------
+
+class WorkItem(Base):
+    __tablename__ = "work_items"
+    __table_args__ = (Index("ix_work_items_claim", "status", "priority", "created_at"),)
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # generation / batch
+    ref_id: Mapped[str] = mapped_column(String(36), nullable=False, index=True)  # task_id / batch_id
+    payload: Mapped[str] = mapped_column(Text, nullable=False, default="{}")  # JSON object
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # lower runs first
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")  # queued/leased/done/failed
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    lease_owner: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=_utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=_utcnow, onupdate=_utcnow)
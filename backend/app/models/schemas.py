@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Optional
+from typing import Annotated, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, StringConstraints
 
 
 class ProductType(str, Enum):
@@ -41,6 +41,19 @@ class RemoveBgResponse(BaseModel):
     removed_bg_url: str
 
 
+# Upload ids are uuid4().hex[:12]; anything else must not reach a path glob
+UploadId = Annotated[str, StringConstraints(pattern=r"^[0-9a-f]{12}$")]
+
+
+class RemoveBgBatchRequest(BaseModel):
+    image_ids: list[UploadId] = Field(..., min_length=1, max_length=200)
+
+
+class RemoveBgBatchResponse(BaseModel):
+    results: list[RemoveBgResponse]
+    failed: list[str] = []  # image ids not found or not decodable
+
+
 class SceneTemplateSchema(BaseModel):
     id: str
     name: str
@@ -103,6 +116,7 @@ class CompositeRequest(BaseModel):
     cell_size: int = 800  # pixel size per cell
     gap: int = 8  # pixel gap between cells
     bg_color: str = "#ffffff"
+    format: str = "png"  # "png", "jpeg" or "webp" (much smaller for photo grids)
 
 
 class GenerateTaskResponse(BaseModel):
@@ -125,6 +139,7 @@ class GeneratedImage(BaseModel):
     template_name: str
     status: ImageStatus
     url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
     error: Optional[str] = None
 
 
@@ -407,6 +422,7 @@ class PlatformExportConfig(BaseModel):
     platform: str
     width: int
     height: int
+    format: str = "png"  # one of image_export.FORMATS
 
 
 class ExportDetailRequest(BaseModel):
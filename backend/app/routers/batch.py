@@ -11,6 +11,7 @@ Flow:
 from __future__ import annotations
 
 import csv
+import functools
 import io
 import uuid
 import zipfile
@@ -19,14 +20,25 @@ from pathlib import Path
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select, update
+from sqlalchemy import insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth import get_current_user
-from app.config import CREDIT_PER_IMAGE, OUTPUT_DIR, UPLOAD_DIR
+from app.config import CREDIT_PER_IMAGE, INTERRUPTED_JOB_POLICY, OUTPUT_DIR, UPLOAD_DIR
 from app.database import get_db
-from app.models.db_models import Batch, BatchItem, User
-from app.services import credit_service
+from app.models.db_models import Batch, BatchItem, GenerationJob, User
+from app.models.schemas import PLATFORM_SPECS
+from app.services import (
+    batch_runner,
+    credit_service,
+    executors,
+    job_queue,
+    output_storage,
+    rendition_cache,
+    storage_io,
+)
+from app.services.scheduler import Priority
+from app.services.zip_stream import ZipEntry, stream_zip
 
 router = APIRouter(prefix="/api/batch", tags=["batch"])
 
@@ -59,6 +71,7 @@ class BatchStatusResponse(BaseModel):
     total_credits: int
     error_message: str | None
     items: list[BatchItemStatus]
+    eta_seconds: float | None = None  # Until the whole batch is done
 
 
 class BatchItemStatus(BaseModel):
@@ -67,6 +80,9 @@ class BatchItemStatus(BaseModel):
     status: str
     job_id: str | None
     error: str | None
+    completed_images: int = 0
+    total_images: int = 0
+    eta_seconds: float | None = None
 
 
 # ---------------------------------------------------------------------------
@@ -83,6 +99,9 @@ VALID_PRODUCT_TYPES = {
 # Default images per SKU (common templates count)
 IMAGES_PER_SKU = 9
 
+# Image extensions looked up for each SKU, in order of preference
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
 
 # ---------------------------------------------------------------------------
 # Endpoints
@@ -108,11 +127,10 @@ async def batch_upload(
     items_preview: list[BatchItemPreview] = []
     sku_rows: list[dict] = []
 
-    # Read ZIP to get available filenames
-    zip_content = await zip_file.read()
+    # Index the ZIP by basename straight from the spooled upload (no copy
+    # in memory); only its central directory is read here
     try:
-        with zipfile.ZipFile(io.BytesIO(zip_content)) as zf:
-            zip_filenames = set(zf.namelist())
+        zip_index = await storage_io.index_zip_members(zip_file.file)
     except zipfile.BadZipFile:
         raise HTTPException(status_code=400, detail="無效的 ZIP 檔案")
 
@@ -131,18 +149,10 @@ async def batch_upload(
             errors.append(f"第 {i} 行：無效的 product_type '{product_type}'")
             continue
 
-        # Look for image in ZIP (try common extensions)
+        # Look for image in ZIP (try common extensions, top level or in a subfolder)
         image_filename = None
-        for ext in [".jpg", ".jpeg", ".png", ".webp"]:
-            candidate = f"{sku_name}{ext}"
-            if candidate in zip_filenames:
-                image_filename = candidate
-                break
-            # Also try inside a subfolder
-            for zname in zip_filenames:
-                if zname.endswith(f"/{sku_name}{ext}") or zname == f"{sku_name}{ext}":
-                    image_filename = zname
-                    break
+        for ext in IMAGE_EXTENSIONS:
+            image_filename = zip_index.get(f"{sku_name}{ext}")
             if image_filename:
                 break
 
@@ -188,23 +198,29 @@ async def batch_upload(
     batch_upload_dir = UPLOAD_DIR / f"batch_{batch_id}"
     batch_upload_dir.mkdir(parents=True, exist_ok=True)
 
-    with zipfile.ZipFile(io.BytesIO(zip_content)) as zf:
-        for row in sku_rows:
-            image_data = zf.read(row["image_filename"])
-            save_path = batch_upload_dir / Path(row["image_filename"]).name
-            save_path.write_bytes(image_data)
-
-            item = BatchItem(
-                batch_id=batch_id,
-                sku_name=row["sku_name"],
-                product_type=row["product_type"],
-                style=row["style"],
-                image_filename=row["image_filename"],
-                image_path=str(save_path),
-                status="pending",
-            )
-            db.add(item)
+    save_paths = {
+        row["image_filename"]: batch_upload_dir / Path(row["image_filename"]).name
+        for row in sku_rows
+    }
+    await storage_io.extract_zip_members(zip_file.file, save_paths)
 
+    # Batch row first, then all items in one executemany
+    await db.flush()
+    await db.execute(
+        insert(BatchItem),
+        [
+            {
+                "batch_id": batch_id,
+                "sku_name": row["sku_name"],
+                "product_type": row["product_type"],
+                "style": row["style"],
+                "image_filename": row["image_filename"],
+                "image_path": str(save_paths[row["image_filename"]]),
+                "status": "pending",
+            }
+            for row in sku_rows
+        ],
+    )
     await db.commit()
 
     return BatchPreviewResponse(
@@ -252,9 +268,12 @@ async def batch_start(
     )
     await db.commit()
 
-    # Enqueue batch processing in background
-    import asyncio
-    asyncio.create_task(_process_batch(batch_id))
+    # Enqueue batch processing: a worker process in queue mode, else here
+    if job_queue.queue_enabled():
+        await job_queue.enqueue("batch", batch_id, priority=int(Priority.BATCH))
+    else:
+        import asyncio
+        asyncio.create_task(batch_runner.run_batch(batch_id))
 
     return {
         "batch_id": batch_id,
@@ -277,16 +296,27 @@ async def batch_status(
     if not batch:
         raise HTTPException(status_code=404, detail="批量任務未找到")
 
-    items = [
-        BatchItemStatus(
+    batch_items = batch.items or []
+    job_ids = [item.job_id for item in batch_items if item.job_id]
+    jobs: dict[str, GenerationJob] = {}
+    if job_ids:
+        job_result = await db.execute(select(GenerationJob).where(GenerationJob.id.in_(job_ids)))
+        jobs = {job.id: job for job in job_result.scalars().all()}
+    batch_eta, item_etas = batch_runner.estimate_eta(batch_items, jobs)
+
+    items = []
+    for item in batch_items:
+        job = jobs.get(item.job_id or "")
+        items.append(BatchItemStatus(
             sku_name=item.sku_name,
             product_type=item.product_type,
             status=item.status,
             job_id=item.job_id,
             error=item.error,
-        )
-        for item in (batch.items or [])
-    ]
+            completed_images=job.completed_images if job else 0,
+            total_images=job.total_images if job else IMAGES_PER_SKU,
+            eta_seconds=item_etas.get(item.id),
+        ))
 
     return BatchStatusResponse(
         batch_id=batch.id,
@@ -296,16 +326,25 @@ async def batch_status(
         total_credits=batch.total_credits,
         error_message=batch.error_message,
         items=items,
+        eta_seconds=batch_eta,
     )
 
 
 @router.get("/{batch_id}/download")
 async def batch_download(
     batch_id: str,
+    platform: str | None = None,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    """Download all batch results as a ZIP organized by SKU."""
+    """Download all batch results as a ZIP organized by SKU.
+
+    With ``?platform=`` (a PLATFORM_SPECS key) images are resized for that
+    platform, via the rendition cache; otherwise originals are included.
+    """
+    spec = PLATFORM_SPECS.get(platform) if platform else None
+    if platform and spec is None:
+        raise HTTPException(status_code=400, detail=f"不支援的平台：{platform}")
     result = await db.execute(
         select(Batch).where(Batch.id == batch_id, Batch.user_id == user.id)
     )
@@ -316,24 +355,35 @@ async def batch_download(
     if batch.status not in ("completed", "partial"):
         raise HTTPException(status_code=400, detail="批量任務尚未完成")
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for item in (batch.items or []):
-            if item.job_id and item.status == "completed":
-                # Find generated images for this job
-                task_output_dir = OUTPUT_DIR / item.job_id
-                if task_output_dir.exists():
-                    for img_file in task_output_dir.glob("*.png"):
-                        if "_v" not in img_file.name:  # Skip variants
-                            arcname = f"{item.sku_name}/{img_file.name}"
-                            zf.write(img_file, arcname)
-
-    buf.seek(0)
+    finished = [
+        (item.sku_name, item.job_id)
+        for item in (batch.items or [])
+        if item.job_id and item.status == "completed"
+    ]
+
+    def list_outputs() -> list[ZipEntry]:
+        entries = []
+        for sku_name, job_id in finished:
+            # Find generated images for this job
+            task_output_dir = OUTPUT_DIR / job_id
+            if task_output_dir.exists():
+                for img_file in output_storage.list_outputs(task_output_dir):
+                    if "_v" not in img_file.name:  # Skip variants
+                        if spec is None:
+                            arcname = f"{sku_name}/{img_file.name}"
+                            produce = functools.partial(output_storage.read_png, img_file)
+                        else:
+                            arcname = f"{sku_name}/{img_file.stem}_{spec.width}x{spec.height}.png"
+                            produce = functools.partial(rendition_cache.get, img_file, spec.width, spec.height)
+                        entries.append(ZipEntry(arcname, produce))
+        return entries
+
+    entries = await executors.run("default", list_outputs)
     return StreamingResponse(
-        buf,
+        stream_zip(entries),
         media_type="application/zip",
         headers={
-            "Content-Disposition": f"attachment; filename=batch_{batch_id}.zip",
+            "Content-Disposition": f"attachment; filename=batch_{batch_id}{f'_{platform}' if platform else ''}.zip",
         },
     )
 
@@ -342,124 +392,58 @@ async def batch_download(
 # Background batch processing
 # ---------------------------------------------------------------------------
 
-async def _process_batch(batch_id: str) -> None:
-    """Process all SKUs in a batch sequentially."""
+async def recover_interrupted_batches(policy: str = INTERRUPTED_JOB_POLICY) -> int:
+    """Handle batches interrupted by a restart, once at startup.
+
+    "resume" continues each batch from its unfinished items; "fail"
+    marks unfinished items failed; "refund" also refunds the credits of
+    items that never started (items with a job are refunded per job by
+    generation_service.recover_stale_tasks).
+    """
+    import asyncio
     import logging
     from app.database import AsyncSessionLocal
-    from app.services import generation_service
 
     logger = logging.getLogger("app.batch")
 
-    try:
-        async with AsyncSessionLocal() as db:
-            # Mark as running
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Batch).where(Batch.status.in_(["confirmed", "running"]))
+        )
+        batches = list(result.scalars().all())
+
+        for batch in batches:
+            if policy == "resume":
+                continue
+            unfinished = [i for i in (batch.items or []) if i.status not in ("completed", "failed")]
             await db.execute(
-                update(Batch).where(Batch.id == batch_id).values(status="running")
-            )
-            await db.commit()
-
-            # Load batch and items
-            result = await db.execute(select(Batch).where(Batch.id == batch_id))
-            batch = result.scalar_one_or_none()
-            if not batch:
-                return
-
-            completed = 0
-            for item in (batch.items or []):
-                try:
-                    # Update item status
-                    await db.execute(
-                        update(BatchItem)
-                        .where(BatchItem.id == item.id)
-                        .values(status="running")
-                    )
-                    await db.commit()
-
-                    # Create generation task for this SKU
-                    image_path = Path(item.image_path) if item.image_path else None
-                    if not image_path or not image_path.exists():
-                        await db.execute(
-                            update(BatchItem)
-                            .where(BatchItem.id == item.id)
-                            .values(status="failed", error="圖片檔案未找到")
-                        )
-                        await db.commit()
-                        continue
-
-                    task = generation_service.create_task(
-                        image_path=image_path,
-                        product_type=item.product_type,
-                        style=item.style,
-                        user_id=batch.user_id,
-                    )
-                    await generation_service.persist_task_to_db(task)
-
-                    # Update batch item with job_id
-                    await db.execute(
-                        update(BatchItem)
-                        .where(BatchItem.id == item.id)
-                        .values(job_id=task.task_id)
-                    )
-                    await db.commit()
-
-                    # Run generation (consume the async generator)
-                    async for _event in generation_service.run_generation(task.task_id):
-                        pass  # Just drive it to completion
-
-                    # Check result
-                    final_task = generation_service.get_task(task.task_id)
-                    if final_task and final_task.status in ("completed", "partial"):
-                        completed += 1
-                        await db.execute(
-                            update(BatchItem)
-                            .where(BatchItem.id == item.id)
-                            .values(status="completed")
-                        )
-                    else:
-                        await db.execute(
-                            update(BatchItem)
-                            .where(BatchItem.id == item.id)
-                            .values(status="failed", error="生成失敗")
-                        )
-
-                    # Update batch progress
-                    await db.execute(
-                        update(Batch)
-                        .where(Batch.id == batch_id)
-                        .values(completed_skus=completed)
-                    )
-                    await db.commit()
-
-                except Exception as e:
-                    logger.error(f"Batch item {item.sku_name} failed: {e}")
-                    await db.execute(
-                        update(BatchItem)
-                        .where(BatchItem.id == item.id)
-                        .values(status="failed", error=str(e))
-                    )
-                    await db.commit()
-
-            # Final batch status
-            final_status = "completed" if completed == batch.total_skus else (
-                "partial" if completed > 0 else "failed"
+                update(BatchItem)
+                .where(BatchItem.id.in_([i.id for i in unfinished]))
+                .values(status="failed", error="伺服器重啟，任務被中斷")
             )
+            completed = sum(1 for i in (batch.items or []) if i.status == "completed")
             await db.execute(
                 update(Batch)
-                .where(Batch.id == batch_id)
-                .values(status=final_status, completed_skus=completed)
+                .where(Batch.id == batch.id)
+                .values(
+                    status="partial" if completed > 0 else "failed",
+                    completed_skus=completed,
+                    error_message="伺服器重啟，任務被中斷",
+                )
             )
-            await db.commit()
-            logger.info(f"Batch {batch_id} finished: {final_status} ({completed}/{batch.total_skus})")
-
-    except Exception as e:
-        logger.error(f"Batch {batch_id} processing error: {e}")
-        try:
-            async with AsyncSessionLocal() as db:
-                await db.execute(
-                    update(Batch)
-                    .where(Batch.id == batch_id)
-                    .values(status="failed", error_message=str(e))
+            not_started = sum(1 for i in unfinished if not i.job_id)
+            if policy == "refund" and not_started:
+                await credit_service.refund_credits(
+                    db, batch.user_id, not_started * IMAGES_PER_SKU * CREDIT_PER_IMAGE,
+                    description=f"伺服器重啟退款：批量任務 {not_started} 個未開始的 SKU",
                 )
-                await db.commit()
-        except Exception:
-            pass
+        await db.commit()
+
+    if policy == "resume":
+        for batch in batches:
+            logger.info(f"Resuming batch {batch.id}")
+            asyncio.create_task(batch_runner.run_batch(batch.id))
+
+    if batches:
+        logger.info(f"Recovered {len(batches)} interrupted batches (policy={policy})")
+    return len(batches)
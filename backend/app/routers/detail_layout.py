@@ -8,14 +8,12 @@ Endpoints:
 
 from __future__ import annotations
 
-import io
-import zipfile
-
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth import get_current_user
+from app.config import OUTPUT_DIR
 from app.database import get_db
 from app.models.db_models import User
 from app.models.schemas import (
@@ -25,9 +23,14 @@ from app.models.schemas import (
     GenerateCopyResponse,
     MarketingCopy,
 )
+from app.services import executors, export_engine, image_export, output_storage
+from app.services.zip_stream import ZipEntry
 
 router = APIRouter(prefix="/api/detail-layout", tags=["detail-layout"])
 
+# Largest export side accepted per platform
+MAX_EXPORT_SIDE = 4096
+
 
 # ---------------------------------------------------------------------------
 # Endpoints
@@ -71,42 +74,54 @@ async def export_detail(
 ):
     """Export images for multiple platforms as a ZIP file.
 
-    TODO: Implement full platform-specific resizing and 4K upscale.
-    """
-    from pathlib import Path
-    from app.config import OUTPUT_DIR
+    Each image is decoded once and fitted to every requested platform size
+    (see export_engine.py). Renditions come from the rendition cache, so
+    repeat exports only read files, and the ZIP is streamed as entries are
+    ready.
 
+    TODO: Implement 4K upscale.
+    """
     task_output_dir = OUTPUT_DIR / request.task_id
     if not task_output_dir.exists():
         raise HTTPException(status_code=404, detail="生成任務未找到，請先生成圖片")
 
+    for platform_config in request.platforms:
+        if not (0 < platform_config.width <= MAX_EXPORT_SIDE and 0 < platform_config.height <= MAX_EXPORT_SIDE):
+            raise HTTPException(
+                status_code=400,
+                detail=f"平台 {platform_config.platform} 的尺寸無效（上限 {MAX_EXPORT_SIDE}px）",
+            )
+        if platform_config.format not in image_export.FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"平台 {platform_config.platform} 的格式不支援: {platform_config.format}",
+            )
+
     # Collect images
-    images = list(task_output_dir.glob("*.png"))
+    images = await executors.run("default", output_storage.list_outputs, task_output_dir)
     images = [img for img in images if "_v" not in img.name]  # Skip variants
     if not images:
         raise HTTPException(status_code=400, detail="沒有可匯出的圖片")
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for platform_config in request.platforms:
-            platform_dir = platform_config.platform
-            for img_file in images:
-                # For now, just include original images organized by platform
-                arcname = f"{platform_dir}/{img_file.name}"
-                zf.write(img_file, arcname)
-
-        # If 4K upscale requested, add a note file
-        if request.include_4k_upscale:
-            zf.writestr(
-                "4K_UPSCALE_NOTE.txt",
-                "4K 放大功能尚在開發中，目前匯出為原始解析度。\n"
-                "4K upscaling is under development. Current export uses original resolution.\n",
-            )
+    # Each image is decoded once and fitted to every platform in one pass
+    targets = [(p.width, p.height, p.format) for p in request.platforms]
+
+    def arcname(img_file, index: int) -> str:
+        platform = request.platforms[index]
+        return f"{platform.platform}/{img_file.stem}.{image_export.EXTENSIONS[platform.format]}"
+
+    extra_entries = []
+    # If 4K upscale requested, add a note file
+    if request.include_4k_upscale:
+        note = (
+            "4K 放大功能尚在開發中，目前匯出為各平台指定尺寸。\n"
+            "4K upscaling is under development. Current export uses each platform's size.\n"
+        ).encode("utf-8")
+        extra_entries.append(ZipEntry("4K_UPSCALE_NOTE.txt", lambda: note))
 
-    buf.seek(0)
     filename = f"export_{request.task_id}.zip"
     return StreamingResponse(
-        buf,
+        export_engine.stream_export(request.task_id, images, targets, arcname, extra_entries),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
@@ -1,18 +1,16 @@
 from __future__ import annotations
 
-import io
+import functools
 import json
-import zipfile
 from pathlib import Path
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
-from PIL import Image
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import config
 from app.auth import get_optional_user
-from app.config import CREDIT_PER_IMAGE, OUTPUT_DIR, UPLOAD_DIR
+from app.config import CREDIT_PER_IMAGE, UPLOAD_DIR
 from app.database import get_db
 from app.models.db_models import User
 from app.models.schemas import (
@@ -25,20 +23,25 @@ from app.models.schemas import (
     GenerateTaskResponse,
     GeneratedImage,
     ImageStatus,
-    PlatformSpec,
     PLATFORM_SPECS,
     ProductTypeInfo,
     RegenerateRequest,
     SceneTemplateSchema,
     StyleSchema,
 )
-from app.services import credit_service, generation_service
-from app.services import copywriting_service
+from app.services import credit_service, generation_service, job_queue, task_events
+from app.services import copywriting_service, image_export, output_storage, rendition_cache, thumbnails
+from app.services.zip_stream import ZipEntry, stream_zip
 from app.templates.registry import TemplateRegistry
 from app.templates.styles.registry import StyleRegistry
 
 router = APIRouter(prefix="/api", tags=["generate"])
 
+# Accepted composite cell size and gap (pixels)
+MIN_COMPOSITE_CELL = 64
+MAX_COMPOSITE_CELL = 2048
+MAX_COMPOSITE_GAP = 256
+
 
 @router.get("/styles", response_model=list[StyleSchema])
 async def get_styles():
@@ -124,22 +127,17 @@ async def start_generation(
         if nobg_path.exists():
             image_path = nobg_path
         else:
-            # Auto remove bg first (run in thread to avoid blocking event loop)
+            # Auto remove bg first (on the rembg worker processes)
             matching = list(UPLOAD_DIR.glob(f"{image_id}.*"))
             matching = [p for p in matching if "_nobg" not in p.name]
             if not matching:
                 raise HTTPException(status_code=404, detail="Image not found")
-            import asyncio
-            import functools
-            from app.services.background_removal import remove_background
-            loop = asyncio.get_running_loop()
+            from app.services import background_removal, storage_io
             try:
-                await loop.run_in_executor(
-                    None,
-                    functools.partial(remove_background, matching[0], nobg_path),
-                )
+                png = await background_removal.cut_out(await storage_io.read_bytes(matching[0]))
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"背景移除失敗: {e}")
+            await storage_io.write_bytes(nobg_path, png)
             image_path = nobg_path
     else:
         matching = list(UPLOAD_DIR.glob(f"{image_id}.*"))
@@ -191,8 +189,10 @@ async def start_generation(
         user_id=user.id if user else None,
     )
 
-    # Persist to DB
+    # Persist to DB, then start generating right away (in-process or via
+    # the work queue); SSE only observes
     await generation_service.persist_task_to_db(task)
+    await generation_service.submit_generation(task)
 
     return GenerateTaskResponse(
         task_id=task.task_id,
@@ -203,44 +203,112 @@ async def start_generation(
     )
 
 
-@router.get("/generate/{task_id}/status")
-async def generation_status_sse(task_id: str):
-    """SSE endpoint for real-time generation progress."""
-    task = generation_service.get_task(task_id)
+def _sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        },
+    )
 
-    # Fallback: try loading from DB if not in memory
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+
+def _legacy_event(event: dict, results: dict[str, dict]) -> dict | None:
+    """Fold a v2 delta / snapshot event into a v1 full-results event."""
+    if "results" in event:
+        results.clear()
+        results.update((r["template_id"], r) for r in event["results"])
+    elif "image" in event:
+        results[event["image"]["template_id"]] = event["image"]
+    name = event["event"]
+    if name == "error":
+        return {"event": "error", "data": event.get("data")}
+    legacy = {k: v for k, v in event.items() if k in ("task_id", "progress", "total", "status")}
+    legacy["event"] = name if name in ("started", "completed") else "progress"
+    legacy["results"] = list(results.values())
+    return legacy
+
+
+@router.get("/generate/{task_id}/status")
+async def generation_status_sse(
+    task_id: str,
+    last_event_id: str | None = Header(default=None),
+    resume_from: str | None = None,
+    protocol: int = 1,
+):
+    """SSE endpoint for real-time generation progress.
+
+    Generation runs as a background job started when the task is created;
+    this endpoint only subscribes to the task's event bus. Any number of
+    viewers can attach, and a reconnect resumes after ``Last-Event-ID``
+    (or ``?resume_from=`` for clients that open a fresh EventSource)
+    without restarting or blocking the job.
+
+    ``?protocol=2`` streams per-image deltas ("image") with sequence numbers
+    and periodic full "snapshot" events; protocol 1 (default) sends the
+    full results list with every event. Idle streams get a ``: keep-alive``
+    comment line every SSE_HEARTBEAT_SECONDS.
+    """
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    # Guard against duplicate generation: only start if task is still pending
-    if task.status == "pending":
-        task.status = "starting"  # Mark immediately to prevent re-entry
+    def frame(seq: int, event: dict, data: str | None, legacy_results: dict[str, dict]) -> str:
+        if protocol >= 2:
+            return f"id: {seq}\ndata: {data or json.dumps(event, ensure_ascii=False)}\n\n"
+        legacy = _legacy_event(event, legacy_results)
+        return f"id: {seq}\ndata: {json.dumps(legacy, ensure_ascii=False)}\n\n"
+
+    bus = task_events.get(task_id)
+    in_progress = task.status not in ("completed", "partial", "failed")
+    if bus is None and in_progress and job_queue.queue_enabled() and task.user_id:
+        # Running (or queued) in a worker process — follow it through the DB
+        async def poll_stream():
+            legacy_results: dict[str, dict] = {}
+            seq = 0
+            async for event in generation_service.poll_task_events(task_id):
+                seq += 1
+                event["seq"] = seq
+                yield frame(seq, event, None, legacy_results)
+
+        return _sse_response(poll_stream())
+
+    if bus is None and task.status == "pending":
+        # Not started yet (e.g. reloaded from DB) — start it now
+        generation_service.start_generation_job(task_id)
+        bus = task_events.get(task_id)
+
+    if bus is not None:
+        try:
+            cursor = last_event_id or resume_from
+            resume_after = int(cursor) if cursor else None
+        except ValueError:
+            resume_after = None
 
         async def event_stream():
-            async for event in generation_service.run_generation(task_id):
-                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
-
-        return StreamingResponse(
-            event_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
-        )
-    elif task.status in ("starting", "running"):
-        # Already generating — return 409 to prevent duplicate generation
-        raise HTTPException(
-            status_code=409,
-            detail="Generation already in progress for this task",
-        )
+            legacy_results: dict[str, dict] = {}
+            async for item in bus.subscribe(resume_after, heartbeat=config.SSE_HEARTBEAT_SECONDS):
+                if item is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield frame(item.seq, item.event, item.data, legacy_results)
+
+        return _sse_response(event_stream())
+
+    # No job in this process — report the task's current state directly
+    results_payload = generation_service._build_results_payload(task_id, task.results)
+    if task.status in ("starting", "running"):
+        snapshot = {
+            "event": "progress",
+            "task_id": task_id,
+            "progress": task.progress,
+            "total": task.total,
+            "results": results_payload,
+        }
     else:
-        # Task already completed/failed/partial — return final results directly
-        results_payload = generation_service._build_results_payload(task_id, task.results)
-        final_event = {
+        snapshot = {
             "event": "completed",
             "task_id": task_id,
             "status": task.status,
@@ -248,28 +316,21 @@ async def generation_status_sse(task_id: str):
             "total": task.total,
             "results": results_payload,
         }
+    if protocol >= 2:
+        snapshot.update(v=generation_service.EVENT_PROTOCOL_VERSION, snapshot=True)
+        if snapshot["event"] == "progress":
+            snapshot["event"] = "snapshot"
 
-        async def done_stream():
-            yield f"data: {json.dumps(final_event, ensure_ascii=False)}\n\n"
-
-        return StreamingResponse(
-            done_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no",
-            },
-        )
+    async def done_stream():
+        yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return _sse_response(done_stream())
 
 
 @router.get("/generate/{task_id}/results", response_model=GenerateResultResponse)
 async def get_results(task_id: str):
     """Get generation results."""
-    task = generation_service.get_task(task_id)
-    # Fallback: try loading from DB if not in memory
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -280,6 +341,7 @@ async def get_results(task_id: str):
             template_name=r.template_name,
             status=ImageStatus(r.status.value),
             url=f"/api/outputs/{task_id}/{r.template_id}.png" if r.output_path else None,
+            thumbnail_url=thumbnails.thumbnail_url(task_id, r.template_id) if r.output_path else None,
             error=r.error,
         ))
 
@@ -295,38 +357,25 @@ async def get_results(task_id: str):
 @router.get("/download/{task_id}")
 async def download_all(task_id: str, platform: str = "general"):
     """Download all generated images as a zip file, optionally resized for platform."""
-    task = generation_service.get_task(task_id)
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
     spec = PLATFORM_SPECS.get(platform, PLATFORM_SPECS["general"])
-    task_output_dir = OUTPUT_DIR / task_id
-
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for r in task.results:
-            if r.output_path and Path(r.output_path).exists():
-                img = Image.open(r.output_path)
-                # Contain resize: fit within target size, then center on white bg
-                target_w, target_h = spec.width, spec.height
-                img.thumbnail((target_w, target_h), Image.LANCZOS)
-                canvas = Image.new("RGB", (target_w, target_h), (255, 255, 255))
-                paste_x = (target_w - img.width) // 2
-                paste_y = (target_h - img.height) // 2
-                # Handle RGBA images (from background removal)
-                if img.mode == "RGBA":
-                    canvas.paste(img, (paste_x, paste_y), img)
-                else:
-                    canvas.paste(img, (paste_x, paste_y))
-                img_buf = io.BytesIO()
-                canvas.save(img_buf, format="PNG")
-                zf.writestr(f"{r.template_id}_{target_w}x{target_h}.png", img_buf.getvalue())
-
-    buf.seek(0)
+    target_w, target_h = spec.width, spec.height
+
+    # Renditions come from the rendition cache (resized in parallel on the
+    # export pool on a miss); streamed as each entry is ready
+    entries = [
+        ZipEntry(
+            f"{r.template_id}_{target_w}x{target_h}.png",
+            functools.partial(rendition_cache.get, Path(r.output_path), target_w, target_h),
+        )
+        for r in task.results
+        if r.output_path
+    ]
     return StreamingResponse(
-        buf,
+        stream_zip(entries),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename=product_images_{task_id}_{platform}.zip",
@@ -342,9 +391,7 @@ async def regenerate_image(
     user: User | None = Depends(get_optional_user),
 ):
     """Regenerate a single image within an existing task. Works with or without authentication."""
-    task = generation_service.get_task(task_id)
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -365,13 +412,7 @@ async def regenerate_image(
             template_id=request.template_id,
             custom_prompt=request.custom_prompt,
         )
-        return {
-            "template_id": result.template_id,
-            "template_name": result.template_name,
-            "status": result.status.value,
-            "url": f"/api/outputs/{task_id}/{result.template_id}.png" if result.output_path else None,
-            "error": result.error,
-        }
+        return generation_service._image_payload(task_id, result)
     except Exception as e:
         # Refund credit on failure (only if user is logged in)
         if user:
@@ -394,9 +435,7 @@ async def generate_variants(
     user: User | None = Depends(get_optional_user),
 ):
     """Generate 4 variant images for a single template. Works with or without authentication."""
-    task = generation_service.get_task(task_id)
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -428,9 +467,7 @@ async def generate_variants(
 @router.post("/generate/{task_id}/select-variant")
 async def select_variant(task_id: str, request: dict):
     """Select a variant to replace the main image."""
-    task = generation_service.get_task(task_id)
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -445,33 +482,34 @@ async def select_variant(task_id: str, request: dict):
             template_id=template_id,
             variant_index=variant_index,
         )
-        return {
-            "template_id": result.template_id,
-            "template_name": result.template_name,
-            "status": result.status.value,
-            "url": f"/api/outputs/{task_id}/{result.template_id}.png" if result.output_path else None,
-            "error": result.error,
-        }
+        return generation_service._image_payload(task_id, result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/composite/{task_id}")
 async def composite_grid(task_id: str, request: CompositeRequest):
-    """Composite all completed images into a single grid image (server-side)."""
-    import math
+    """Composite all completed images into a single grid image (server-side).
 
-    task = generation_service.get_task(task_id)
-    if not task:
-        task = await generation_service.get_task_from_db(task_id)
+    Rendered on the export process pool and cached by the images' content
+    hashes and every layout parameter, so repeat requests are served from
+    a file.
+    """
+    task = await generation_service.load_task(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
+    if request.format not in image_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {request.format}")
+    if not (MIN_COMPOSITE_CELL <= request.cell_size <= MAX_COMPOSITE_CELL) or not (0 <= request.gap <= MAX_COMPOSITE_GAP):
+        raise HTTPException(status_code=400, detail="Invalid cell_size or gap")
+
     # Collect completed images in the requested order
     completed = {
         r.template_id: r
         for r in task.results
-        if r.status.value == "completed" and r.output_path and Path(r.output_path).exists()
+        if r.status.value == "completed" and r.output_path
+        and await output_storage.locate(Path(r.output_path)) is not None
     }
     if not completed:
         raise HTTPException(status_code=400, detail="No completed images to composite")
@@ -481,127 +519,29 @@ async def composite_grid(task_id: str, request: CompositeRequest):
         ordered_ids = [tid for tid in request.image_order if tid in completed]
     else:
         ordered_ids = list(completed.keys())
-
-    count = min(len(ordered_ids), 9)
-    if count == 0:
+    if not ordered_ids:
         raise HTTPException(status_code=400, detail="No valid images for composite")
 
-    cell = request.cell_size
-    gap = request.gap
-    cols = 3
-    layout = request.layout
-
     # Parse background color
     bg_hex = request.bg_color.lstrip("#")
     try:
-        bg_r, bg_g, bg_b = int(bg_hex[0:2], 16), int(bg_hex[2:4], 16), int(bg_hex[4:6], 16)
+        bg = (int(bg_hex[0:2], 16), int(bg_hex[2:4], 16), int(bg_hex[4:6], 16))
     except (ValueError, IndexError):
-        bg_r, bg_g, bg_b = 255, 255, 255
-
-    # --- detail_long: true vertical long image (single column, preserve aspect ratio) ---
-    if layout == "detail_long":
-        target_w = cell  # uniform width (e.g. 800px)
-        # First pass: load & resize all images to target_w, collect heights
-        resized_images: list[Image.Image] = []
-        for i in range(count):
-            tid = ordered_ids[i]
-            r = completed[tid]
-            try:
-                img = Image.open(r.output_path)
-                if img.mode == "RGBA":
-                    bg_img = Image.new("RGB", img.size, (bg_r, bg_g, bg_b))
-                    bg_img.paste(img, mask=img)
-                    img = bg_img
-                elif img.mode != "RGB":
-                    img = img.convert("RGB")
-                # Scale width to target_w, keep aspect ratio
-                scale = target_w / img.width
-                new_h = int(img.height * scale)
-                img = img.resize((target_w, new_h), Image.LANCZOS)
-                resized_images.append(img)
-            except Exception:
-                continue
-
-        if not resized_images:
-            raise HTTPException(status_code=400, detail="No valid images for composite")
-
-        total_h = sum(im.height for im in resized_images) + gap * (len(resized_images) - 1)
-        canvas = Image.new("RGB", (target_w, total_h), (bg_r, bg_g, bg_b))
-        y_offset = 0
-        for im in resized_images:
-            canvas.paste(im, (0, y_offset))
-            y_offset += im.height + gap
-
-    else:
-        # --- grid3x3 & hero_center ---
-        if layout == "hero_center":
-            rows = 3
-        else:
-            rows = math.ceil(count / cols)
-
-        total_w = cols * cell + (cols - 1) * gap
-        total_h = rows * cell + (rows - 1) * gap
-        canvas = Image.new("RGB", (total_w, total_h), (bg_r, bg_g, bg_b))
-
-        for i in range(count):
-            tid = ordered_ids[i]
-            r = completed[tid]
-
-            try:
-                img = Image.open(r.output_path)
-                if img.mode == "RGBA":
-                    bg_img = Image.new("RGB", img.size, (bg_r, bg_g, bg_b))
-                    bg_img.paste(img, mask=img)
-                    img = bg_img
-                elif img.mode != "RGB":
-                    img = img.convert("RGB")
-            except Exception:
-                continue
-
-            if layout == "hero_center" and i == 0:
-                w = cell * 2 + gap
-                h = cell * 2 + gap
-                col, row = 0, 0
-            elif layout == "hero_center" and i > 0:
-                positions = [
-                    (2, 0), (2, 1), (2, 2),
-                    (0, 2), (1, 2),
-                ]
-                pos_idx = (i - 1) % len(positions)
-                col, row = positions[pos_idx]
-                w, h = cell, cell
-            else:
-                col = i % cols
-                row = i // cols
-                w, h = cell, cell
-
-            x = col * (cell + gap)
-            y = row * (cell + gap)
-
-            # Cover-fit the image into the cell
-            scale = max(w / img.width, h / img.height)
-            new_w = int(img.width * scale)
-            new_h = int(img.height * scale)
-            img = img.resize((new_w, new_h), Image.LANCZOS)
-            left = (new_w - w) // 2
-            top = (new_h - h) // 2
-            img = img.crop((left, top, left + w, top + h))
-
-            canvas.paste(img, (x, y))
-
-    # Save to buffer
-    buf = io.BytesIO()
-    canvas.save(buf, format="PNG", quality=95)
-    buf.seek(0)
-
-    filename = f"composite_{task_id}_{layout}.png"
-    return StreamingResponse(
-        buf,
-        media_type="image/png",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}",
-        },
+        bg = (255, 255, 255)
+
+    path = await rendition_cache.get_composite(
+        [Path(completed[tid].output_path) for tid in ordered_ids[:9]],
+        request.layout,
+        request.cell_size,
+        request.gap,
+        bg,
+        request.format,
     )
+    if path is None:
+        raise HTTPException(status_code=400, detail="No valid images for composite")
+
+    filename = f"composite_{task_id}_{request.layout}.{image_export.EXTENSIONS[request.format]}"
+    return FileResponse(path, media_type=image_export.MEDIA_TYPES[request.format], filename=filename)
 
 
 @router.get("/platforms")
@@ -7,6 +7,8 @@ cross-device accessible records.
 
 from __future__ import annotations
 
+import asyncio
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from sqlalchemy import func, select
@@ -17,6 +19,7 @@ from app.config import OUTPUT_DIR
 from app.database import get_db
 from app.models.db_models import GeneratedImage as GeneratedImageModel
 from app.models.db_models import GenerationJob, User
+from app.services import thumbnails
 
 router = APIRouter(prefix="/api", tags=["history"])
 
@@ -56,6 +59,7 @@ class HistoryImageResponse(BaseModel):
     template_name: str
     status: str
     url: str | None
+    thumbnail_url: str | None = None
     error: str | None
 
 
@@ -96,17 +100,17 @@ async def get_history(
     )
     jobs = list(result.scalars().all())
 
-    items = []
-    for job in jobs:
-        # Find first completed image for thumbnail
-        first_image_url = None
-        if job.images:
-            for img in job.images:
-                if img.status == "completed" and img.output_path:
-                    first_image_url = f"/api/outputs/{job.id}/{img.template_id}.png"
-                    break
-
-        items.append(HistoryItemResponse(
+    async def first_image_url(job: GenerationJob) -> str | None:
+        # Thumbnail of the first completed image, versioned so browsers keep it
+        for img in job.images or []:
+            if img.status == "completed" and img.output_path:
+                return await thumbnails.versioned_url(job.id, img.template_id)
+        return None
+
+    first_urls = await asyncio.gather(*(first_image_url(job) for job in jobs))
+
+    items = [
+        HistoryItemResponse(
             job_id=job.id,
             product_type=job.product_type,
             style=job.style,
@@ -115,8 +119,10 @@ async def get_history(
             completed_images=job.completed_images,
             credits_charged=job.credits_charged,
             created_at=job.created_at.isoformat(),
-            first_image_url=first_image_url,
-        ))
+            first_image_url=url,
+        )
+        for job, url in zip(jobs, first_urls)
+    ]
 
     return PaginatedHistoryResponse(
         items=items,
@@ -141,12 +147,18 @@ async def get_history_detail(
     if not job:
         raise HTTPException(status_code=404, detail="生成記錄未找到")
 
+    completed = [img for img in (job.images or []) if img.status == "completed" and img.output_path]
+    thumbs = dict(zip(
+        [img.template_id for img in completed],
+        await asyncio.gather(*(thumbnails.versioned_url(job.id, img.template_id) for img in completed)),
+    ))
     images = [
         HistoryImageResponse(
             template_id=img.template_id,
             template_name=img.template_name,
             status=img.status,
             url=f"/api/outputs/{job.id}/{img.template_id}.png" if img.status == "completed" and img.output_path else None,
+            thumbnail_url=thumbs.get(img.template_id),
             error=img.error,
         )
         for img in (job.images or [])
@@ -0,0 +1,91 @@
+"""
+Outputs router: generated images at full size or as on-demand thumbnails.
+
+Serves /api/outputs/{task_id}/{filename} ahead of the static mount.
+Responses carry a strong ETag derived from the file's content hash, so
+revalidation costs a 304; URLs whose ``v`` matches the file's current
+version (see app.services.thumbnails) are marked immutable. ``w`` and /
+or ``fmt`` return a cached, downscaled / converted copy.
+
+Outputs are stored as WebP / AVIF / JPEG masters (see
+app.services.output_storage); a ``.png`` URL is answered with PNG,
+materialized on first request and cached like a thumbnail. When renders
+are saturated and the stored file is not in the requested format, the
+response is 503 with Retry-After.
+"""
+
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+
+from app.config import OUTPUT_DIR, OUTPUT_IMMUTABLE_MAX_AGE, THUMBNAIL_WIDTHS
+from app.services import image_export, output_storage, rendition_cache, thumbnails
+
+router = APIRouter(prefix="/api/outputs", tags=["outputs"])
+
+# Retry-After of a 503 when thumbnail renders are saturated
+THUMBNAIL_RETRY_AFTER_SECONDS = 2
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+@router.get("/{task_id}/{filename}")
+async def get_output(
+    task_id: str,
+    filename: str,
+    request: Request,
+    w: int | None = Query(None, ge=1, le=THUMBNAIL_WIDTHS[-1]),
+    fmt: str | None = Query(None),
+    v: str | None = Query(None),
+):
+    """Serve a generated image, optionally resized (?w=) or converted (?fmt=)."""
+    # Cache directories (.renditions, .thumbnails, ...) are not outputs
+    if task_id.startswith(".") or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="圖片未找到")
+
+    source = OUTPUT_DIR / task_id / filename
+    stored = await output_storage.locate(source)
+    digest = await rendition_cache.source_digest(stored) if stored is not None else None
+    if digest is None:
+        raise HTTPException(status_code=404, detail="圖片未找到")
+
+    width = thumbnails.snap_width(w) if w is not None else None
+    # The URL's extension asks for that format; the stored master is served as is
+    want = fmt or output_storage.format_of(source) or "png"
+    derived = width is not None or want != output_storage.format_of(stored)
+    if derived and want not in image_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的格式: {want}")
+    etag = f'"{digest[:32]}-{width or "full"}.{want}"' if derived else f'"{digest[:32]}"'
+    immutable = v is not None and v == await thumbnails.output_version(source)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={OUTPUT_IMMUTABLE_MAX_AGE}, immutable" if immutable else "no-cache",
+    }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if not derived:
+        return FileResponse(stored, headers=headers)
+
+    try:
+        path = await thumbnails.get(source, width, want)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="圖片未找到")
+    if path is None:
+        # Thumbnail workers saturated: the stored file if it is in the format
+        # asked for (full size now, a thumbnail next time), else retry later
+        if output_storage.format_of(stored) == want:
+            return FileResponse(stored, headers={"Cache-Control": "no-store"})
+        raise HTTPException(
+            status_code=503,
+            detail="縮圖產生忙碌中，請稍後再試",
+            headers={"Retry-After": str(THUMBNAIL_RETRY_AFTER_SECONDS)},
+        )
+    return FileResponse(path, media_type=image_export.MEDIA_TYPES[want], headers=headers)
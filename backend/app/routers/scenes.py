@@ -26,6 +26,7 @@ from app.models.schemas import (
     SceneListResponse,
     StyleReferenceResponse,
 )
+from app.services import storage_io
 
 router = APIRouter(prefix="/api/scenes", tags=["scenes"])
 
@@ -128,7 +129,7 @@ async def upload_style_reference(
     reference_id = uuid.uuid4().hex[:12]
     filename = f"styleref_{reference_id}{ext}"
     file_path = UPLOAD_DIR / filename
-    file_path.write_bytes(content)
+    await storage_io.write_bytes(file_path, content)
 
     # Mock extracted style info
     mock_style_info = {
@@ -1,8 +1,7 @@
 from __future__ import annotations
 
-import asyncio
-import functools
 import io
+import re
 import uuid
 from pathlib import Path
 
@@ -14,11 +13,18 @@ from app.auth import get_optional_user
 from app.config import ALLOWED_EXTENSIONS, MAX_UPLOAD_SIZE, UPLOAD_DIR
 from app.database import get_db
 from app.models.db_models import UploadedImage, User
-from app.models.schemas import RemoveBgResponse, UploadResponse
-from app.services.background_removal import remove_background
+from app.models.schemas import (
+    RemoveBgBatchRequest,
+    RemoveBgBatchResponse,
+    RemoveBgResponse,
+    UploadResponse,
+)
+from app.services import background_removal, storage_io
 
 router = APIRouter(prefix="/api", tags=["upload"])
 
+_UPLOAD_ID = re.compile(r"[A-Za-z0-9_-]+")
+
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_image(
@@ -57,7 +63,7 @@ async def upload_image(
     image_id = uuid.uuid4().hex[:12]
     filename = f"{image_id}{ext}"
     file_path = UPLOAD_DIR / filename
-    file_path.write_bytes(content)
+    await storage_io.write_bytes(file_path, content)
 
     # Persist upload record to DB (only if user is logged in)
     if user:
@@ -80,6 +86,72 @@ async def upload_image(
     )
 
 
+async def _record_nobg(db: AsyncSession, user: User | None, paths: dict[str, Path]) -> None:
+    """Update DB records with nobg_path (only if user is logged in)."""
+    if not user or not paths:
+        return
+    try:
+        from sqlalchemy import update
+        from app.models.db_models import UploadedImage as UploadedImageModel
+        for image_id, output_path in paths.items():
+            await db.execute(
+                update(UploadedImageModel)
+                .where(UploadedImageModel.id == image_id)
+                .values(nobg_path=str(output_path))
+            )
+        await db.commit()
+    except Exception:
+        pass  # Non-critical
+
+
+def _find_upload(image_id: str) -> Path | None:
+    if not _UPLOAD_ID.fullmatch(image_id):
+        return None  # keep glob patterns ("..", "/", "*") out of UPLOAD_DIR
+    matching = [p for p in UPLOAD_DIR.glob(f"{image_id}.*") if "_nobg" not in p.name]
+    return matching[0] if matching else None
+
+
+@router.post("/remove-bg/batch", response_model=RemoveBgBatchResponse)
+async def remove_bg_batch(
+    request: RemoveBgBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    user: User | None = Depends(get_optional_user),
+):
+    """Remove background from several uploaded images in batched inference calls."""
+    inputs: dict[str, Path] = {}
+    failed: list[str] = []
+    for image_id in dict.fromkeys(request.image_ids):
+        input_path = _find_upload(image_id)
+        if input_path is None:
+            failed.append(image_id)
+        else:
+            inputs[image_id] = input_path
+
+    datas = [await storage_io.read_bytes(path) for path in inputs.values()]
+    try:
+        pngs = await background_removal.remove_many(datas)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Background removal failed: {e}")
+
+    results: list[RemoveBgResponse] = []
+    outputs: dict[str, Path] = {}
+    for (image_id, input_path), png in zip(inputs.items(), pngs):
+        if png is None:
+            failed.append(image_id)
+            continue
+        output_filename = f"{image_id}_nobg.png"
+        outputs[image_id] = UPLOAD_DIR / output_filename
+        await storage_io.write_bytes(outputs[image_id], png)
+        results.append(RemoveBgResponse(
+            image_id=image_id,
+            original_url=f"/api/uploads/{input_path.name}",
+            removed_bg_url=f"/api/uploads/{output_filename}",
+        ))
+
+    await _record_nobg(db, user, outputs)
+    return RemoveBgBatchResponse(results=results, failed=failed)
+
+
 @router.post("/remove-bg/{image_id}", response_model=RemoveBgResponse)
 async def remove_bg(
     image_id: str,
@@ -88,36 +160,20 @@ async def remove_bg(
 ):
     """Remove background from uploaded image. Works with or without authentication."""
     # Find the uploaded image
-    matching = list(UPLOAD_DIR.glob(f"{image_id}.*"))
-    if not matching:
+    input_path = _find_upload(image_id)
+    if input_path is None:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    input_path = matching[0]
     output_filename = f"{image_id}_nobg.png"
     output_path = UPLOAD_DIR / output_filename
 
     try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            None,
-            functools.partial(remove_background, input_path, output_path),
-        )
+        png = await background_removal.cut_out(await storage_io.read_bytes(input_path))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Background removal failed: {e}")
+    await storage_io.write_bytes(output_path, png)
 
-    # Update DB record with nobg_path (only if user is logged in)
-    if user:
-        try:
-            from sqlalchemy import update
-            from app.models.db_models import UploadedImage as UploadedImageModel
-            await db.execute(
-                update(UploadedImageModel)
-                .where(UploadedImageModel.id == image_id)
-                .values(nobg_path=str(output_path))
-            )
-            await db.commit()
-        except Exception:
-            pass  # Non-critical
+    await _record_nobg(db, user, {image_id: output_path})
 
     return RemoveBgResponse(
         image_id=image_id,
@@ -1,34 +1,430 @@
+"""
+Background removal with persistent rembg / ONNX Runtime sessions.
+
+rembg.remove() without a session builds the model's session inside the
+call, so every request paid model setup. Sessions are now created once
+per model — at startup by warm_up(), or lazily on first use — and reused
+from a small pool: up to REMBG_SESSIONS sessions, each running inference
+on REMBG_INTRA_OP_THREADS threads, so concurrent calls (one per "rembg"
+executor worker) split the cores instead of oversubscribing them.
+
+REMBG_MODEL picks the speed / quality tier:
+- "u2netp"  — smallest and fastest, rougher edges
+- "silueta" — u2net quality in a much smaller model
+- "u2net"   — general-purpose default
+- "isnet"   — isnet-general-use, cleanest edges, slowest
+Any other rembg model name works as well.
+
+Inference runs on the "rembg" process pool (PROCESS_EXECUTOR_WORKERS),
+so it no longer competes for the GIL with Pillow work and the event loop.
+Each worker holds one session, loaded and warmed by the pool initializer
+when the worker starts; a worker that grows past REMBG_WORKER_MAX_MB is
+replaced. REMBG_PROCESS_WORKERS=0 keeps the in-process thread pool.
+
+remove_many() sends images to the workers in chunks of REMBG_BATCH_SIZE;
+for the models in BATCH_PREPROCESSING whose ONNX input takes a dynamic
+batch size, a chunk is one inference call. Results come back as PNG bytes.
+
+Warm-up time, session setup time and per-call latency are kept per model
+and reported by stats() (/api/health/rembg).
+
+Usage:
+    png_bytes = await background_removal.cut_out(image_bytes)
+    results = await background_removal.remove_many([a, b, c], model="u2netp")  # PNG bytes or None
+    png_bytes = remove_background_bytes(image_bytes, model="u2netp")  # blocking
+"""
+
 from __future__ import annotations
 
+import asyncio
 import io
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
+from typing import Iterator
 
-from PIL import Image
-from rembg import remove
+import numpy as np
+import onnxruntime as ort
+from PIL import Image, UnidentifiedImageError
+from rembg import new_session, remove
+from rembg.bg import fix_image_orientation, naive_cutout
+from rembg.sessions.base import BaseSession
 
+from app.config import (
+    PROCESS_EXECUTOR_WORKERS,
+    REMBG_BATCH_SIZE,
+    REMBG_INTRA_OP_THREADS,
+    REMBG_MODEL,
+    REMBG_SESSIONS,
+    REMBG_WARMUP,
+    REMBG_WORKER_MAX_MB,
+)
+from app.services import executors
+
+logger = logging.getLogger(__name__)
+
+MODEL_ALIASES = {"isnet": "isnet-general-use"}
+
+# Number of recent call latencies kept per model
+LATENCY_SAMPLE_SIZE = 200
+
+WARMUP_IMAGE_SIZE = (320, 320)
+
+# Normalization mean, std and input size of the models whose masks are
+# computed here for a whole batch (mirroring their rembg predict()); any
+# other model runs one image per inference call
+_U2NET_PREPROCESSING = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))
+BATCH_PREPROCESSING = {
+    "u2net": _U2NET_PREPROCESSING,
+    "u2netp": _U2NET_PREPROCESSING,
+    "silueta": _U2NET_PREPROCESSING,
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+# Set in rembg worker processes, which hold a single session each
+_in_worker = False
+
+
+def model_name(model: str | None = None) -> str:
+    name = model or REMBG_MODEL
+    return MODEL_ALIASES.get(name, name)
+
+
+class SessionPool:
+    """Up to ``size`` rembg sessions of one model, created on demand and reused."""
+
+    def __init__(self, model: str, size: int, intra_op_threads: int):
+        self.model = model
+        self.size = max(1, size)
+        self.intra_op_threads = max(1, intra_op_threads)
+        self._idle: queue.LifoQueue[BaseSession] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.setup_ms: list[float] = []
+        self.warmup_ms: float | None = None
+        self.calls = 0
+        self.failed = 0
+        self.waits = 0
+        self.batches = 0
+        self.batched_images = 0
+        self._batchable: bool | None = None
+        self._latency: deque[float] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+    def _new_session(self) -> BaseSession:
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.intra_op_threads
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        started = time.perf_counter()
+        session = new_session(self.model, sess_opts=opts)
+        setup_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.setup_ms.append(round(setup_ms, 1))
+        logger.info(
+            f"rembg session {len(self.setup_ms)}/{self.size} for {self.model} ready in "
+            f"{setup_ms:.0f}ms ({self.intra_op_threads} intra-op threads)"
+        )
+        return session
+
+    @contextmanager
+    def session(self) -> Iterator[BaseSession]:
+        """Borrow a session, creating one if the pool is not full yet."""
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+                else:
+                    self.waits += 1
+            if create:
+                try:
+                    session = self._new_session()
+                except BaseException:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+            else:
+                session = self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def remove(self, img: Image.Image) -> Image.Image:
+        with self.session() as session:
+            started = time.perf_counter()
+            try:
+                return remove(img, session=session)
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.calls += 1
+                    self._latency.append((time.perf_counter() - started) * 1000)
+
+    def _batch_input(self, session: BaseSession) -> str | None:
+        """Input name if ``session`` takes several images per run, else None."""
+        model_input = session.inner_session.get_inputs()[0]
+        if self._batchable is None:
+            # A fixed batch dimension is an int; dynamic ones are named or None
+            self._batchable = self.model in BATCH_PREPROCESSING and not isinstance(model_input.shape[0], int)
+        return model_input.name if self._batchable else None
+
+    def _predict_batch(self, session: BaseSession, name: str, images: list[Image.Image]) -> list[Image.Image]:
+        mean, std, size = BATCH_PREPROCESSING[self.model]
+        inputs = np.concatenate([session.normalize(img, mean, std, size)[name] for img in images])
+        preds = session.inner_session.run(None, {name: inputs})[0][:, 0, :, :]
+        masks = []
+        for img, pred in zip(images, preds):
+            lo, hi = pred.min(), pred.max()
+            pred = (pred - lo) / max(hi - lo, 1e-6)
+            mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+            masks.append(mask.resize(img.size, Image.Resampling.LANCZOS))
+        return masks
+
+    def remove_batch(self, images: list[Image.Image]) -> list[Image.Image]:
+        """Cut out several images on one session, in one inference call if the model allows."""
+        with self.session() as session:
+            started = time.perf_counter()
+            try:
+                name = self._batch_input(session)
+                if name is None or len(images) == 1:
+                    return [remove(img, session=session) for img in images]
+                images = [fix_image_orientation(img) for img in images]
+                masks = self._predict_batch(session, name, images)
+                with self._lock:
+                    self.batches += 1
+                    self.batched_images += len(images)
+                return [naive_cutout(img, mask) for img, mask in zip(images, masks)]
+            except BaseException:
+                with self._lock:
+                    self.failed += len(images)
+                raise
+            finally:
+                per_image = (time.perf_counter() - started) * 1000 / max(1, len(images))
+                with self._lock:
+                    self.calls += len(images)
+                    self._latency.extend([per_image] * len(images))
+
+    def warm_up(self) -> float:
+        """Fill the pool and run one inference per session; returns the time taken in ms."""
+        started = time.perf_counter()
+        blank = Image.new("RGB", WARMUP_IMAGE_SIZE, (255, 255, 255))
+        with ExitStack() as stack:
+            sessions = [stack.enter_context(self.session()) for _ in range(self.size)]
+            for session in sessions:
+                remove(blank, session=session)
+        self.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"rembg {self.model} warmed up: {self.size} sessions in {self.warmup_ms:.0f}ms")
+        return self.warmup_ms
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sorted(self._latency)
+            n = len(samples)
+            return {
+                "sessions": self.created,
+                "max_sessions": self.size,
+                "intra_op_threads": self.intra_op_threads,
+                "idle": self._idle.qsize(),
+                "setup_ms": list(self.setup_ms),
+                "warmup_ms": self.warmup_ms,
+                "calls": self.calls,
+                "failed": self.failed,
+                "waits": self.waits,
+                "batches": self.batches,
+                "batched_images": self.batched_images,
+                "batchable": self._batchable,
+                "latency_ms": {
+                    "avg": round(sum(samples) / n, 1) if n else 0.0,
+                    "p95": round(samples[min(n - 1, int(n * 0.95))], 1) if n else 0.0,
+                    "max": round(samples[-1], 1) if n else 0.0,
+                },
+            }
+
+
+_pools: dict[str, SessionPool] = {}
+_pools_lock = threading.Lock()
+_warmup_task: asyncio.Task | None = None
+_worker_pids: dict[int, float | None] = {}
+_requests = {"calls": 0, "images": 0, "failed": 0}
+
+
+def get_pool(model: str | None = None) -> SessionPool:
+    """Get (or lazily create) the session pool of a model (REMBG_MODEL by default)."""
+    name = model_name(model)
+    pool = _pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = SessionPool(name, 1 if _in_worker else REMBG_SESSIONS, REMBG_INTRA_OP_THREADS)
+                _pools[name] = pool
+    return pool
 
-def remove_background(input_path: Path, output_path: Path) -> Path:
-    """Remove background from product image using rembg."""
-    input_image = Image.open(input_path)
-    output_image = remove(input_image)
 
+def _to_rgba(image: Image.Image) -> Image.Image:
     # Ensure RGBA for transparency
-    if output_image.mode != "RGBA":
-        output_image = output_image.convert("RGBA")
+    return image if image.mode == "RGBA" else image.convert("RGBA")
+
+
+def _cut_out(input_image: Image.Image, model: str | None) -> Image.Image:
+    return _to_rgba(get_pool(model).remove(input_image))
+
+
+def remove_background(input_path: Path, output_path: Path, model: str | None = None) -> Path:
+    """Remove background from product image using rembg."""
+    input_image = Image.open(input_path)
+    output_image = _cut_out(input_image, model)
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     output_image.save(output_path, format="PNG")
     return output_path
 
 
-def remove_background_bytes(image_bytes: bytes) -> bytes:
+def remove_background_bytes(image_bytes: bytes, model: str | None = None) -> bytes:
     """Remove background from image bytes, return PNG bytes."""
     input_image = Image.open(io.BytesIO(image_bytes))
-    output_image = remove(input_image)
-
-    if output_image.mode != "RGBA":
-        output_image = output_image.convert("RGBA")
+    output_image = _cut_out(input_image, model)
 
     buf = io.BytesIO()
     output_image.save(buf, format="PNG")
     return buf.getvalue()
+
+
+def remove_background_batch(images: list[bytes], model: str | None = None) -> list[bytes | None]:
+    """Remove the background of several images (blocking); PNG bytes, None if undecodable.
+
+    Runs in a "rembg" worker: images go through the session REMBG_BATCH_SIZE
+    at a time.
+    """
+    decoded: list[Image.Image | None] = []
+    for data in images:
+        try:
+            img = Image.open(io.BytesIO(data))
+            img.load()
+            decoded.append(img)
+        except (UnidentifiedImageError, OSError, ValueError) as e:
+            logger.warning(f"Skipping undecodable image in rembg batch: {e}")
+            decoded.append(None)
+
+    valid = [img for img in decoded if img is not None]
+    pool = get_pool(model)
+    cutouts: list[Image.Image] = []
+    for start in range(0, len(valid), REMBG_BATCH_SIZE):
+        cutouts.extend(pool.remove_batch(valid[start:start + REMBG_BATCH_SIZE]))
+
+    results: list[bytes | None] = []
+    produced = iter(cutouts)
+    for img in decoded:
+        if img is None:
+            results.append(None)
+            continue
+        buf = io.BytesIO()
+        _to_rgba(next(produced)).save(buf, format="PNG")
+        results.append(buf.getvalue())
+    return results
+
+
+async def remove_many(images: list[bytes], model: str | None = None) -> list[bytes | None]:
+    """Remove the background of ``images`` on the "rembg" workers, in input order.
+
+    Chunks of REMBG_BATCH_SIZE run in parallel across the workers; an
+    undecodable image gives None, an inference failure raises.
+    """
+    chunks = [images[i:i + REMBG_BATCH_SIZE] for i in range(0, len(images), REMBG_BATCH_SIZE)]
+    _requests["calls"] += 1
+    _requests["images"] += len(images)
+    try:
+        done = await asyncio.gather(*(
+            executors.run_in_process("rembg", remove_background_batch, chunk, model) for chunk in chunks
+        ))
+    except Exception:
+        _requests["failed"] += 1
+        raise
+    return [png for chunk in done for png in chunk]
+
+
+async def cut_out(image_bytes: bytes, model: str | None = None) -> bytes:
+    """Remove the background of one image on the "rembg" workers; PNG bytes.
+
+    Raises ValueError if the image cannot be decoded.
+    """
+    png = (await remove_many([image_bytes], model))[0]
+    if png is None:
+        raise ValueError("cannot decode image")
+    return png
+
+
+def warm_up(model: str | None = None) -> float:
+    """Create a model's sessions and run a first inference (blocking)."""
+    return get_pool(model).warm_up()
+
+
+def _init_worker(model: str, warm: bool) -> None:
+    """Process-pool initializer: one session per worker, loaded before any request."""
+    global _in_worker
+    _in_worker = True
+    if not warm:
+        return
+    try:
+        warm_up(model)
+    except Exception as e:
+        logger.warning(f"rembg worker warm-up for {model} failed; the session loads on first use: {e}")
+
+
+def _worker_warmup_ms(model: str) -> tuple[int, float | None]:
+    return os.getpid(), get_pool(model).warmup_ms
+
+
+executors.configure_process_pool(
+    "rembg",
+    initializer=_init_worker,
+    initargs=(model_name(), REMBG_WARMUP),
+    max_rss_bytes=REMBG_WORKER_MAX_MB * 1024 * 1024,
+)
+
+
+async def _warm_up_in_background(model: str | None) -> None:
+    workers = PROCESS_EXECUTOR_WORKERS.get("rembg", 0)
+    try:
+        if workers <= 0:
+            await executors.run("rembg", warm_up, model)
+            return
+        # One call per worker so every worker starts (and warms up in its initializer)
+        results = await asyncio.gather(*(
+            executors.run_in_process("rembg", _worker_warmup_ms, model_name(model)) for _ in range(workers)
+        ))
+        _worker_pids.update(results)
+        logger.info(f"rembg {model_name(model)} ready on {len(_worker_pids)} worker processes")
+    except Exception as e:
+        logger.warning(f"rembg warm-up for {model_name(model)} failed; sessions load on first use: {e}")
+
+
+def start_warm_up(model: str | None = None) -> None:
+    """Warm up a model on the "rembg" pool without delaying startup."""
+    global _warmup_task
+    if _warmup_task is None or _warmup_task.done():
+        _warmup_task = asyncio.create_task(_warm_up_in_background(model))
+
+
+def stats() -> dict:
+    """Session pools of this process, plus the worker pool when inference runs in processes."""
+    return {
+        "default_model": model_name(),
+        "batch_size": REMBG_BATCH_SIZE,
+        "requests": dict(_requests),
+        "process_pool": executors.stats().get("rembg:process"),
+        "worker_warmup_ms": {str(pid): ms for pid, ms in _worker_pids.items()},
+        "models": {name: pool.stats() for name, pool in _pools.items()},
+    }
@@ -0,0 +1,219 @@
+"""
+Batch executor: runs a batch's SKUs as a pipeline.
+
+Up to BATCH_SKUS_IN_FLIGHT SKUs of a batch generate at once. Each SKU is
+an ordinary generation job at Priority.BATCH, so all of their template
+requests feed the shared provider slots in app.services.scheduler — the
+scheduler, not the batch, bounds provider concurrency, and interactive
+work still goes first. When one SKU finishes, the next one starts
+immediately instead of waiting for the slowest image of a whole group.
+
+Resumable: finished items are skipped, and an item interrupted while its
+job was running continues that job (unfinished templates only) instead
+of starting a new one. Progress is written per item, so a restart picks
+up from the DB.
+
+ETAs are derived from DB state alone (see estimate_eta), so any API
+process can report them while a worker process runs the batch.
+
+Usage:
+    await batch_runner.run_batch(batch_id)
+    batch_eta, item_etas = batch_runner.estimate_eta(items, jobs)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import select, update
+
+from app.config import BATCH_SKU_SECONDS_ESTIMATE, BATCH_SKUS_IN_FLIGHT
+from app.database import AsyncSessionLocal
+from app.models.db_models import Batch, BatchItem, GenerationJob
+from app.services import generation_service
+from app.services.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+FINISHED_ITEM_STATUSES = ("completed", "failed")
+
+
+async def _set_item(item_id: int, **values) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(BatchItem).where(BatchItem.id == item_id).values(**values))
+        await db.commit()
+
+
+async def _set_batch(batch_id: str, **values) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Batch).where(Batch.id == batch_id).values(**values))
+        await db.commit()
+
+
+async def _run_item(batch: Batch, item: BatchItem) -> bool:
+    """Generate one SKU; True if it produced images."""
+    try:
+        if item.job_id:
+            # Interrupted mid-generation — continue that job
+            job = await generation_service.resume_task(item.job_id, Priority.BATCH)
+            if job is not None:
+                await job
+            task_id = item.job_id
+        else:
+            image_path = Path(item.image_path) if item.image_path else None
+            if not image_path or not image_path.exists():
+                await _set_item(item.id, status="failed", error="圖片檔案未找到")
+                return False
+
+            await _set_item(item.id, status="running")
+            task = generation_service.create_task(
+                image_path=image_path,
+                product_type=item.product_type,
+                style=item.style,
+                user_id=batch.user_id,
+                priority=Priority.BATCH,
+            )
+            await generation_service.persist_task_to_db(task)
+            await _set_item(item.id, job_id=task.task_id)
+
+            # Run generation as a background job and wait for it
+            await generation_service.start_generation_job(task.task_id)
+            task_id = task.task_id
+
+        final_task = await generation_service.load_task(task_id)
+        if final_task and final_task.status in ("completed", "partial"):
+            await _set_item(item.id, status="completed")
+            return True
+        await _set_item(item.id, status="failed", error="生成失敗")
+        return False
+
+    except asyncio.CancelledError:
+        raise  # Shutdown — the item stays resumable
+    except Exception as e:
+        logger.error(f"Batch item {item.sku_name} failed: {e}")
+        await _set_item(item.id, status="failed", error=str(e))
+        return False
+
+
+async def run_batch(batch_id: str, in_flight: int = BATCH_SKUS_IN_FLIGHT) -> None:
+    """Process a batch with up to ``in_flight`` SKUs generating at once."""
+    try:
+        await _set_batch(batch_id, status="running")
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Batch).where(Batch.id == batch_id))
+            batch = result.scalar_one_or_none()
+            if not batch:
+                return
+            items = list(batch.items or [])
+
+        completed = sum(1 for item in items if item.status == "completed")
+        pending = iter([item for item in items if item.status not in FINISHED_ITEM_STATUSES])
+
+        async def lane() -> None:
+            nonlocal completed
+            for item in pending:  # shared iterator: each lane takes the next SKU
+                if await _run_item(batch, item):
+                    completed += 1
+                    await _set_batch(batch_id, completed_skus=completed)
+
+        await asyncio.gather(*(lane() for _ in range(max(1, in_flight))))
+
+        # Final batch status
+        final_status = "completed" if completed == batch.total_skus else (
+            "partial" if completed > 0 else "failed"
+        )
+        await _set_batch(batch_id, status=final_status, completed_skus=completed)
+        logger.info(f"Batch {batch_id} finished: {final_status} ({completed}/{batch.total_skus})")
+
+    except asyncio.CancelledError:
+        logger.warning(f"Batch {batch_id} interrupted; it will resume from its unfinished items")
+        raise
+    except Exception as e:
+        logger.error(f"Batch {batch_id} processing error: {e}")
+        try:
+            await _set_batch(batch_id, status="failed", error_message=str(e))
+        except Exception:
+            pass
+
+
+async def fail_batch(batch_id: str, error: str) -> None:
+    """Finish a batch the work queue gave up on: unfinished items (and their jobs) fail.
+
+    Registered as the "batch" failure hook (see job_queue).
+    """
+    async with AsyncSessionLocal() as db:
+        batch = await db.get(Batch, batch_id)
+        if batch is None or batch.status in ("completed", "partial", "failed"):
+            return
+        items = list(batch.items or [])
+
+    completed = sum(1 for item in items if item.status == "completed")
+    for item in items:
+        if item.status in FINISHED_ITEM_STATUSES:
+            continue
+        if item.job_id:
+            await generation_service.fail_job(item.job_id, error)
+        await _set_item(item.id, status="failed", error=error)
+    final_status = "partial" if completed > 0 else "failed"
+    await _set_batch(batch_id, status=final_status, completed_skus=completed, error_message=error)
+    logger.warning(f"Batch {batch_id} marked {final_status}: {error}")
+
+
+def _utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def estimate_eta(
+    items: list[BatchItem],
+    jobs: dict[str, GenerationJob],
+    in_flight: int = BATCH_SKUS_IN_FLIGHT,
+    now: datetime | None = None,
+) -> tuple[float | None, dict[int, float | None]]:
+    """Seconds until each unfinished item (and the whole batch) is done.
+
+    Per-SKU duration is the average wall time of the batch's finished
+    jobs (BATCH_SKU_SECONDS_ESTIMATE before any has finished). A running
+    SKU is extrapolated from its completed images; queued SKUs are
+    assigned to lanes in order as running ones free up.
+    """
+    now = now or datetime.now(timezone.utc)
+    durations = [
+        (_utc(job.updated_at) - _utc(job.created_at)).total_seconds()
+        for item in items
+        if item.status == "completed" and (job := jobs.get(item.job_id or ""))
+    ]
+    per_sku = sum(durations) / len(durations) if durations else BATCH_SKU_SECONDS_ESTIMATE
+
+    etas: dict[int, float | None] = {}
+    lanes: list[float] = []
+    queued: list[BatchItem] = []
+    for item in items:
+        if item.status in FINISHED_ITEM_STATUSES:
+            etas[item.id] = None
+            continue
+        job = jobs.get(item.job_id or "")
+        if job is None:
+            queued.append(item)
+            continue
+        elapsed = (now - _utc(job.created_at)).total_seconds()
+        done = job.completed_images / job.total_images if job.total_images else 0.0
+        if done > 0:
+            remaining = elapsed * (1 - done) / done
+        else:
+            remaining = max(per_sku - elapsed, 0.0)
+        etas[item.id] = round(remaining, 1)
+        lanes.append(remaining)
+
+    lanes.extend([0.0] * max(0, in_flight - len(lanes)))
+    heapq.heapify(lanes)
+    for item in queued:
+        eta = heapq.heappop(lanes) + per_sku
+        etas[item.id] = round(eta, 1)
+        heapq.heappush(lanes, eta)
+
+    remaining_etas = [e for e in etas.values() if e is not None]
+    return (max(remaining_etas) if remaining_etas else None), etas
@@ -5,12 +5,11 @@ based on product details provided by the user.
 """
 from __future__ import annotations
 
-import asyncio
-import functools
 import logging
 from typing import Optional
 
 from app import config
+from app.services import executors
 
 logger = logging.getLogger(__name__)
 
@@ -116,13 +115,10 @@ async def generate_copy(
     Returns:
         JSON string containing copy for each scene.
     """
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None,
-        functools.partial(
-            _sync_generate_copy,
-            product_details=product_details,
-            product_type=product_type,
-            scene_names=scene_names,
-        ),
+    return await executors.run(
+        "copywriting",
+        _sync_generate_copy,
+        product_details=product_details,
+        product_type=product_type,
+        scene_names=scene_names,
     )
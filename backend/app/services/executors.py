@@ -0,0 +1,339 @@
+"""
+Dedicated, bounded thread pools per class of blocking work.
+
+Provider SDK calls, copywriting and rembg inference used to share the
+event loop's default executor, so a handful of slow Gemini calls could
+block background removal for a minute. Each class of work now gets its
+own named pool (sized in app.config.EXECUTOR_WORKERS) with counters that
+show when it is saturated.
+
+CPU-bound work that holds the GIL (image decode / resample / encode)
+can instead go to a named process pool (PROCESS_EXECUTOR_WORKERS) via
+run_in_process(); the callable and its arguments must be picklable.
+configure_process_pool() gives a pool a per-worker initializer (e.g. to
+preload a model) and a memory cap: once a worker reports more resident
+memory than the cap, the pool is replaced and the old workers exit after
+finishing what they already have.
+
+Usage:
+    from app.services import executors
+
+    result = await executors.run("copywriting", _sync_generate_copy, product_details=details)
+    data = await executors.run_in_process("export", render_targets, path, targets)
+    executors.configure_process_pool("rembg", initializer=_load_model, max_rss_bytes=2 << 30)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, TypeVar
+
+from app.config import EXECUTOR_WORKERS, PROCESS_EXECUTOR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Number of recent queue-wait samples kept per pool
+WAIT_SAMPLE_SIZE = 200
+
+
+class BoundedExecutor:
+    """ThreadPoolExecutor wrapper that tracks queueing and utilisation."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=f"{name}-worker",
+        )
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_queued = 0
+        self._wait_samples: deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def _wrap(self, fn: Callable[..., T], enqueued_at: float, state: list[str]) -> Callable[[], T]:
+        def runner() -> T:
+            with self._lock:
+                if state[0] == "cancelled":
+                    raise asyncio.CancelledError()
+                state[0] = "started"
+                self.queued -= 1
+                self.active += 1
+                self._wait_samples.append(time.monotonic() - enqueued_at)
+            try:
+                result = fn()
+            except BaseException:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+            return result
+
+        return runner
+
+    async def run(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(*args, **kwargs)`` on this pool without blocking the loop."""
+        call = functools.partial(fn, *args, **kwargs)
+        state = ["queued"]
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+            if self.queued == self.max_workers + 1:  # log once per saturation episode
+                logger.warning(
+                    f"Executor '{self.name}' saturated: "
+                    f"{self.active} active, {self.queued} queued"
+                )
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._pool, self._wrap(call, time.monotonic(), state)
+            )
+        except asyncio.CancelledError:
+            # Cancelled before a worker picked it up: drop it from the queue count
+            with self._lock:
+                if state[0] == "queued":
+                    state[0] = "cancelled"
+                    self.queued -= 1
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sorted(self._wait_samples)
+            n = len(samples)
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "saturated": self.active >= self.max_workers and self.queued > 0,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "queue_wait_seconds": {
+                    "avg": round(sum(samples) / n, 3) if n else 0.0,
+                    "p95": round(samples[min(n - 1, int(n * 0.95))], 3) if n else 0.0,
+                    "max": round(samples[-1], 3) if n else 0.0,
+                },
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def _current_rss() -> int:
+    """Resident memory of this process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _call_and_measure(call: Callable[[], T]) -> tuple[T, int]:
+    """Run ``call`` in a worker and report the worker's memory with the result."""
+    return call(), _current_rss()
+
+
+class ProcessExecutor:
+    """ProcessPoolExecutor wrapper with the same counters as BoundedExecutor.
+
+    Workers are spawned (not forked) so they never inherit the event loop
+    or other threads' locks. A pool broken by a crashed worker is replaced
+    on the next call, and with ``max_rss_bytes`` a pool whose worker grew
+    past the cap is recycled.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple = (),
+        max_rss_bytes: int = 0,
+    ):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_rss_bytes = max_rss_bytes
+        self._pool = self._new_pool()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.recycles = 0
+        self.last_rss = 0
+        self._durations: deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+            initargs=self.initargs,
+        )
+
+    def _recycle(self, pool: ProcessPoolExecutor, rss: int) -> None:
+        if self._pool is not pool:
+            return  # already replaced
+        self.recycles += 1
+        logger.info(
+            f"Process pool '{self.name}' recycled: a worker reached {rss / 1024 / 1024:.0f} MB "
+            f"(cap {self.max_rss_bytes / 1024 / 1024:.0f} MB)"
+        )
+        self._pool = self._new_pool()
+        pool.shutdown(wait=False)  # old workers finish their queue, then exit
+
+    async def run(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """Run ``fn(*args, **kwargs)`` in a worker process."""
+        call = functools.partial(fn, *args, **kwargs)
+        self.submitted += 1
+        self.in_flight += 1
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            if not self.max_rss_bytes:
+                return await loop.run_in_executor(pool, call)
+            result, rss = await loop.run_in_executor(pool, _call_and_measure, call)
+            self.last_rss = rss
+            if rss > self.max_rss_bytes:
+                self._recycle(pool, rss)
+            return result
+        except BrokenProcessPool:
+            self.failed += 1
+            if self._pool is pool:
+                self.restarts += 1
+                logger.error(f"Process pool '{self.name}' broke; restarting it")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+            raise
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._durations.append(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        samples = sorted(self._durations)
+        n = len(samples)
+        return {
+            "processes": True,
+            "max_workers": self.max_workers,
+            "active": min(self.in_flight, self.max_workers),
+            "queued": max(0, self.in_flight - self.max_workers),
+            "saturated": self.in_flight > self.max_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "recycles": self.recycles,
+            "last_worker_rss_mb": round(self.last_rss / 1024 / 1024, 1),
+            "call_seconds": {
+                "avg": round(sum(samples) / n, 3) if n else 0.0,
+                "p95": round(samples[min(n - 1, int(n * 0.95))], 3) if n else 0.0,
+                "max": round(samples[-1], 3) if n else 0.0,
+            },
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_executors: dict[str, BoundedExecutor | ProcessExecutor] = {}
+_executors_lock = threading.Lock()
+_process_options: dict[str, dict] = {}
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    """Get (or lazily create) the named pool."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                workers = EXECUTOR_WORKERS.get(name, EXECUTOR_WORKERS["default"])
+                executor = BoundedExecutor(name, workers)
+                _executors[name] = executor
+                logger.info(f"Created executor '{name}' ({executor.max_workers} workers)")
+    return executor
+
+
+async def run(name: str, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the named pool."""
+    return await get_executor(name).run(fn, *args, **kwargs)
+
+
+def configure_process_pool(
+    name: str,
+    *,
+    initializer: Callable[..., None] | None = None,
+    initargs: tuple = (),
+    max_rss_bytes: int = 0,
+) -> None:
+    """Set per-worker setup and a memory cap for a process pool created later."""
+    _process_options[name] = {"initializer": initializer, "initargs": initargs, "max_rss_bytes": max_rss_bytes}
+
+
+def get_process_executor(name: str) -> ProcessExecutor:
+    """Get (or lazily create) the named process pool."""
+    key = f"{name}:process"
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                executor = ProcessExecutor(name, PROCESS_EXECUTOR_WORKERS[name], **_process_options.get(name, {}))
+                _executors[key] = executor
+                logger.info(f"Created process pool '{name}' ({executor.max_workers} workers)")
+    return executor
+
+
+async def run_in_process(name: str, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """Run a picklable CPU-bound callable on the named process pool.
+
+    Falls back to the thread pool of the same name when the process pool
+    is disabled (PROCESS_EXECUTOR_WORKERS[name] == 0).
+    """
+    if PROCESS_EXECUTOR_WORKERS.get(name, 0) <= 0:
+        return await run(name, fn, *args, **kwargs)
+    return await get_process_executor(name).run(fn, *args, **kwargs)
+
+
+def stats() -> dict[str, dict]:
+    return {name: ex.stats() for name, ex in _executors.items()}
+
+
+def shutdown_all() -> None:
+    for executor in list(_executors.values()):
+        executor.shutdown()
+    _executors.clear()
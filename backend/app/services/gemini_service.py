@@ -1,16 +1,15 @@
 from __future__ import annotations
 
-import asyncio
-import functools
 import logging
 from pathlib import Path
 
-from PIL import Image
-
 from app import config
+from app.services import http_pool, storage_io
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "gemini-2.5-flash-image"
+
 _client = None
 _current_key = ""
 
@@ -22,71 +21,73 @@ def _get_client():
         raise RuntimeError("Gemini API Key 未設定，請先到設定頁面填入 API Key")
     if _client is None or key != _current_key:
         from google import genai
-        _client = genai.Client(api_key=key)
+        from google.genai import types
+
+        # Async calls go over the shared keep-alive pool instead of a
+        # per-client connection set.
+        _client = genai.Client(
+            api_key=key,
+            http_options=types.HttpOptions(
+                httpx_async_client=http_pool.get_client("gemini"),
+            ),
+        )
         _current_key = key
     return _client
 
 
-def _sync_generate(
-    product_image_path: Path,
-    prompt: str,
-    aspect_ratio: str,
-    model: str,
-) -> bytes:
-    """Synchronous image generation — runs in a thread pool to avoid blocking the event loop."""
-    from google.genai import types
-
-    client = _get_client()
-    input_image = Image.open(product_image_path)
-
-    response = client.models.generate_content(
-        model=model,
-        contents=[prompt, input_image],
-        config=types.GenerateContentConfig(
-            response_modalities=["TEXT", "IMAGE"],
-            image_config=types.ImageConfig(aspect_ratio=aspect_ratio),
-        ),
-    )
-
-    for part in response.parts:
-        if part.inline_data is not None:
-            result_image = part.as_image()
-            return result_image.image_bytes
-
-    raise RuntimeError("No image returned from Gemini API")
+def _sniff_mime_type(image_bytes: bytes) -> str:
+    """Detect the image MIME type from its magic bytes."""
+    if image_bytes.startswith(b"\x89PNG"):
+        return "image/png"
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
 
 
-def _sync_generate_from_bytes(
+async def generate_scene_image_from_bytes(
     image_bytes: bytes,
     prompt: str,
-    aspect_ratio: str,
-    model: str,
+    aspect_ratio: str = "1:1",
+    model: str = DEFAULT_MODEL,
+    mime_type: str | None = None,
 ) -> bytes:
-    """Synchronous image generation from pre-loaded image bytes.
+    """Generate a scene image from pre-loaded image bytes.
 
-    Avoids re-reading the same product image from disk for every generation call
-    within a batch, reducing I/O overhead significantly.
-    """
-    import io
+    Uses the SDK's native asyncio client, so an in-flight request costs a
+    coroutine rather than a thread and is aborted when the caller is
+    cancelled. The product image is sent as-is (no decode / re-encode).
+
+    Args:
+        image_bytes: Pre-loaded product image bytes.
+        prompt: Scene description prompt.
+        aspect_ratio: Output aspect ratio.
+        model: Gemini model to use.
+        mime_type: MIME type of ``image_bytes``; sniffed when omitted.
 
+    Returns:
+        Generated image as PNG bytes.
+    """
     from google.genai import types
 
     client = _get_client()
-    input_image = Image.open(io.BytesIO(image_bytes))
-
-    response = client.models.generate_content(
+    response = await client.aio.models.generate_content(
         model=model,
-        contents=[prompt, input_image],
+        contents=[
+            prompt,
+            types.Part.from_bytes(
+                data=image_bytes,
+                mime_type=mime_type or _sniff_mime_type(image_bytes),
+            ),
+        ],
         config=types.GenerateContentConfig(
             response_modalities=["TEXT", "IMAGE"],
             image_config=types.ImageConfig(aspect_ratio=aspect_ratio),
         ),
     )
 
-    for part in response.parts:
-        if part.inline_data is not None:
-            result_image = part.as_image()
-            return result_image.image_bytes
+    for part in response.parts or []:
+        if part.inline_data is not None and part.inline_data.data:
+            return part.inline_data.data
 
     raise RuntimeError("No image returned from Gemini API")
 
@@ -95,13 +96,10 @@ async def generate_scene_image(
     product_image_path: Path,
     prompt: str,
     aspect_ratio: str = "1:1",
-    model: str = "gemini-2.5-flash-image",
+    model: str = DEFAULT_MODEL,
 ) -> bytes:
     """Generate a scene image using Gemini Image API.
 
-    Uses run_in_executor to avoid blocking the asyncio event loop,
-    so SSE progress events can still be pushed while generating.
-
     Args:
         product_image_path: Path to the product image (preferably background-removed).
         prompt: Scene description prompt.
@@ -111,49 +109,12 @@ async def generate_scene_image(
     Returns:
         Generated image as PNG bytes.
     """
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None,
-        functools.partial(
-            _sync_generate,
-            product_image_path=product_image_path,
-            prompt=prompt,
-            aspect_ratio=aspect_ratio,
-            model=model,
-        ),
-    )
-
-
-async def generate_scene_image_from_bytes(
-    image_bytes: bytes,
-    prompt: str,
-    aspect_ratio: str = "1:1",
-    model: str = "gemini-2.5-flash-image",
-) -> bytes:
-    """Generate a scene image from pre-loaded image bytes.
-
-    Optimized version that avoids repeated disk reads when generating
-    multiple images from the same product photo in a batch.
-
-    Args:
-        image_bytes: Pre-loaded product image bytes.
-        prompt: Scene description prompt.
-        aspect_ratio: Output aspect ratio.
-        model: Gemini model to use.
-
-    Returns:
-        Generated image as PNG bytes.
-    """
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None,
-        functools.partial(
-            _sync_generate_from_bytes,
-            image_bytes=image_bytes,
-            prompt=prompt,
-            aspect_ratio=aspect_ratio,
-            model=model,
-        ),
+    image_bytes = await storage_io.read_bytes(product_image_path)
+    return await generate_scene_image_from_bytes(
+        image_bytes=image_bytes,
+        prompt=prompt,
+        aspect_ratio=aspect_ratio,
+        model=model,
     )
 
 
@@ -161,6 +122,7 @@ async def generate_scene_image_from_bytes(
 # Provider interface wrapper (for provider_registry)
 # ---------------------------------------------------------------------------
 
+from app.services.prepared_input import PreparedInput  # noqa: E402
 from app.services.provider_base import ImageProvider  # noqa: E402
 
 
@@ -171,6 +133,13 @@ class GeminiProvider(ImageProvider):
     def name(self) -> str:
         return "gemini"
 
+    @property
+    def model(self) -> str:
+        return DEFAULT_MODEL
+
+    def is_configured(self) -> bool:
+        return bool(config.GEMINI_API_KEY)
+
     async def generate(
         self,
         image_bytes: bytes,
@@ -182,3 +151,17 @@ class GeminiProvider(ImageProvider):
             prompt=prompt,
             aspect_ratio=aspect_ratio,
         )
+
+    async def generate_prepared(
+        self,
+        prepared: PreparedInput,
+        prompt: str,
+        aspect_ratio: str = "1:1",
+    ) -> bytes:
+        payload = await prepared.payload(self.max_input_side)
+        return await generate_scene_image_from_bytes(
+            image_bytes=payload.data,
+            prompt=prompt,
+            aspect_ratio=aspect_ratio,
+            mime_type=payload.mime_type,
+        )
@@ -2,29 +2,57 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import sys
 import time
 import uuid
-from collections import OrderedDict
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Awaitable, Callable
 
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config import CREDIT_PER_IMAGE, OUTPUT_DIR, MAX_CONCURRENT_GENERATIONS
+from app.config import (
+    CREDIT_PER_IMAGE,
+    INTERRUPTED_JOB_POLICY,
+    OUTPUT_DIR,
+    SSE_POLL_SECONDS,
+    SSE_SNAPSHOT_EVERY,
+)
 from app.database import AsyncSessionLocal
-from app.models.db_models import GeneratedImage as DBGeneratedImage, GenerationJob
-from app.services import gemini_service, kimi_service
+from app.models.db_models import BatchItem, GeneratedImage as DBGeneratedImage, GenerationJob
+from app.services import (
+    credit_service,
+    job_queue,
+    output_storage,
+    prepared_input,
+    rendition_cache,
+    result_cache,
+    storage_io,
+    task_events,
+    thumbnails,
+)
+from app.services.hedging import hedger
+from app.services.job_persistence import TERMINAL_JOB_STATUSES, PersistError, write_behind
+from app.services.prepared_input import PreparedInput
+from app.services.provider_base import ImageProvider
+from app.services.provider_registry import ProviderRegistry, register_builtin_providers
+from app.services.retry_policy import guarded_call, retry_engine
+from app.services.scheduler import Priority, scheduler
+from app.services.task_store import TaskStore
 from app.templates.registry import SceneTemplate, TemplateRegistry
 from app.templates.styles.registry import InjectionLevel, StyleRegistry
 
 logger = logging.getLogger(__name__)
 
-# Task cleanup constants
+register_builtin_providers()
+
+# Progress event protocol: v2 sends per-image deltas plus periodic snapshots
+EVENT_PROTOCOL_VERSION = 2
+
+# A task still "pending" after this long was never started; stop pinning it
 MAX_TASK_AGE_SECONDS = 3600  # 1 hour
-MAX_TASKS = 200
 
 # Color tone coherence prefix — injected into all prompts in a batch to ensure
 # a visually unified set of 9 images with consistent color temperature and tone.
@@ -48,7 +76,10 @@ class ImageStatus(str, Enum):
     FAILED = "failed"
 
 
-@dataclass
+FINISHED_IMAGE_STATUSES = (ImageStatus.COMPLETED, ImageStatus.FAILED)
+
+
+@dataclass(slots=True)
 class GeneratedImageResult:
     template_id: str
     template_name: str
@@ -57,7 +88,7 @@ class GeneratedImageResult:
     error: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class GenerationTask:
     task_id: str
     image_path: Path
@@ -69,25 +100,33 @@ class GenerationTask:
     style: str | None = None
     created_at: float = field(default_factory=time.time)
     user_id: str | None = None  # Linked user (None for anonymous/legacy)
+    priority: Priority = Priority.INTERACTIVE  # Scheduling class for provider slots
+    template_overrides: dict[str, str] | None = None  # Custom prompts by template_id
 
 
-# In-memory task storage with ordered insertion for efficient cleanup
-_tasks: OrderedDict[str, GenerationTask] = OrderedDict()
+def _is_live(task: GenerationTask) -> bool:
+    """In progress (or being regenerated) — must stay in memory."""
+    if task.task_id in _jobs:
+        return True
+    if task.status in TERMINAL_JOB_STATUSES:
+        return any(r.status == ImageStatus.GENERATING for r in task.results)
+    if task.status == "pending":
+        return time.time() - task.created_at <= MAX_TASK_AGE_SECONDS
+    return True
 
 
-def _cleanup_old_tasks():
-    """Remove expired tasks and keep total count within limits."""
-    now = time.time()
-    # Remove tasks older than MAX_TASK_AGE_SECONDS
-    expired = [
-        tid for tid, t in _tasks.items()
-        if now - t.created_at > MAX_TASK_AGE_SECONDS
-    ]
-    for tid in expired:
-        _tasks.pop(tid, None)
-    # If still over limit, remove oldest tasks first
-    while len(_tasks) > MAX_TASKS:
-        _tasks.popitem(last=False)
+def _task_nbytes(task: GenerationTask) -> int:
+    """Approximate memory held by a task record and its results."""
+    size = sys.getsizeof(task) + sys.getsizeof(task.results) + sys.getsizeof(task.task_id)
+    for r in task.results:
+        size += sys.getsizeof(r) + sys.getsizeof(r.template_id) + sys.getsizeof(r.template_name)
+        size += sys.getsizeof(r.output_path) + sys.getsizeof(r.error)
+    return size
+
+
+# In-memory task storage: live tasks are pinned, finished ones kept LRU
+# (see task_store.py); lookups that miss fall back to get_task_from_db().
+_tasks = TaskStore(is_pinned=_is_live, sizeof=_task_nbytes, on_release=task_events.drop)
 
 
 def create_task(
@@ -97,9 +136,9 @@ def create_task(
     selected_template_ids: list[str] | None = None,
     style: str | None = None,
     user_id: str | None = None,
+    priority: Priority = Priority.INTERACTIVE,
 ) -> GenerationTask:
     """Create a generation task for selected (or all) templates."""
-    _cleanup_old_tasks()
     task_id = uuid.uuid4().hex[:12]
     templates = TemplateRegistry.get_templates(product_type)
 
@@ -131,6 +170,8 @@ def create_task(
         total=len(results),
         style=style,
         user_id=user_id,
+        priority=priority,
+        template_overrides=template_overrides,
     )
     _tasks[task_id] = task
     return task
@@ -182,24 +223,11 @@ async def _update_image_status_db(
     output_path: str | None = None,
     error: str | None = None,
 ) -> None:
-    """Update a single generated_image row in the database."""
-    try:
-        async with AsyncSessionLocal() as db:
-            await db.execute(
-                update(DBGeneratedImage)
-                .where(
-                    DBGeneratedImage.job_id == task_id,
-                    DBGeneratedImage.template_id == template_id,
-                )
-                .values(
-                    status=status,
-                    output_path=output_path,
-                    error=error,
-                )
-            )
-            await db.commit()
-    except Exception as e:
-        logger.error(f"Failed to update image status in DB ({task_id}/{template_id}): {e}")
+    """Queue an update of a single generated_image row (write-behind)."""
+    write_behind.update_image(
+        task_id, template_id,
+        {"status": status, "output_path": output_path, "error": error},
+    )
 
 
 async def _update_job_status_db(
@@ -208,29 +236,42 @@ async def _update_job_status_db(
     completed_images: int | None = None,
     error_message: str | None = None,
 ) -> None:
-    """Update a generation_job row in the database."""
-    try:
-        async with AsyncSessionLocal() as db:
-            values: dict = {"status": status}
-            if completed_images is not None:
-                values["completed_images"] = completed_images
-            if error_message is not None:
-                values["error_message"] = error_message
-
-            await db.execute(
-                update(GenerationJob)
-                .where(GenerationJob.id == task_id)
-                .values(**values)
-            )
-            await db.commit()
-    except Exception as e:
-        logger.error(f"Failed to update job status in DB ({task_id}): {e}")
+    """Queue an update of a generation_job row (write-behind).
+
+    Terminal states are flushed before returning, so they are durable once
+    this call completes; raises PersistError if the job row could not be
+    written.
+    """
+    values: dict = {"status": status}
+    if completed_images is not None:
+        values["completed_images"] = completed_images
+    if error_message is not None:
+        values["error_message"] = error_message
+    write_behind.update_job(task_id, values)
+
+    if status in TERMINAL_JOB_STATUSES:
+        try:
+            await storage_io.sync()  # output files land before the row says so
+        except Exception as e:
+            logger.error(f"Failed to sync outputs of {task_id}: {e}")
+        try:
+            await write_behind.flush()
+        except PersistError as e:
+            if task_id in e.jobs:
+                logger.error(f"Failed to persist {status} state of job {task_id}: {e}")
+                raise
+            logger.error(f"Failed to update job status in DB ({task_id}): {e}")
 
 
 def get_task(task_id: str) -> GenerationTask | None:
     return _tasks.get(task_id)
 
 
+async def load_task(task_id: str) -> GenerationTask | None:
+    """Task from memory, or from the DB if it was evicted (or never here)."""
+    return _tasks.get(task_id) or await get_task_from_db(task_id)
+
+
 async def get_task_from_db(task_id: str) -> GenerationTask | None:
     """Fallback: load a task from DB when not in memory cache.
 
@@ -238,6 +279,7 @@ async def get_task_from_db(task_id: str) -> GenerationTask | None:
     for a task_id that was evicted from memory but persists in the DB.
     """
     try:
+        await write_behind.flush()  # include changes not yet written
         async with AsyncSessionLocal() as db:
             result = await db.execute(
                 select(GenerationJob).where(GenerationJob.id == task_id)
@@ -274,8 +316,11 @@ async def get_task_from_db(task_id: str) -> GenerationTask | None:
                 user_id=job.user_id,
             )
 
-            # Re-populate memory cache so subsequent in-flight lookups are fast
-            _tasks[task_id] = task
+            # Re-populate memory cache so subsequent lookups are fast. In
+            # queue mode, tasks still in progress are owned by whichever
+            # process runs them, so they are re-read each time instead.
+            if task.status in TERMINAL_JOB_STATUSES or not job_queue.queue_enabled():
+                _tasks[task_id] = task
             return task
 
     except Exception as e:
@@ -283,11 +328,16 @@ async def get_task_from_db(task_id: str) -> GenerationTask | None:
         return None
 
 
-async def recover_stale_tasks() -> int:
-    """Mark stale running/pending jobs as failed on startup.
+async def recover_stale_tasks(policy: str = INTERRUPTED_JOB_POLICY) -> int:
+    """Handle jobs interrupted by a crash or restart, once at startup.
+
+    ``policy`` (INTERRUPTED_JOB_POLICY):
+    - "resume": restart each job for just its unfinished templates;
+      completed images are kept
+    - "fail":   mark unfinished images failed and the job partial/failed
+    - "refund": as "fail", and refund the credits of unfinished images
 
-    Called once during application startup to clean up any jobs that were
-    interrupted by a crash or restart. Returns the count of recovered tasks.
+    Returns the count of recovered tasks.
     """
     try:
         async with AsyncSessionLocal() as db:
@@ -300,6 +350,10 @@ async def recover_stale_tasks() -> int:
             count = 0
 
             for job in stale_jobs:
+                if policy == "resume" and Path(job.image_path).exists():
+                    count += 1
+                    continue  # Resumed below, once this session is closed
+
                 new_status = "partial" if job.completed_images > 0 else "failed"
                 await db.execute(
                     update(GenerationJob)
@@ -311,7 +365,7 @@ async def recover_stale_tasks() -> int:
                 )
 
                 # Mark any non-completed images as failed
-                await db.execute(
+                unfinished = await db.execute(
                     update(DBGeneratedImage)
                     .where(
                         DBGeneratedImage.job_id == job.id,
@@ -322,29 +376,156 @@ async def recover_stale_tasks() -> int:
                         error="伺服器重啟，生成被中斷",
                     )
                 )
+                if policy == "refund" and unfinished.rowcount > 0 and job.credits_charged > 0:
+                    await credit_service.refund_credits(
+                        db, job.user_id, unfinished.rowcount * CREDIT_PER_IMAGE,
+                        description=f"伺服器重啟退款：{unfinished.rowcount} 張未完成圖片",
+                        job_id=job.id,
+                    )
                 count += 1
 
             await db.commit()
-            if count > 0:
-                logger.info(f"Recovered {count} stale tasks on startup")
-            return count
+
+        if policy == "resume":
+            resumable = [job.id for job in stale_jobs if Path(job.image_path).exists()]
+            batch_jobs = await _batch_job_ids(resumable)
+            for job_id in resumable:
+                await resume_task(job_id, Priority.BATCH if job_id in batch_jobs else Priority.INTERACTIVE)
+
+        if count > 0:
+            logger.info(f"Recovered {count} stale tasks on startup (policy={policy})")
+        return count
 
     except Exception as e:
         logger.error(f"Failed to recover stale tasks: {e}")
         return 0
 
 
+async def _batch_job_ids(job_ids: list[str]) -> set[str]:
+    """The jobs among ``job_ids`` that belong to a batch (they resume at batch priority)."""
+    if not job_ids:
+        return set()
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(BatchItem.job_id).where(BatchItem.job_id.in_(job_ids)))
+        return set(result.scalars().all())
+
+
+def _reset_for_resume(task: GenerationTask) -> None:
+    """Re-enqueue images still pending / generating; completed and failed ones are kept."""
+    for r in task.results:
+        if r.status in (ImageStatus.PENDING, ImageStatus.GENERATING):
+            r.status, r.error = ImageStatus.PENDING, None
+    task.progress = sum(1 for r in task.results if r.status in FINISHED_IMAGE_STATUSES)
+    task.status = "pending"
+
+
+async def resume_task(task_id: str, priority: Priority = Priority.INTERACTIVE) -> asyncio.Task | None:
+    """Continue an interrupted task for just its unfinished templates.
+
+    The priority is not persisted with the job, so callers resuming batch
+    work pass ``Priority.BATCH``. Returns the running generation job, or
+    None when the task is already finished (or unknown).
+    """
+    job = _jobs.get(task_id)
+    if job is not None:
+        return job
+    task = await load_task(task_id)
+    if task is None or task.status in TERMINAL_JOB_STATUSES:
+        return None
+    _reset_for_resume(task)
+    task.priority = priority
+    _tasks[task_id] = task
+    logger.info(f"Resuming task {task_id}: {task.progress}/{task.total} already completed")
+    return start_generation_job(task_id)
+
+
+def _image_payload(task_id: str, r: GeneratedImageResult) -> dict:
+    return {
+        "template_id": r.template_id,
+        "template_name": r.template_name,
+        "status": r.status.value,
+        "url": f"/api/outputs/{task_id}/{r.template_id}.png" if r.output_path else None,
+        "thumbnail_url": thumbnails.thumbnail_url(task_id, r.template_id) if r.output_path else None,
+        "error": r.error,
+    }
+
+
 def _build_results_payload(task_id: str, results: list[GeneratedImageResult]) -> list[dict]:
-    return [
-        {
-            "template_id": r.template_id,
-            "template_name": r.template_name,
-            "status": r.status.value,
-            "url": f"/api/outputs/{task_id}/{r.template_id}.png" if r.output_path else None,
-            "error": r.error,
-        }
-        for r in results
-    ]
+    return [_image_payload(task_id, r) for r in results]
+
+
+async def _generate_image(
+    provider: str,
+    prepared: PreparedInput,
+    prompt: str,
+    aspect_ratio: str,
+    user_id: str | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+    use_cache: bool = True,
+    on_start: Callable[[], Awaitable[None]] | None = None,
+    template_id: str | None = None,
+) -> bytes:
+    """Generate one image, going through the result cache and retry engine.
+
+    Each attempt takes its own scheduler slot on whichever provider the
+    retry engine picks (the preferred one, or a failover target), so
+    backoff sleeps and cache hits do not hold provider capacity.
+    ``on_start`` runs once, when the first attempt gets its slot (or when
+    joining an identical generation already in flight). With
+    hedging enabled, a slow attempt may be duplicated (see hedging.py);
+    ``template_id`` selects the latency history used for that decision.
+
+    Pass ``use_cache=False`` for explicit regenerate / variant requests where
+    a fresh random result is the point.
+    """
+    started = False
+
+    async def start() -> None:
+        nonlocal started
+        if not started:
+            started = True
+            if on_start is not None:
+                await on_start()
+
+    async def attempt(p: ImageProvider) -> tuple[str, bytes]:
+        async with scheduler.slot(p.name, user_id, priority):
+            await start()
+            return await hedger.run(
+                p,
+                template_id,
+                user_id,
+                call=call,
+                acquire=lambda q: scheduler.slot(q.name, user_id, priority),
+                choose_alternate=lambda name: retry_engine.choose_provider(name, exclude={name}),
+            )
+
+    async def call(q: ImageProvider) -> tuple[str, bytes]:
+        # Tagged with the provider that produced it: failover and hedges may pick another
+        data = await guarded_call(q, lambda g: g.generate_prepared(prepared, prompt, aspect_ratio))
+        return q.name, data
+
+    served = provider
+
+    async def producer() -> bytes:
+        nonlocal served
+        served, data = await retry_engine.execute(provider, attempt)
+        return data
+
+    def cache_key(name: str) -> str:
+        model = ProviderRegistry.get(name).model
+        return result_cache.make_key(prepared.digest, prompt, aspect_ratio, model, name)
+
+    key = cache_key(provider)
+    data, hit = await result_cache.get_or_generate(
+        key, producer, use_cache=use_cache,
+        store_key=lambda: key if served == provider else cache_key(served),
+        on_join=start,
+    )
+    if hit:
+        logger.info(f"Result cache hit ({provider}, key={key[:12]})")
+    elif served != provider:
+        logger.info(f"Result for {provider} served by {served} (cached as {served})")
+    return data
 
 
 async def run_generation(
@@ -357,6 +538,7 @@ async def run_generation(
         yield {"event": "error", "data": "Task not found"}
         return
 
+    template_overrides = template_overrides or task.template_overrides
     task.status = "running"
     # Update DB status
     await _update_job_status_db(task_id, "running")
@@ -365,144 +547,147 @@ async def run_generation(
     all_templates = TemplateRegistry.get_templates(task.product_type)
     result_ids = {r.template_id for r in task.results}
     templates = [t for t in all_templates if t.id in result_ids]
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
 
     task_output_dir = OUTPUT_DIR / task_id
     task_output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Pre-load product image bytes once — avoids repeated disk reads for every
-    # generation call within the batch (9 reads → 1 read).
-    product_image_bytes = task.image_path.read_bytes()
-    logger.info(f"Pre-loaded product image ({len(product_image_bytes)} bytes) for batch generation")
+    # Prepare the product image once — read, orient, downscale and encode
+    # per provider — and share it across all templates (and later
+    # regenerate / variant calls) instead of redoing it per request.
+    prepared = await prepared_input.get(task.image_path)
+    logger.info(f"Prepared product image ({len(prepared.source)} bytes) for batch generation")
 
-    # Use an Event to signal when any single image finishes
-    progress_event = asyncio.Event()
+    # Indices of results whose status changed, drained by the event loop below
+    changes: asyncio.Queue[int] = asyncio.Queue()
 
     async def generate_single(index: int, template: SceneTemplate):
-        async with semaphore:
-            result = task.results[index]
+        result = task.results[index]
+
+        # Use custom prompt if provided, otherwise apply style injection
+        if template_overrides and template.id in template_overrides:
+            prompt = template_overrides[template.id]
+        else:
+            # Apply style modifier based on template's injection_level
+            injection_level = InjectionLevel(template.injection_level)
+            prompt = StyleRegistry.assemble_prompt(
+                base_prompt=template.prompt,
+                style_id=task.style,
+                injection_level=injection_level,
+            )
+
+        # Inject color coherence prefix for batch visual harmony
+        prompt = COLOR_COHERENCE_PREFIX + prompt
+        logger.info(f"Prompt for {template.id} (style={task.style}, level={template.injection_level}): {prompt[:120]}...")
+
+        async def mark_generating() -> None:
             result.status = ImageStatus.GENERATING
             # Update DB: generating
             await _update_image_status_db(task_id, template.id, "generating")
             # Signal so SSE can push "generating" status
-            progress_event.set()
-
-            # Use custom prompt if provided, otherwise apply style injection
-            if template_overrides and template.id in template_overrides:
-                prompt = template_overrides[template.id]
-            else:
-                # Apply style modifier based on template's injection_level
-                injection_level = InjectionLevel(template.injection_level)
-                prompt = StyleRegistry.assemble_prompt(
-                    base_prompt=template.prompt,
-                    style_id=task.style,
-                    injection_level=injection_level,
-                )
+            changes.put_nowait(index)
 
-            # Inject color coherence prefix for batch visual harmony
-            prompt = COLOR_COHERENCE_PREFIX + prompt
-            logger.info(f"Prompt for {template.id} (style={task.style}, level={template.injection_level}): {prompt[:120]}...")
-
-            try:
-                provider = template.recommended_provider
-                if provider == "kimi":
-                    image_bytes = await kimi_service.generate_scene_image(
-                        product_image_path=task.image_path,
-                        prompt=prompt,
-                    )
-                else:
-                    image_bytes = await gemini_service.generate_scene_image_from_bytes(
-                        image_bytes=product_image_bytes,
-                        prompt=prompt,
-                        aspect_ratio=template.aspect_ratio,
-                    )
+        try:
+            # Provider slots are shared process-wide (fair across users,
+            # interactive first); retries back off and may fail over.
+            image_bytes = await _generate_image(
+                template.recommended_provider,
+                prepared,
+                prompt,
+                template.aspect_ratio,
+                user_id=task.user_id,
+                priority=task.priority,
+                on_start=mark_generating,
+                template_id=template.id,
+            )
 
-                output_filename = f"{template.id}.png"
-                output_path = task_output_dir / output_filename
-                output_path.write_bytes(image_bytes)
-
-                result.status = ImageStatus.COMPLETED
-                result.output_path = str(output_path)
-                logger.info(f"Generated {template.id} successfully")
-                # Update DB: completed
-                await _update_image_status_db(
-                    task_id, template.id, "completed",
-                    output_path=str(output_path),
-                )
+            output_filename = f"{template.id}.png"
+            output_path = task_output_dir / output_filename
+            await output_storage.save(output_path, image_bytes)
+
+            result.status = ImageStatus.COMPLETED
+            result.output_path = str(output_path)
+            logger.info(f"Generated {template.id} successfully")
+            # Update DB: completed
+            await _update_image_status_db(
+                task_id, template.id, "completed",
+                output_path=str(output_path),
+            )
 
-            except Exception as e:
-                logger.error(f"Failed to generate {template.id}: {e}")
-                # Retry once — use the same provider as initial attempt
-                try:
-                    if provider == "kimi":
-                        image_bytes = await kimi_service.generate_scene_image(
-                            product_image_path=task.image_path,
-                            prompt=prompt,
-                        )
-                    else:
-                        image_bytes = await gemini_service.generate_scene_image_from_bytes(
-                            image_bytes=product_image_bytes,
-                            prompt=prompt,
-                            aspect_ratio=template.aspect_ratio,
-                        )
-                    output_filename = f"{template.id}.png"
-                    output_path = task_output_dir / output_filename
-                    output_path.write_bytes(image_bytes)
-                    result.status = ImageStatus.COMPLETED
-                    result.output_path = str(output_path)
-                    logger.info(f"Generated {template.id} on retry")
-                    # Update DB: completed (retry)
-                    await _update_image_status_db(
-                        task_id, template.id, "completed",
-                        output_path=str(output_path),
-                    )
-                except Exception as retry_err:
-                    result.status = ImageStatus.FAILED
-                    result.error = str(retry_err)
-                    logger.error(f"Retry also failed for {template.id}: {retry_err}")
-                    # Update DB: failed
-                    await _update_image_status_db(
-                        task_id, template.id, "failed",
-                        error=str(retry_err),
-                    )
+        except Exception as e:
+            result.status = ImageStatus.FAILED
+            result.error = str(e)
+            logger.error(f"Failed to generate {template.id}: {e}")
+            # Update DB: failed
+            await _update_image_status_db(
+                task_id, template.id, "failed",
+                error=str(e),
+            )
 
-            task.progress += 1
-            # Update DB: job progress
-            await _update_job_status_db(task_id, "running", completed_images=task.progress)
-            # Signal progress to the SSE loop
-            progress_event.set()
+        task.progress += 1
+        # Update DB: job progress
+        await _update_job_status_db(task_id, "running", completed_images=task.progress)
+        # Signal progress to the SSE loop
+        changes.put_nowait(index)
 
-    # Launch all tasks
+    # Launch all tasks (a resumed task skips templates already finished)
+    index_by_id = {r.template_id: i for i, r in enumerate(task.results)}
     gen_tasks = []
-    for i, template in enumerate(templates):
+    for template in templates:
+        i = index_by_id[template.id]
+        if task.results[i].status in FINISHED_IMAGE_STATUSES:
+            continue
         gen_tasks.append(asyncio.create_task(generate_single(i, template)))
 
-    # Yield initial started event
-    yield {"event": "started", "task_id": task_id, "total": task.total}
+    try:
+        # Initial event carries a full snapshot; after that only the images
+        # that changed are sent, with a compact snapshot every
+        # SSE_SNAPSHOT_EVERY deltas so late subscribers can catch up.
+        yield {
+            "v": EVENT_PROTOCOL_VERSION,
+            "event": "started",
+            "snapshot": True,
+            "task_id": task_id,
+            "progress": task.progress,
+            "total": task.total,
+            "results": _build_results_payload(task_id, task.results),
+        }
 
-    # Yield progress events whenever any image status changes
-    last_progress = -1
-    while task.progress < task.total:
-        # Wait for a status change or timeout (for periodic heartbeat)
-        progress_event.clear()
-        try:
-            await asyncio.wait_for(progress_event.wait(), timeout=2.0)
-        except asyncio.TimeoutError:
-            pass
-
-        # Only yield if something actually changed
-        if task.progress != last_progress:
-            last_progress = task.progress
-            yield {
-                "event": "progress",
-                "task_id": task_id,
-                "progress": task.progress,
-                "total": task.total,
-                "results": _build_results_payload(task_id, task.results),
-            }
-
-    # Wait for all to finish (they should be done already)
-    await asyncio.gather(*gen_tasks, return_exceptions=True)
+        deltas_since_snapshot = 0
+        while task.progress < task.total or not changes.empty():
+            changed = {await changes.get()}
+            while not changes.empty():
+                changed.add(changes.get_nowait())
+
+            for index in sorted(changed):
+                yield {
+                    "v": EVENT_PROTOCOL_VERSION,
+                    "event": "image",
+                    "task_id": task_id,
+                    "progress": task.progress,
+                    "total": task.total,
+                    "image": _image_payload(task_id, task.results[index]),
+                }
+            deltas_since_snapshot += len(changed)
+
+            if deltas_since_snapshot >= SSE_SNAPSHOT_EVERY:
+                deltas_since_snapshot = 0
+                yield {
+                    "v": EVENT_PROTOCOL_VERSION,
+                    "event": "snapshot",
+                    "snapshot": True,
+                    "task_id": task_id,
+                    "progress": task.progress,
+                    "total": task.total,
+                    "results": _build_results_payload(task_id, task.results),
+                }
+
+        # Wait for all to finish (they should be done already)
+        await asyncio.gather(*gen_tasks, return_exceptions=True)
+    finally:
+        # Consumer went away (or the job was cancelled) — don't orphan calls
+        for t in gen_tasks:
+            if not t.done():
+                t.cancel()
 
     # Determine overall status
     completed_count = sum(1 for r in task.results if r.status == ImageStatus.COMPLETED)
@@ -517,7 +702,9 @@ async def run_generation(
     await _update_job_status_db(task_id, task.status, completed_images=completed_count)
 
     yield {
+        "v": EVENT_PROTOCOL_VERSION,
         "event": "completed",
+        "snapshot": True,
         "task_id": task_id,
         "status": task.status,
         "progress": task.total,
@@ -526,13 +713,166 @@ async def run_generation(
     }
 
 
+# Running background generation jobs, keyed by task_id
+_jobs: dict[str, asyncio.Task] = {}
+
+
+def start_generation_job(task_id: str) -> asyncio.Task:
+    """Start generation for a task as a supervised background job.
+
+    Progress events go to the task's event bus (see task_events.py), which
+    SSE connections subscribe to — the job no longer depends on any viewer
+    staying connected. Idempotent: returns the existing job if running.
+    """
+    job = _jobs.get(task_id)
+    if job is not None:
+        return job
+    task = _tasks.get(task_id)
+    if not task:
+        raise RuntimeError("Task not found")
+
+    task.status = "starting"
+    bus = task_events.create(task_id)
+    job = asyncio.create_task(_supervise_job(task_id, bus), name=f"generation-{task_id}")
+    _jobs[task_id] = job
+    job.add_done_callback(lambda _t: _jobs.pop(task_id, None))
+    return job
+
+
+async def _supervise_job(task_id: str, bus: task_events.TaskEventBus) -> None:
+    try:
+        async for event in run_generation(task_id):
+            bus.publish(event)
+    except asyncio.CancelledError:
+        logger.warning(f"Generation job {task_id} cancelled")
+        raise
+    except Exception as e:
+        logger.exception(f"Generation job {task_id} crashed: {e}")
+        task = _tasks.get(task_id)
+        if task:
+            task.status = "failed"
+        try:
+            await _update_job_status_db(task_id, "failed", error_message=str(e))
+        except PersistError:
+            pass  # Already logged; the error event still goes out
+        bus.publish({
+            "v": EVENT_PROTOCOL_VERSION,
+            "event": "error",
+            "snapshot": True,
+            "task_id": task_id,
+            "data": str(e),
+        })
+    finally:
+        bus.close()
+
+
+async def submit_generation(task: GenerationTask) -> None:
+    """Start a persisted task: in-process, or via the durable work queue.
+
+    In queue mode the task is handed to a worker process and dropped from
+    this process's memory, so reads go to the shared DB. Anonymous tasks
+    are not persisted and always run in-process.
+    """
+    if not job_queue.queue_enabled() or not task.user_id:
+        start_generation_job(task.task_id)
+        return
+    await job_queue.enqueue(
+        "generation",
+        task.task_id,
+        {"template_overrides": task.template_overrides, "priority": int(task.priority)},
+        priority=int(task.priority),
+    )
+    _tasks.pop(task.task_id, None)
+
+
+async def run_queued_generation(task_id: str, payload: dict) -> None:
+    """Work-queue handler: load a task from the DB and run it to completion."""
+    task = await get_task_from_db(task_id)
+    if task is None:
+        raise RuntimeError(f"Task {task_id} not found in DB")
+    task.template_overrides = payload.get("template_overrides")
+    task.priority = Priority(payload.get("priority", Priority.INTERACTIVE))
+    if task.status in TERMINAL_JOB_STATUSES:
+        logger.info(f"Queued task {task_id} already {task.status}; nothing to do")
+        return
+    # Possibly reclaimed after a worker died: only redo unfinished templates
+    _reset_for_resume(task)
+    _tasks[task_id] = task
+    await start_generation_job(task_id)
+
+
+async def fail_job(task_id: str, error: str) -> None:
+    """Mark a job the work queue gave up on as finished: unfinished images fail.
+
+    Registered as the "generation" failure hook (see job_queue); pollers
+    in the API processes then see the terminal state.
+    """
+    async with AsyncSessionLocal() as db:
+        job = await db.get(GenerationJob, task_id)
+        if job is None or job.status in TERMINAL_JOB_STATUSES:
+            return
+        await db.execute(
+            update(DBGeneratedImage)
+            .where(
+                DBGeneratedImage.job_id == task_id,
+                DBGeneratedImage.status.in_(["pending", "generating"]),
+            )
+            .values(status="failed", error=error)
+        )
+        status = "partial" if job.completed_images > 0 else "failed"
+        await db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == task_id)
+            .values(status=status, error_message=error)
+        )
+        await db.commit()
+    _tasks.pop(task_id, None)
+    logger.warning(f"Job {task_id} marked {status}: {error}")
+
+
+async def poll_task_events(task_id: str) -> AsyncGenerator[dict, None]:
+    """Progress events for a task running in another process, read from the DB.
+
+    Emits a snapshot first, then an "image" delta for each result that
+    changed between polls (every SSE_POLL_SECONDS), and a final
+    "completed" snapshot.
+    """
+    last: dict[str, dict] | None = None
+    while True:
+        task = await get_task_from_db(task_id)
+        if task is None:
+            yield {"v": EVENT_PROTOCOL_VERSION, "event": "error", "snapshot": True,
+                   "task_id": task_id, "data": "Task not found"}
+            return
+        images = {r.template_id: _image_payload(task_id, r) for r in task.results}
+        base = {"v": EVENT_PROTOCOL_VERSION, "task_id": task_id, "total": task.total}
+
+        if task.status in TERMINAL_JOB_STATUSES:
+            yield {**base, "event": "completed", "snapshot": True, "status": task.status,
+                   "progress": task.total, "results": list(images.values())}
+            return
+        if last is None:
+            yield {**base, "event": "snapshot", "snapshot": True,
+                   "progress": task.progress, "results": list(images.values())}
+        else:
+            for template_id, image in images.items():
+                if last.get(template_id) != image:
+                    yield {**base, "event": "image", "progress": task.progress, "image": image}
+        last = images
+        await asyncio.sleep(SSE_POLL_SECONDS)
+
+
+def job_stats() -> dict:
+    return {"running_jobs": len(_jobs), "tasks": _tasks.stats(), **task_events.stats()}
+
+
 async def regenerate_single(
     task_id: str,
     template_id: str,
     custom_prompt: str | None = None,
 ) -> GeneratedImageResult:
     """Regenerate a single image within an existing task."""
-    task = _tasks.get(task_id)
+    task = await load_task(task_id)
     if not task:
         raise RuntimeError("Task not found")
 
@@ -575,13 +915,20 @@ async def regenerate_single(
     task_output_dir = OUTPUT_DIR / task_id
 
     try:
-        image_bytes = await gemini_service.generate_scene_image(
-            product_image_path=task.image_path,
-            prompt=prompt,
-            aspect_ratio=template.aspect_ratio,
+        prepared = await prepared_input.get(task.image_path)
+        # Explicit regenerate: bypass the result cache to get a fresh image
+        image_bytes = await _generate_image(
+            template.recommended_provider,
+            prepared,
+            prompt,
+            template.aspect_ratio,
+            user_id=task.user_id,
+            use_cache=False,
+            template_id=template.id,
         )
         output_path = task_output_dir / f"{template_id}.png"
-        output_path.write_bytes(image_bytes)
+        await rendition_cache.invalidate(output_path)
+        await output_storage.save(output_path, image_bytes)
         result.status = ImageStatus.COMPLETED
         result.output_path = str(output_path)
         logger.info(f"Regenerated {template_id} successfully")
@@ -612,7 +959,7 @@ async def generate_variants(
     generation produces different visual results. Returns a list of
     {variant_index, url} dicts.
     """
-    task = _tasks.get(task_id)
+    task = await load_task(task_id)
     if not task:
         raise RuntimeError("Task not found")
 
@@ -638,36 +985,39 @@ async def generate_variants(
     task_output_dir = OUTPUT_DIR / task_id
     task_output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Pre-load product image once
-    product_image_bytes = task.image_path.read_bytes()
+    # Shared prepared input (usually already built by the original job)
+    prepared = await prepared_input.get(task.image_path)
 
-    # Generate variants concurrently (max 4 at once)
-    semaphore = asyncio.Semaphore(count)
+    # Generate variants concurrently; each attempt takes a shared provider slot
     variants: list[dict] = []
 
     async def gen_one(idx: int):
-        async with semaphore:
-            try:
-                image_bytes = await gemini_service.generate_scene_image_from_bytes(
-                    image_bytes=product_image_bytes,
-                    prompt=prompt,
-                    aspect_ratio=template.aspect_ratio,
-                )
-                filename = f"{template_id}_v{idx}.png"
-                output_path = task_output_dir / filename
-                output_path.write_bytes(image_bytes)
-                variants.append({
-                    "variant_index": idx,
-                    "url": f"/api/outputs/{task_id}/{filename}",
-                })
-                logger.info(f"Variant {idx} for {template_id} generated successfully")
-            except Exception as e:
-                logger.error(f"Variant {idx} for {template_id} failed: {e}")
-                variants.append({
-                    "variant_index": idx,
-                    "url": None,
-                    "error": str(e),
-                })
+        try:
+            # Variants rely on sampling randomness, so never serve from cache
+            image_bytes = await _generate_image(
+                template.recommended_provider,
+                prepared,
+                prompt,
+                template.aspect_ratio,
+                user_id=task.user_id,
+                use_cache=False,
+                template_id=template.id,
+            )
+            filename = f"{template_id}_v{idx}.png"
+            output_path = task_output_dir / filename
+            await output_storage.save(output_path, image_bytes)
+            variants.append({
+                "variant_index": idx,
+                "url": f"/api/outputs/{task_id}/{filename}",
+            })
+            logger.info(f"Variant {idx} for {template_id} generated successfully")
+        except Exception as e:
+            logger.error(f"Variant {idx} for {template_id} failed: {e}")
+            variants.append({
+                "variant_index": idx,
+                "url": None,
+                "error": str(e),
+            })
 
     tasks = [asyncio.create_task(gen_one(i)) for i in range(count)]
     await asyncio.gather(*tasks, return_exceptions=True)
@@ -683,7 +1033,7 @@ async def select_variant(
     variant_index: int,
 ) -> GeneratedImageResult:
     """Replace the main image for a template with the chosen variant."""
-    task = _tasks.get(task_id)
+    task = await load_task(task_id)
     if not task:
         raise RuntimeError("Task not found")
 
@@ -691,12 +1041,12 @@ async def select_variant(
     variant_path = task_output_dir / f"{template_id}_v{variant_index}.png"
     main_path = task_output_dir / f"{template_id}.png"
 
-    if not variant_path.exists():
+    if await output_storage.locate(variant_path) is None:
         raise RuntimeError(f"Variant {variant_index} not found for {template_id}")
 
     # Copy variant to main path
-    import shutil
-    shutil.copy2(variant_path, main_path)
+    await rendition_cache.invalidate(main_path)
+    await output_storage.copy(variant_path, main_path)
 
     # Update the result entry
     result = None
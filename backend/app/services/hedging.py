@@ -0,0 +1,225 @@
+"""
+Hedged provider requests to cut tail latency.
+
+When a provider call has been running longer than HEDGE_PERCENTILE of the
+recent latency for that provider + template, a duplicate request is sent
+to the same provider (or, with HEDGE_ALTERNATE_PROVIDER, to a healthy
+alternative). Whichever finishes first wins and the other is cancelled.
+
+Hedges cost an extra provider call, so they are capped per user: at most
+HEDGE_MAX_RATE of the user's calls and HEDGE_MAX_PER_USER_HOUR per hour.
+Disabled unless HEDGING_ENABLED is set.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import AbstractAsyncContextManager
+from typing import Awaitable, Callable, TypeVar
+
+from app.config import (
+    HEDGE_ALTERNATE_PROVIDER,
+    HEDGE_MAX_PER_USER_HOUR,
+    HEDGE_MAX_RATE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    HEDGING_ENABLED,
+)
+from app.services.provider_base import ImageProvider
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Recent latency samples kept per (provider, template)
+LATENCY_SAMPLE_SIZE = 200
+BUDGET_WINDOW_SECONDS = 3600
+# How often record_call() drops users idle for the whole budget window
+BUDGET_SWEEP_SECONDS = 60
+
+
+class LatencyTracker:
+    """Rolling latency samples per (provider, template), with provider fallback."""
+
+    def __init__(self):
+        self._by_key: dict[tuple[str, str], deque[float]] = {}
+        self._by_provider: dict[str, deque[float]] = {}
+
+    def record(self, provider: str, template_id: str | None, latency: float) -> None:
+        self._by_provider.setdefault(provider, deque(maxlen=LATENCY_SAMPLE_SIZE)).append(latency)
+        if template_id:
+            self._by_key.setdefault(
+                (provider, template_id), deque(maxlen=LATENCY_SAMPLE_SIZE)
+            ).append(latency)
+
+    def threshold(self, provider: str, template_id: str | None) -> float | None:
+        """Latency percentile to hedge at, or None while there is too little data."""
+        samples = self._by_key.get((provider, template_id or ""))
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            samples = self._by_provider.get(provider)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+
+class HedgeBudget:
+    """Per-user cap on hedged (duplicate) requests over a rolling hour."""
+
+    def __init__(self):
+        self._calls: dict[str, deque[float]] = defaultdict(deque)
+        self._hedges: dict[str, deque[float]] = defaultdict(deque)
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _trim(events: deque[float], now: float) -> int:
+        cutoff = now - BUDGET_WINDOW_SECONDS
+        while events and events[0] < cutoff:
+            events.popleft()
+        return len(events)
+
+    def _sweep(self, now: float) -> None:
+        """Trim every user's events and drop users idle for the whole window."""
+        self._last_sweep = now
+        for user in list(self._calls.keys() | self._hedges.keys()):
+            calls = self._trim(self._calls.get(user, deque()), now)
+            hedges = self._trim(self._hedges.get(user, deque()), now)
+            if not calls and not hedges:
+                self._calls.pop(user, None)
+                self._hedges.pop(user, None)
+
+    def record_call(self, user_key: str) -> None:
+        now = time.monotonic()
+        calls = self._calls[user_key]
+        self._trim(calls, now)
+        calls.append(now)
+        if now - self._last_sweep >= BUDGET_SWEEP_SECONDS:
+            self._sweep(now)
+
+    def try_acquire(self, user_key: str) -> bool:
+        now = time.monotonic()
+        calls = self._trim(self._calls[user_key], now)
+        hedges = self._trim(self._hedges[user_key], now)
+        if hedges >= HEDGE_MAX_PER_USER_HOUR or hedges + 1 > max(1.0, calls * HEDGE_MAX_RATE):
+            return False
+        self._hedges[user_key].append(now)
+        return True
+
+    def usage(self) -> dict[str, dict]:
+        self._sweep(time.monotonic())
+        return {
+            user: {"calls": len(self._calls.get(user, ())), "hedges": len(self._hedges.get(user, ()))}
+            for user in self._calls.keys() | self._hedges.keys()
+        }
+
+
+class Hedger:
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget()
+        self.hedges_launched = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.wasted_calls = 0  # provider calls whose result was discarded
+
+    async def _timed(
+        self,
+        provider: ImageProvider,
+        template_id: str | None,
+        call: Callable[[ImageProvider], Awaitable[T]],
+    ) -> T:
+        started = time.monotonic()
+        try:
+            result = await call(provider)
+        except asyncio.CancelledError:
+            # A loser cut off by the other call: its elapsed time is a lower
+            # bound on its latency, and dropping it would erase the slow tail
+            # the hedge threshold is computed from
+            self.latency.record(provider.name, template_id, time.monotonic() - started)
+            raise
+        self.latency.record(provider.name, template_id, time.monotonic() - started)
+        return result
+
+    async def run(
+        self,
+        provider: ImageProvider,
+        template_id: str | None,
+        user_id: str | None,
+        call: Callable[[ImageProvider], Awaitable[T]],
+        acquire: Callable[[ImageProvider], AbstractAsyncContextManager],
+        choose_alternate: Callable[[str], ImageProvider] | None = None,
+    ) -> T:
+        """Run ``call(provider)``, hedging it if it runs unusually long.
+
+        The caller already holds a slot for the primary call; the hedge takes
+        its own slot via ``acquire(provider)``.
+        """
+        user_key = user_id or "anonymous"
+        self.budget.record_call(user_key)
+        threshold = self.latency.threshold(provider.name, template_id) if HEDGING_ENABLED else None
+        if threshold is None:
+            return await self._timed(provider, template_id, call)
+
+        primary = asyncio.create_task(self._timed(provider, template_id, call))
+        pending: set[asyncio.Task] = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                return primary.result()
+
+            if not self.budget.try_acquire(user_key):
+                self.budget_denied += 1
+                return await primary
+
+            hedge_provider = provider
+            if HEDGE_ALTERNATE_PROVIDER and choose_alternate is not None:
+                hedge_provider = choose_alternate(provider.name)
+
+            async def hedge_call() -> T:
+                async with acquire(hedge_provider):
+                    return await self._timed(hedge_provider, template_id, call)
+
+            self.hedges_launched += 1
+            logger.info(
+                f"Hedging {provider.name}/{template_id} after {threshold:.1f}s "
+                f"→ {hedge_provider.name} (user={user_key})"
+            )
+            hedge = asyncio.create_task(hedge_call())
+            pending.add(hedge)
+
+            first_error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        if finished is hedge:
+                            self.hedge_wins += 1
+                        if pending:
+                            self.wasted_calls += len(pending)
+                        return finished.result()
+                    first_error = first_error or finished.exception()
+            assert first_error is not None
+            raise first_error
+        finally:
+            for t in pending:
+                t.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": HEDGING_ENABLED,
+            "percentile": HEDGE_PERCENTILE,
+            "alternate_provider": HEDGE_ALTERNATE_PROVIDER,
+            "hedges_launched": self.hedges_launched,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "extra_provider_calls": self.hedges_launched,
+            "wasted_calls": self.wasted_calls,
+            "per_user": self.budget.usage(),
+        }
+
+
+# Process-wide hedger shared by every generation path
+hedger = Hedger()
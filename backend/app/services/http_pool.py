@@ -0,0 +1,47 @@
+"""
+Shared keep-alive HTTP connection pools for provider SDKs.
+
+Each provider gets one long-lived httpx.AsyncClient that its async SDK
+client is built on, so concurrent generations reuse TLS connections
+instead of opening a new one per request. Pools are closed on shutdown.
+"""
+
+from __future__ import annotations
+
+import logging
+
+import httpx
+
+from app.config import (
+    HTTP_POOL_KEEPALIVE_EXPIRY,
+    HTTP_POOL_MAX_CONNECTIONS,
+    HTTP_POOL_MAX_KEEPALIVE,
+    PROVIDER_REQUEST_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Get (or lazily create) the shared connection pool for a provider."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(PROVIDER_REQUEST_TIMEOUT, connect=10.0),
+        )
+        _clients[name] = client
+        logger.info(f"Created HTTP connection pool for '{name}'")
+    return client
+
+
+async def close_all() -> None:
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,238 @@
+"""
+Image renditions for downloads and exports.
+
+Pure, blocking Pillow functions — call them through an executor (the
+"export" process pool, see rendition_cache.py) rather than on the event
+loop. render_targets() decodes a source once and fans it out to every
+requested size and format; render_thumbnail() makes width-bound
+thumbnails; render_composite() builds grid / long images.
+
+Usage:
+    images, timings = render_targets(Path(r.output_path), [(800, 800, "png"), (1080, 1920, "jpeg")])
+    grid = render_composite(paths, "grid3x3", 800, 8, (255, 255, 255), "webp")
+"""
+
+from __future__ import annotations
+
+import io
+import math
+import time
+from pathlib import Path
+
+from PIL import Image
+
+
+# Pillow format name and save options per rendition format
+FORMATS = {
+    "png": ("PNG", {}),  # lossless; large for photographic grids
+    "jpeg": ("JPEG", {"quality": 90}),
+    "webp": ("WEBP", {"quality": 90}),
+}
+
+
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+# Storage encodings of generated outputs (see output_storage.py)
+MASTER_FORMATS = {
+    "webp": ("WEBP", {"lossless": True, "quality": 50, "method": 4}),  # ~45% below PNG
+    "avif": ("AVIF", {"quality": 90, "speed": 6}),
+    "jpeg": ("JPEG", {"quality": 95, "subsampling": 0}),
+}
+
+
+def encode(img: Image.Image, fmt: str = "png") -> bytes:
+    pil_format, options = FORMATS[fmt]
+    buf = io.BytesIO()
+    img.save(buf, format=pil_format, **options)
+    return buf.getvalue()
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _fit_to_canvas(base: Image.Image, width: int, height: int) -> Image.Image:
+    """Contain-fit ``base`` into ``width``x``height`` on white (never upscales)."""
+    scale = min(width / base.width, height / base.height, 1.0)
+    size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+    # reducing_gap: cheap integer reduce() first, then LANCZOS on the rest
+    img = base if size == base.size else base.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    canvas = Image.new("RGB", (width, height), (255, 255, 255))
+    paste_at = ((width - img.width) // 2, (height - img.height) // 2)
+    # Handle RGBA images (from background removal)
+    if img.mode == "RGBA":
+        canvas.paste(img, paste_at, img)
+    else:
+        canvas.paste(img, paste_at)
+    return canvas
+
+
+def render_targets(
+    source: Path,
+    targets: list[tuple[int, int, str]],
+) -> tuple[list[bytes], dict] | None:
+    """Decode ``source`` once and fit it to every (width, height, format) target.
+
+    Returns (encoded images in target order, timings in ms), or None if the
+    source file no longer exists. Runs in an export worker process.
+    """
+    started = time.perf_counter()
+    try:
+        img = Image.open(source)
+    except FileNotFoundError:
+        return None
+    with img:
+        if img.format == "JPEG":
+            # Decode at the smallest DCT scale still covering the largest target
+            img.draft("RGB", (max(t[0] for t in targets), max(t[1] for t in targets)))
+        base = img.convert("RGBA" if _has_alpha(img) else "RGB")
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    outputs: list[bytes] = []
+    render_ms: list[float] = []
+    for width, height, fmt in targets:
+        t = time.perf_counter()
+        outputs.append(encode(_fit_to_canvas(base, width, height), fmt))
+        render_ms.append(round((time.perf_counter() - t) * 1000, 1))
+    return outputs, {"decode_ms": round(decode_ms, 1), "render_ms": render_ms}
+
+
+def render_thumbnail(source: Path, width: int | None, fmt: str = "png") -> bytes | None:
+    """``source`` scaled down to ``width`` wide, aspect kept (never upscales).
+
+    ``width`` None keeps the full size and only converts the format.
+    Returns None if the source no longer exists.
+    """
+    try:
+        img = Image.open(source)
+    except FileNotFoundError:
+        return None
+    with img:
+        if width is not None and width < img.width:
+            # draft() for JPEG sources, reduce() before LANCZOS for the rest
+            img.thumbnail((width, img.height), Image.LANCZOS, reducing_gap=2.0)
+        alpha = _has_alpha(img)
+        if alpha and fmt == "jpeg":
+            rgba = img.convert("RGBA")
+            out = Image.new("RGB", rgba.size, (255, 255, 255))
+            out.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            out = img.convert("RGBA" if alpha else "RGB")
+    return encode(out, fmt)
+
+
+def encode_master(data: bytes, fmt: str) -> tuple[bytes | None, float]:
+    """Re-encode provider output ``data`` in storage format ``fmt``.
+
+    Returns (encoded bytes, encode time in ms). The bytes are None when
+    ``data`` should be kept as is: undecodable, transparent for a JPEG
+    master, or not made smaller by re-encoding.
+    """
+    started = time.perf_counter()
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None, 0.0
+    alpha = _has_alpha(img)
+    if alpha and fmt == "jpeg":
+        return None, 0.0
+    pil_format, options = MASTER_FORMATS[fmt]
+    buf = io.BytesIO()
+    img.convert("RGBA" if alpha else "RGB").save(buf, format=pil_format, **options)
+    encoded = buf.getvalue()
+    encode_ms = round((time.perf_counter() - started) * 1000, 1)
+    return (encoded if len(encoded) < len(data) else None), encode_ms
+
+
+# Cell positions (col, row) of the small images around the 2x2 hero
+HERO_POSITIONS = [(2, 0), (2, 1), (2, 2), (0, 2), (1, 2)]
+
+
+def _open_flat(source: Path, bg: tuple[int, int, int]) -> Image.Image:
+    """Open ``source`` as RGB, flattening transparency onto ``bg``."""
+    img = Image.open(source)
+    if img.mode == "RGBA":
+        flat = Image.new("RGB", img.size, bg)
+        flat.paste(img, mask=img)
+        return flat
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+def _cover(img: Image.Image, w: int, h: int) -> Image.Image:
+    """Cover-fit: scale to fill w x h, then center-crop."""
+    scale = max(w / img.width, h / img.height)
+    new_w = int(img.width * scale)
+    new_h = int(img.height * scale)
+    img = img.resize((new_w, new_h), Image.LANCZOS, reducing_gap=3.0)
+    left = (new_w - w) // 2
+    top = (new_h - h) // 2
+    return img.crop((left, top, left + w, top + h))
+
+
+def render_composite(
+    sources: list[Path],
+    layout: str,
+    cell: int,
+    gap: int,
+    bg: tuple[int, int, int],
+    fmt: str = "png",
+) -> bytes | None:
+    """Composite up to 9 images into one grid / long image.
+
+    Layouts: "grid3x3", "hero_center" (first image 2x2) and "detail_long"
+    (single column, aspect preserved). Unreadable sources are skipped;
+    returns None if none could be read.
+    """
+    sources = sources[:9]
+    cols = 3
+
+    if layout == "detail_long":
+        # Single column at a uniform width, heights follow each aspect ratio
+        resized: list[Image.Image] = []
+        for source in sources:
+            try:
+                img = _open_flat(source, bg)
+            except Exception:
+                continue
+            new_h = int(img.height * cell / img.width)
+            resized.append(img.resize((cell, new_h), Image.LANCZOS, reducing_gap=3.0))
+        if not resized:
+            return None
+        total_h = sum(im.height for im in resized) + gap * (len(resized) - 1)
+        canvas = Image.new("RGB", (cell, total_h), bg)
+        y_offset = 0
+        for im in resized:
+            canvas.paste(im, (0, y_offset))
+            y_offset += im.height + gap
+        return encode(canvas, fmt)
+
+    # --- grid3x3 & hero_center ---
+    rows = 3 if layout == "hero_center" else math.ceil(len(sources) / cols)
+    total_w = cols * cell + (cols - 1) * gap
+    total_h = rows * cell + (rows - 1) * gap
+    canvas = Image.new("RGB", (total_w, total_h), bg)
+
+    pasted = 0
+    for i, source in enumerate(sources):
+        try:
+            img = _open_flat(source, bg)
+        except Exception:
+            continue
+
+        if layout == "hero_center" and i == 0:
+            w = h = cell * 2 + gap
+            col, row = 0, 0
+        elif layout == "hero_center":
+            col, row = HERO_POSITIONS[(i - 1) % len(HERO_POSITIONS)]
+            w = h = cell
+        else:
+            col, row = i % cols, i // cols
+            w = h = cell
+
+        canvas.paste(_cover(img, w, h), (col * (cell + gap), row * (cell + gap)))
+        pasted += 1
+
+    return encode(canvas, fmt) if pasted else None
+
@@ -0,0 +1,193 @@
+"""
+Write-behind persistence for generation progress.
+
+Status changes for generation_jobs / generated_images rows are merged in
+memory per job and per (job, template) — a "generating" followed by
+"completed" becomes a single write — and flushed in ONE transaction every
+PERSIST_FLUSH_INTERVAL_MS. Terminal job states flush immediately and the
+caller awaits the commit, so they are durable before the final SSE
+"completed" event is sent.
+
+When the batched transaction fails, each row is retried in its own
+transaction so one bad row (schema / constraint error) cannot hold the
+others back. A row that keeps failing is dropped, and logged, after
+PERSIST_MAX_ATTEMPTS flushes. flush() raises PersistError naming the rows
+that were not written, so a terminal state that did not persist reaches
+the caller.
+
+On SQLite this turns ~30 sessions/commits per 9-image job into a handful.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from sqlalchemy import update
+
+from app.config import PERSIST_FLUSH_INTERVAL_MS, PERSIST_MAX_ATTEMPTS
+from app.database import AsyncSessionLocal
+from app.models.db_models import GeneratedImage as DBGeneratedImage, GenerationJob
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_JOB_STATUSES = {"completed", "partial", "failed"}
+
+
+class PersistError(Exception):
+    """Some pending rows could not be written (re-queued, or dropped if poison)."""
+
+    def __init__(self, jobs: set[str], images: set[tuple[str, str]]):
+        self.jobs = jobs
+        self.images = images
+        super().__init__(f"{len(jobs)} job and {len(images)} image rows not written")
+
+
+class WriteBehindQueue:
+    def __init__(self, interval_ms: int = PERSIST_FLUSH_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._jobs: dict[str, dict] = {}
+        self._images: dict[tuple[str, str], dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: asyncio.Event | None = None
+        self._loop_task: asyncio.Task | None = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.updates_merged = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        self._attempts: dict[tuple, int] = {}  # ("job"|"image", key) -> failed flushes
+
+    def _ensure_running(self) -> None:
+        if self._loop_task is None or self._loop_task.done():
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.interval)  # let more updates coalesce
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                if self._jobs or self._images:
+                    self._wakeup.set()  # Re-queued; retry on the next tick
+
+    def _enqueue(self, pending: dict, key, values: dict) -> None:
+        existing = pending.get(key)
+        if existing is None:
+            pending[key] = dict(values)
+        else:
+            existing.update(values)
+            self.updates_merged += 1
+        self._ensure_running()
+        assert self._wakeup is not None
+        self._wakeup.set()
+
+    def update_image(self, task_id: str, template_id: str, values: dict) -> None:
+        self._enqueue(self._images, (task_id, template_id), values)
+
+    def update_job(self, task_id: str, values: dict) -> None:
+        self._enqueue(self._jobs, task_id, values)
+
+    @staticmethod
+    async def _write(db, images: dict, jobs: dict) -> None:
+        for (task_id, template_id), values in images.items():
+            await db.execute(
+                update(DBGeneratedImage)
+                .where(
+                    DBGeneratedImage.job_id == task_id,
+                    DBGeneratedImage.template_id == template_id,
+                )
+                .values(**values)
+            )
+        for task_id, values in jobs.items():
+            await db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == task_id)
+                .values(**values)
+            )
+
+    async def _write_each(self, images: dict, jobs: dict) -> tuple[set, set]:
+        """Write rows one transaction each; returns the (image, job) keys that failed."""
+        failed_images: set = set()
+        failed_jobs: set = set()
+        rows = [("image", key, {key: values}, {}) for key, values in images.items()]
+        rows += [("job", key, {}, {key: values}) for key, values in jobs.items()]
+        for kind, key, image_rows, job_rows in rows:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self._write(db, image_rows, job_rows)
+                    await db.commit()
+            except Exception as e:
+                attempts = self._attempts.get((kind, key), 0) + 1
+                if attempts >= PERSIST_MAX_ATTEMPTS:
+                    self._attempts.pop((kind, key), None)
+                    self.dropped_rows += 1
+                    logger.error(f"Dropping {kind} update {key} {(image_rows or job_rows)[key]} after {attempts} failed flushes: {e}")
+                else:
+                    self._attempts[(kind, key)] = attempts
+                    pending = self._images if kind == "image" else self._jobs
+                    # Re-queue under any newer values that arrived meanwhile
+                    pending[key] = {**(image_rows or job_rows)[key], **pending.get(key, {})}
+                (failed_images if kind == "image" else failed_jobs).add(key)
+                continue
+            self._attempts.pop((kind, key), None)
+            self.rows_written += 1
+        return failed_images, failed_jobs
+
+    async def flush(self) -> None:
+        """Write all pending changes, in a single transaction when possible.
+
+        Raises PersistError if any row could not be written.
+        """
+        async with self._flush_lock:
+            if not self._jobs and not self._images:
+                return
+            jobs, self._jobs = self._jobs, {}
+            images, self._images = self._images, {}
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self._write(db, images, jobs)
+                    await db.commit()
+                self.flushes += 1
+                self.rows_written += len(jobs) + len(images)
+                for key in images:
+                    self._attempts.pop(("image", key), None)
+                for key in jobs:
+                    self._attempts.pop(("job", key), None)
+                return
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Write-behind flush failed ({len(jobs)} jobs, {len(images)} images), writing rows one by one: {e}")
+            failed_images, failed_jobs = await self._write_each(images, jobs)
+            self.flushes += 1
+            if failed_images or failed_jobs:
+                raise PersistError(failed_jobs, failed_images)
+
+    async def close(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        try:
+            await self.flush()
+        except Exception:
+            pass  # Already logged
+
+    def stats(self) -> dict:
+        return {
+            "flush_interval_ms": int(self.interval * 1000),
+            "pending_jobs": len(self._jobs),
+            "pending_images": len(self._images),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "updates_merged": self.updates_merged,
+            "failed_flushes": self.failed_flushes,
+            "retrying_rows": len(self._attempts),
+            "dropped_rows": self.dropped_rows,
+        }
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,306 @@
+"""
+Durable, DB-backed work queue for generation and batch jobs.
+
+With JOB_QUEUE_MODE=queue, API processes only enqueue work items (table
+work_items) and any number of worker processes (``python -m app.worker``)
+claim them. Claims are leases: a worker owns an item until
+lease_expires_at and heartbeats to extend it while the work runs. If a
+worker dies, its lease lapses and another worker reclaims the item, up to
+JOB_MAX_ATTEMPTS claims. An item that runs out of claims is failed, and
+the failure hook registered for its kind (register_failure_hook) marks
+the job it refers to as failed, so that row does not stay "running".
+
+Claiming is a compare-and-set UPDATE (``... WHERE id = ? AND status = ?``)
+rather than anything SQLite-specific, so the same code works on
+Postgres; there, ``SELECT ... FOR UPDATE SKIP LOCKED`` on the candidate
+query would be a drop-in improvement for heavy contention.
+
+Usage:
+    await job_queue.enqueue("generation", task_id, {"priority": 0})
+
+    job_queue.register_handler("generation", handle_generation)
+    job_queue.register_failure_hook("generation", fail_generation)
+    await job_queue.Worker().run(stop_event)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import and_, func, or_, select, update
+
+from app.config import (
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_QUEUE_MODE,
+    JOB_WORKER_CONCURRENCY,
+)
+from app.database import AsyncSessionLocal
+from app.models.db_models import WorkItem
+
+logger = logging.getLogger(__name__)
+
+# Candidates fetched per claim attempt; losing a CAS race moves to the next
+CLAIM_CANDIDATES = 5
+
+POISON_ERROR = "lease expired too many times"
+
+Handler = Callable[[str, dict], Awaitable[None]]
+FailureHook = Callable[[str, str], Awaitable[None]]
+_handlers: dict[str, Handler] = {}
+_failure_hooks: dict[str, FailureHook] = {}
+
+
+def queue_enabled() -> bool:
+    """Whether work goes through the durable queue instead of running in-process."""
+    return JOB_QUEUE_MODE == "queue"
+
+
+def register_handler(kind: str, handler: Handler) -> None:
+    """Register ``async handler(ref_id, payload)`` for a work item kind."""
+    _handlers[kind] = handler
+
+
+def register_failure_hook(kind: str, hook: FailureHook) -> None:
+    """Register ``async hook(ref_id, error)``, run when an item of ``kind`` is given up on."""
+    _failure_hooks[kind] = hook
+
+
+async def _run_failure_hook(kind: str, ref_id: str, error: str) -> None:
+    hook = _failure_hooks.get(kind)
+    if hook is None:
+        return
+    try:
+        await hook(ref_id, error)
+    except Exception as e:
+        logger.error(f"Failure hook for {kind} {ref_id} failed: {e}")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue(kind: str, ref_id: str, payload: dict | None = None, priority: int = 0) -> str:
+    async with AsyncSessionLocal() as db:
+        item = WorkItem(
+            kind=kind,
+            ref_id=ref_id,
+            payload=json.dumps(payload or {}, ensure_ascii=False),
+            priority=priority,
+        )
+        db.add(item)
+        await db.commit()
+        logger.info(f"Enqueued {kind} work item {item.id} for {ref_id}")
+        return item.id
+
+
+def _claimable(now: datetime):
+    expired = and_(WorkItem.status == "leased", WorkItem.lease_expires_at < now)
+    return and_(
+        or_(WorkItem.status == "queued", expired),
+        WorkItem.attempts < JOB_MAX_ATTEMPTS,
+    )
+
+
+async def _fail_poison(now: datetime) -> None:
+    """Fail items whose lease lapsed too many times, and the jobs they refer to."""
+    poison = and_(
+        WorkItem.status == "leased",
+        WorkItem.lease_expires_at < now,
+        WorkItem.attempts >= JOB_MAX_ATTEMPTS,
+    )
+    failed: list[tuple[str, str, str]] = []
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(WorkItem.id, WorkItem.kind, WorkItem.ref_id).where(poison))
+        for item_id, kind, ref_id in result.all():
+            marked = await db.execute(
+                update(WorkItem)
+                .where(WorkItem.id == item_id, poison)
+                .values(status="failed", last_error=POISON_ERROR, lease_owner=None)
+            )
+            if marked.rowcount == 1:  # another worker may have got there first
+                failed.append((item_id, kind, ref_id))
+        await db.commit()
+    for item_id, kind, ref_id in failed:
+        logger.error(f"Work item {item_id} ({kind} {ref_id}) failed: {POISON_ERROR}")
+        await _run_failure_hook(kind, ref_id, POISON_ERROR)
+
+
+async def claim(worker_id: str, kinds: list[str]) -> WorkItem | None:
+    """Lease the next runnable item (queued, or with an expired lease)."""
+    now = _now()
+    await _fail_poison(now)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(WorkItem.id, WorkItem.status, WorkItem.attempts)
+            .where(_claimable(now), WorkItem.kind.in_(kinds))
+            .order_by(WorkItem.priority, WorkItem.created_at)
+            .limit(CLAIM_CANDIDATES)
+        )
+        for item_id, status, attempts in result.all():
+            claimed = await db.execute(
+                update(WorkItem)
+                .where(
+                    WorkItem.id == item_id,
+                    WorkItem.status == status,
+                    WorkItem.attempts == attempts,  # nobody claimed it in between
+                )
+                .values(
+                    status="leased",
+                    attempts=attempts + 1,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                )
+            )
+            if claimed.rowcount == 1:
+                await db.commit()
+                item = await db.get(WorkItem, item_id)
+                return item
+        await db.commit()
+        return None
+
+
+async def heartbeat(item_id: str, worker_id: str) -> bool:
+    """Extend a lease. False means the lease was lost to another worker."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(WorkItem)
+            .where(
+                WorkItem.id == item_id,
+                WorkItem.lease_owner == worker_id,
+                WorkItem.status == "leased",
+            )
+            .values(lease_expires_at=_now() + timedelta(seconds=JOB_LEASE_SECONDS))
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+
+async def finish(item_id: str, worker_id: str, error: str | None = None) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(WorkItem)
+            .where(WorkItem.id == item_id, WorkItem.lease_owner == worker_id)
+            .values(
+                status="failed" if error else "done",
+                last_error=error,
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+        )
+        await db.commit()
+
+
+async def release(item_id: str, worker_id: str) -> None:
+    """Hand an unfinished item back to the queue (graceful worker shutdown)."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(WorkItem)
+            .where(WorkItem.id == item_id, WorkItem.lease_owner == worker_id)
+            .values(
+                status="queued",
+                attempts=WorkItem.attempts - 1,  # not the item's fault
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+        )
+        await db.commit()
+
+
+async def stats() -> dict:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(WorkItem.kind, WorkItem.status, func.count()).group_by(WorkItem.kind, WorkItem.status)
+        )
+        counts: dict[str, dict[str, int]] = {}
+        for kind, status, n in result.all():
+            counts.setdefault(kind, {})[status] = n
+    return {"mode": JOB_QUEUE_MODE, "items": counts}
+
+
+class Worker:
+    """Claims work items and runs their handlers under a heartbeated lease."""
+
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY, kinds: list[str] | None = None):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.kinds = kinds or list(_handlers)
+        self._running: dict[asyncio.Task, str] = {}  # task -> work item id
+
+    async def run(self, stop: asyncio.Event) -> None:
+        logger.info(f"Worker {self.worker_id} started (kinds={self.kinds}, concurrency={self.concurrency})")
+        stopping = asyncio.create_task(stop.wait())
+        try:
+            while not stop.is_set():
+                if len(self._running) >= self.concurrency:
+                    await asyncio.wait({stopping, *self._running}, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    item = await claim(self.worker_id, self.kinds)
+                except Exception as e:
+                    logger.error(f"Claim failed: {e}")
+                    item = None
+                if item is None:
+                    try:
+                        await asyncio.wait_for(stop.wait(), timeout=JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                task = asyncio.create_task(self._execute(item))
+                self._running[task] = item.id
+                task.add_done_callback(lambda t: self._running.pop(t, None))
+        finally:
+            stopping.cancel()
+            await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        if not self._running:
+            return
+        logger.info(f"Worker {self.worker_id} stopping; releasing {len(self._running)} items")
+        items = dict(self._running)
+        for task in items:
+            task.cancel()
+        await asyncio.gather(*items, return_exceptions=True)
+        for item_id in items.values():
+            await release(item_id, self.worker_id)
+
+    async def _keep_leased(self, item_id: str, work: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                if not await heartbeat(item_id, self.worker_id):
+                    logger.error(f"Lost lease on work item {item_id}; abandoning it")
+                    work.cancel()
+                    return
+            except Exception as e:
+                logger.warning(f"Heartbeat for {item_id} failed: {e}")
+
+    async def _execute(self, item: WorkItem) -> None:
+        handler = _handlers[item.kind]
+        logger.info(f"Running {item.kind} {item.ref_id} (item {item.id}, attempt {item.attempts})")
+        work = asyncio.create_task(handler(item.ref_id, json.loads(item.payload or "{}")))
+        keeper = asyncio.create_task(self._keep_leased(item.id, work))
+        try:
+            await work
+        except asyncio.CancelledError:
+            if keeper.done() and not keeper.cancelled():
+                return  # Lease lost — the new owner finishes it
+            raise  # Worker shutdown — _shutdown() releases the item
+        except Exception as e:
+            logger.exception(f"{item.kind} {item.ref_id} failed: {e}")
+            await finish(item.id, self.worker_id, error=str(e)[:1000])
+            await _run_failure_hook(item.kind, item.ref_id, str(e))
+            return
+        finally:
+            keeper.cancel()
+            if not work.done():
+                work.cancel()
+        await finish(item.id, self.worker_id)
@@ -1,15 +1,16 @@
 from __future__ import annotations
 
-import asyncio
 import base64
-import functools
 import logging
 from pathlib import Path
 
 from app import config
+from app.services import http_pool, storage_io
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "moonshotai/Kimi-K2.5"
+
 _client = None
 _current_key = ""
 
@@ -20,31 +21,39 @@ def _get_client():
     if not key:
         raise RuntimeError("Together AI API Key 未設定，請先到設定頁面填入 API Key")
     if _client is None or key != _current_key:
-        from together import Together
-        _client = Together(api_key=key)
+        from together import AsyncTogether
+        # retry_policy is the only retry layer (the SDK retries twice by default)
+        _client = AsyncTogether(api_key=key, http_client=http_pool.get_client("kimi"), max_retries=0)
         _current_key = key
     return _client
 
 
-def _sync_generate(
-    product_image_path: Path,
+def _to_data_url(image_bytes: bytes) -> str:
+    mime_type = "image/png" if image_bytes.startswith(b"\x89PNG") else "image/jpeg"
+    image_b64 = base64.standard_b64encode(image_bytes).decode("utf-8")
+    return f"data:{mime_type};base64,{image_b64}"
+
+
+async def generate_scene_image_from_bytes(
+    image_bytes: bytes,
     prompt: str,
-    width: int,
-    height: int,
-    steps: int,
+    width: int = 1024,
+    height: int = 1024,
+    steps: int = 28,
+    image_url: str | None = None,
 ) -> bytes:
-    """Synchronous image generation — runs in a thread pool."""
-    client = _get_client()
+    """Generate a scene image from pre-loaded image bytes using Kimi K2.5.
 
-    image_bytes = product_image_path.read_bytes()
-    image_b64 = base64.standard_b64encode(image_bytes).decode("utf-8")
-    mime_type = "image/png" if product_image_path.suffix == ".png" else "image/jpeg"
-    data_url = f"data:{mime_type};base64,{image_b64}"
+    Uses Together's native asyncio client over the shared connection pool,
+    so cancelling the caller aborts the HTTP request. Pass a prepared
+    ``image_url`` (data URL) to skip re-encoding ``image_bytes``.
+    """
+    client = _get_client()
 
-    response = client.images.generate(
-        model="moonshotai/Kimi-K2.5",
+    response = await client.images.generate(
+        model=DEFAULT_MODEL,
         prompt=prompt,
-        image_url=data_url,
+        image_url=image_url or _to_data_url(image_bytes),
         width=width,
         height=height,
         steps=steps,
@@ -67,8 +76,6 @@ async def generate_scene_image(
 ) -> bytes:
     """Generate a scene image using Kimi K2.5 via Together AI.
 
-    Uses run_in_executor to avoid blocking the asyncio event loop.
-
     Args:
         product_image_path: Path to the product image.
         prompt: Scene description prompt.
@@ -79,17 +86,13 @@ async def generate_scene_image(
     Returns:
         Generated image as bytes (PNG).
     """
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        None,
-        functools.partial(
-            _sync_generate,
-            product_image_path=product_image_path,
-            prompt=prompt,
-            width=width,
-            height=height,
-            steps=steps,
-        ),
+    image_bytes = await storage_io.read_bytes(product_image_path)
+    return await generate_scene_image_from_bytes(
+        image_bytes=image_bytes,
+        prompt=prompt,
+        width=width,
+        height=height,
+        steps=steps,
     )
 
 
@@ -97,40 +100,22 @@ async def generate_scene_image(
 # Provider interface wrapper (for provider_registry)
 # ---------------------------------------------------------------------------
 
+from app.services.prepared_input import PreparedInput  # noqa: E402
 from app.services.provider_base import ImageProvider  # noqa: E402
 
 
-def _sync_generate_from_bytes(
-    image_bytes: bytes,
-    prompt: str,
-    width: int = 1024,
-    height: int = 1024,
-    steps: int = 28,
-) -> bytes:
-    """Kimi generation from pre-loaded image bytes."""
-    import io
-    import tempfile
+# Map aspect_ratio to width/height for Kimi
+_ASPECT_DIMENSIONS = {
+    "1:1": (1024, 1024),
+    "3:4": (768, 1024),
+    "4:3": (1024, 768),
+    "9:16": (576, 1024),
+    "16:9": (1024, 576),
+}
 
-    client = _get_client()
 
-    image_b64 = base64.standard_b64encode(image_bytes).decode("utf-8")
-    data_url = f"data:image/png;base64,{image_b64}"
-
-    response = client.images.generate(
-        model="moonshotai/Kimi-K2.5",
-        prompt=prompt,
-        image_url=data_url,
-        width=width,
-        height=height,
-        steps=steps,
-        response_format="b64_json",
-    )
-
-    if response.data and len(response.data) > 0:
-        b64_data = response.data[0].b64_json
-        return base64.standard_b64decode(b64_data)
-
-    raise RuntimeError("No image returned from Kimi K2.5 API")
+def _dimensions(aspect_ratio: str) -> tuple[int, int]:
+    return _ASPECT_DIMENSIONS.get(aspect_ratio, (1024, 1024))
 
 
 class KimiProvider(ImageProvider):
@@ -140,30 +125,40 @@ class KimiProvider(ImageProvider):
     def name(self) -> str:
         return "kimi"
 
+    @property
+    def model(self) -> str:
+        return DEFAULT_MODEL
+
+    def is_configured(self) -> bool:
+        return bool(config.TOGETHER_API_KEY)
+
     async def generate(
         self,
         image_bytes: bytes,
         prompt: str,
         aspect_ratio: str = "1:1",
     ) -> bytes:
-        # Map aspect_ratio to width/height for Kimi
-        ar_map = {
-            "1:1": (1024, 1024),
-            "3:4": (768, 1024),
-            "4:3": (1024, 768),
-            "9:16": (576, 1024),
-            "16:9": (1024, 576),
-        }
-        width, height = ar_map.get(aspect_ratio, (1024, 1024))
-
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(
-            None,
-            functools.partial(
-                _sync_generate_from_bytes,
-                image_bytes=image_bytes,
-                prompt=prompt,
-                width=width,
-                height=height,
-            ),
+        width, height = _dimensions(aspect_ratio)
+        return await generate_scene_image_from_bytes(
+            image_bytes=image_bytes,
+            prompt=prompt,
+            width=width,
+            height=height,
+        )
+
+    async def generate_prepared(
+        self,
+        prepared: PreparedInput,
+        prompt: str,
+        aspect_ratio: str = "1:1",
+    ) -> bytes:
+        # Reuse the cached base64 data URL instead of re-encoding per call
+        payload = await prepared.payload(self.max_input_side, data_url=True)
+        width, height = _dimensions(aspect_ratio)
+        return await generate_scene_image_from_bytes(
+            image_bytes=payload.data,
+            prompt=prompt,
+            width=width,
+            height=height,
+            image_url=payload.data_url,
         )
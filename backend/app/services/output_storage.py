@@ -0,0 +1,285 @@
+"""
+Storage format policy for generated outputs.
+
+Provider output used to be written as returned ({template_id}.png, plus
+up to 4 variants per template), so the outputs volume grew by gigabytes a
+day. Outputs are now stored as a master in OUTPUT_STORAGE_FORMAT —
+lossless WebP by default, or high-quality AVIF / JPEG — next to where the
+PNG used to be (hero.png -> hero.webp). A master is only kept when it is
+smaller than what the provider returned.
+
+Everything else keeps addressing outputs by their logical ``.png`` path
+(GeneratedImageResult.output_path, DB rows, URLs); locate() finds the
+file actually stored for it. PNG is produced only when a client or
+export asks for it: the outputs router materializes it into the
+thumbnail cache, read_png() encodes it for ZIP entries.
+
+recompress_existing() converts PNG outputs written before the policy (or
+under "png") in the background, one image at a time on the "storage"
+process pool. Byte savings and encode time are recorded per image.
+
+Usage:
+    stored = await output_storage.save(task_output_dir / "hero.png", image_bytes)
+    path = await output_storage.locate(Path(r.output_path))  # hero.webp
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from pathlib import Path
+
+import aiofiles.os
+
+from app.config import (
+    OUTPUT_DIR,
+    OUTPUT_RECOMPRESS_MIN_AGE_SECONDS,
+    OUTPUT_STORAGE_FORMAT,
+)
+from app.services import executors, image_export, storage_io
+
+logger = logging.getLogger(__name__)
+
+# File suffix per storage format; a logical path's own suffix is tried first
+SUFFIXES = {"png": ".png", "webp": ".webp", "avif": ".avif", "jpeg": ".jpg"}
+FORMAT_OF_SUFFIX = {suffix: fmt for fmt, suffix in SUFFIXES.items()}
+
+# Per-image records kept for /api/health/storage
+RECENT_RECORDS = 200
+
+if OUTPUT_STORAGE_FORMAT not in SUFFIXES:
+    logger.warning(f"Unknown OUTPUT_STORAGE_FORMAT {OUTPUT_STORAGE_FORMAT!r}; storing PNG")
+STORAGE_FORMAT = OUTPUT_STORAGE_FORMAT if OUTPUT_STORAGE_FORMAT in SUFFIXES else "png"
+
+_totals = {"images": 0, "kept_original": 0, "original_bytes": 0, "stored_bytes": 0, "encode_ms": 0.0}
+_recent: deque[dict] = deque(maxlen=RECENT_RECORDS)
+_recompress = {"running": False, "scanned": 0, "converted": 0, "kept": 0, "failed": 0}
+# One writer at a time per logical output (save / copy / recompress)
+_path_locks: dict[Path, asyncio.Lock] = {}
+_recompress_task: asyncio.Task | None = None
+
+
+def _candidates(path: Path) -> list[Path]:
+    return [path] + [path.with_suffix(s) for s in SUFFIXES.values() if s != path.suffix]
+
+
+def resolve(path: Path) -> Path | None:
+    """The stored file for logical output ``path`` (blocking), or None."""
+    for candidate in _candidates(path):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+async def locate(path: Path) -> Path | None:
+    """The stored file for logical output ``path``, or None if there is none."""
+    return await executors.run("default", resolve, Path(path))
+
+
+def format_of(path: Path) -> str | None:
+    return FORMAT_OF_SUFFIX.get(path.suffix.lower())
+
+
+def list_outputs(directory: Path) -> list[Path]:
+    """Logical (.png) paths of every output stored in ``directory`` (blocking)."""
+    found = {
+        p.with_suffix(".png")
+        for p in directory.iterdir()
+        if p.suffix.lower() in FORMAT_OF_SUFFIX and not p.name.startswith(".") and p.is_file()
+    }
+    return sorted(found)
+
+
+def _record(path: Path, fmt: str, original: int, stored: int, encode_ms: float, origin: str) -> None:
+    _totals["images"] += 1
+    _totals["kept_original"] += stored == original
+    _totals["original_bytes"] += original
+    _totals["stored_bytes"] += stored
+    _totals["encode_ms"] += encode_ms
+    _recent.append({
+        "path": f"{path.parent.name}/{path.name}",
+        "format": fmt,
+        "original_bytes": original,
+        "stored_bytes": stored,
+        "saved_bytes": original - stored,
+        "encode_ms": encode_ms,
+        "origin": origin,
+    })
+
+
+async def _remove_siblings(path: Path, keep: Path) -> None:
+    for candidate in _candidates(path):
+        if candidate != keep:
+            try:
+                await aiofiles.os.remove(candidate)
+            except FileNotFoundError:
+                pass
+
+
+def _lock(path: Path) -> asyncio.Lock:
+    return _path_locks.setdefault(path, asyncio.Lock())
+
+
+def _release(path: Path, lock: asyncio.Lock) -> None:
+    if not lock.locked() and _path_locks.get(path) is lock:
+        del _path_locks[path]
+
+
+async def save(path: Path, data: bytes, fmt: str = STORAGE_FORMAT) -> Path:
+    """Store provider output ``data`` for logical output ``path``.
+
+    Written as a ``fmt`` master when that is smaller, as is otherwise;
+    any previously stored file for ``path`` is removed. Returns the file
+    written.
+    """
+    path = Path(path)
+    encoded, encode_ms = None, 0.0
+    if fmt != "png":
+        encoded, encode_ms = await executors.run_in_process("storage", image_export.encode_master, data, fmt)
+    target = path.with_suffix(SUFFIXES[fmt]) if encoded is not None else path
+    lock = _lock(path)
+    try:
+        async with lock:
+            await storage_io.write_bytes(target, encoded if encoded is not None else data)
+            await _remove_siblings(path, keep=target)
+    finally:
+        _release(path, lock)
+    stored_fmt = fmt if encoded is not None else "png"
+    _record(path, stored_fmt, len(data), len(encoded) if encoded is not None else len(data), encode_ms, "generated")
+    return target
+
+
+async def copy(src: Path, dst: Path) -> Path:
+    """Copy the stored file of logical output ``src`` to logical output ``dst``."""
+    stored = await locate(src)
+    if stored is None:
+        raise FileNotFoundError(src)
+    dst = Path(dst)
+    target = dst.with_suffix(stored.suffix)
+    lock = _lock(dst)
+    try:
+        async with lock:
+            await storage_io.copy(stored, target)
+            await _remove_siblings(dst, keep=target)
+    finally:
+        _release(dst, lock)
+    return target
+
+
+async def read_png(path: Path) -> bytes | None:
+    """PNG bytes of logical output ``path`` (encoded if stored otherwise); None if gone."""
+    stored = await locate(path)
+    if stored is None:
+        return None
+    if stored.suffix == ".png":
+        try:
+            return await storage_io.read_bytes(stored)
+        except FileNotFoundError:
+            return None
+    return await executors.run_in_process("export", image_export.render_thumbnail, stored, None, "png")
+
+
+def _scan_pngs(root: Path, min_age: float) -> list[Path]:
+    cutoff = time.time() - min_age
+    found = []
+    for task_dir in root.iterdir():
+        if not task_dir.is_dir() or task_dir.name.startswith("."):
+            continue
+        for p in task_dir.glob("*.png"):
+            if not p.name.startswith(".") and p.stat().st_mtime < cutoff:
+                found.append(p)
+    return found
+
+
+async def _recompress_one(png: Path, fmt: str) -> None:
+    try:
+        before = await aiofiles.os.stat(png)
+        data = await storage_io.read_bytes(png)
+    except FileNotFoundError:
+        return
+    encoded, encode_ms = await executors.run_in_process("storage", image_export.encode_master, data, fmt)
+    if encoded is None:
+        _recompress["kept"] += 1
+        return
+    lock = _lock(png)
+    try:
+        async with lock:
+            try:
+                current = await aiofiles.os.stat(png)
+            except FileNotFoundError:
+                return  # replaced meanwhile
+            if (current.st_mtime_ns, current.st_size) != (before.st_mtime_ns, before.st_size):
+                return  # rewritten meanwhile; picked up by the next run
+            await storage_io.write_bytes(png.with_suffix(SUFFIXES[fmt]), encoded)
+            await aiofiles.os.remove(png)
+    finally:
+        _release(png, lock)
+    _recompress["converted"] += 1
+    _record(png, fmt, len(data), len(encoded), encode_ms, "recompressed")
+
+
+async def recompress_existing(
+    fmt: str = STORAGE_FORMAT,
+    min_age: float = OUTPUT_RECOMPRESS_MIN_AGE_SECONDS,
+) -> int:
+    """Convert stored PNG outputs older than ``min_age`` seconds to ``fmt`` masters.
+
+    Runs one image at a time so it stays in the background; safe to run
+    in several processes at once. Returns the number of images converted.
+    """
+    if fmt == "png" or _recompress["running"]:
+        return 0
+    _recompress["running"] = True
+    converted_before = _recompress["converted"]
+    saved_before = _totals["original_bytes"] - _totals["stored_bytes"]
+    started = time.perf_counter()
+    pngs: list[Path] = []
+    try:
+        pngs = await executors.run("default", _scan_pngs, OUTPUT_DIR, min_age)
+        _recompress["scanned"] += len(pngs)
+        for png in pngs:
+            try:
+                await _recompress_one(png, fmt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _recompress["failed"] += 1
+                logger.warning(f"Recompressing {png} failed: {e}")
+    finally:
+        _recompress["running"] = False
+    converted = _recompress["converted"] - converted_before
+    if pngs:
+        saved = _totals["original_bytes"] - _totals["stored_bytes"] - saved_before
+        logger.info(
+            f"Recompressed {converted}/{len(pngs)} outputs to {fmt}, "
+            f"saved {saved / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.1f}s"
+        )
+    return converted
+
+
+def start_recompress() -> None:
+    """Run recompress_existing() in the background (once per process)."""
+    global _recompress_task
+    if STORAGE_FORMAT != "png" and (_recompress_task is None or _recompress_task.done()):
+        _recompress_task = asyncio.create_task(recompress_existing())
+
+
+def stop_recompress() -> None:
+    if _recompress_task is not None:
+        _recompress_task.cancel()
+
+
+def stats() -> dict:
+    images = _totals["images"]
+    return {
+        "format": STORAGE_FORMAT,
+        **_totals,
+        "encode_ms": round(_totals["encode_ms"], 1),
+        "saved_bytes": _totals["original_bytes"] - _totals["stored_bytes"],
+        "ratio": round(_totals["stored_bytes"] / _totals["original_bytes"], 3) if _totals["original_bytes"] else None,
+        "avg_encode_ms": round(_totals["encode_ms"] / images, 1) if images else None,
+        "recompress": dict(_recompress),
+        "recent": list(_recent),
+    }
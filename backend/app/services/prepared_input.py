@@ -0,0 +1,183 @@
+"""
+Prepared product-image inputs, built once and shared by every provider call.
+
+A 9-image job (plus any regenerates / variants) sends the same product
+image to the provider many times. PreparedInput reads the upload once,
+applies EXIF orientation, downscales to each provider's max useful input
+size and keeps the encoded payload — JPEG, or PNG when the image has
+transparency (e.g. after background removal) — plus its base64 data URL
+for providers that want one. Payloads are built off the event loop, once
+per (image, max side).
+
+Entries are keyed by the upload's path, size and mtime and kept in a
+small LRU (PREPARED_INPUT_CACHE_SIZE), so regenerate and variants reuse
+the work done for the original job.
+
+Usage:
+    prepared = await prepared_input.get(task.image_path)
+    payload = await prepared.payload(max_side=2048, data_url=True)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import aiofiles.os
+from PIL import Image, ImageOps
+
+from app.config import PREPARED_INPUT_CACHE_SIZE, PREPARED_JPEG_QUALITY
+from app.services import executors, storage_io
+
+logger = logging.getLogger(__name__)
+
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass(slots=True)
+class ProviderPayload:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    data_url: str | None = None
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _normalize(source: bytes, max_side: int) -> ProviderPayload:
+    """Orient, downscale and encode ``source`` for a provider."""
+    img = Image.open(io.BytesIO(source))
+    orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+    if orientation == 1 and max(img.size) <= max_side and img.format in ("PNG", "JPEG"):
+        # Already upright and small enough — send the original bytes
+        return ProviderPayload(source, Image.MIME[img.format], *img.size)
+
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))  # decode at reduced scale
+    img = ImageOps.exif_transpose(img)
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    buf = io.BytesIO()
+    if _has_alpha(img):
+        img.save(buf, format="PNG")
+        mime_type = "image/png"
+    else:
+        img.convert("RGB").save(buf, format="JPEG", quality=PREPARED_JPEG_QUALITY)
+        mime_type = "image/jpeg"
+    return ProviderPayload(buf.getvalue(), mime_type, *img.size)
+
+
+def _to_data_url(payload: ProviderPayload) -> str:
+    return f"data:{payload.mime_type};base64,{base64.standard_b64encode(payload.data).decode('ascii')}"
+
+
+class PreparedInput:
+    """One product image with its per-size provider payloads."""
+
+    __slots__ = ("digest", "source", "_payloads", "_lock")
+
+    def __init__(self, source: bytes, digest: str):
+        self.source = source
+        self.digest = digest  # sha256 of the original upload (result cache key)
+        self._payloads: dict[int, ProviderPayload] = {}
+        self._lock = asyncio.Lock()
+
+    async def payload(self, max_side: int, data_url: bool = False) -> ProviderPayload:
+        payload = self._payloads.get(max_side)
+        if payload is not None and (payload.data_url is not None or not data_url):
+            return payload
+        async with self._lock:
+            payload = self._payloads.get(max_side)
+            if payload is None:
+                payload = await executors.run("default", _normalize, self.source, max_side)
+                self._payloads[max_side] = payload
+                logger.info(
+                    f"Prepared input {self.digest[:12]} @ {max_side}px: "
+                    f"{payload.width}x{payload.height} {payload.mime_type}, "
+                    f"{len(self.source)} → {len(payload.data)} bytes"
+                )
+            if data_url and payload.data_url is None:
+                payload.data_url = await executors.run("default", _to_data_url, payload)
+            return payload
+
+    @property
+    def nbytes(self) -> int:
+        total = len(self.source)
+        for p in self._payloads.values():
+            total += len(p.data) + len(p.data_url or "")
+        return total
+
+
+class PreparedInputCache:
+    """LRU of PreparedInput keyed by (path, size, mtime), with build coalescing."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, PreparedInput] = OrderedDict()
+        self._building: dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    async def _build(path: Path) -> PreparedInput:
+        source = await storage_io.read_bytes(path)
+        digest = await executors.run("default", lambda: hashlib.sha256(source).hexdigest())
+        return PreparedInput(source, digest)
+
+    async def get(self, path: Path) -> PreparedInput:
+        st = await aiofiles.os.stat(path)
+        key = (str(path), st.st_size, st.st_mtime_ns)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        building = self._building.get(key)
+        if building is None:
+            self.misses += 1
+            building = asyncio.create_task(self._build(path))
+            self._building[key] = building
+            building.add_done_callback(lambda _t, key=key: self._building.pop(key, None))
+        entry = await asyncio.shield(building)
+
+        if key not in self._entries:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": sum(e.nbytes for e in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_cache = PreparedInputCache(PREPARED_INPUT_CACHE_SIZE)
+
+
+async def get(path: Path) -> PreparedInput:
+    """Prepared input for an uploaded product image (cached)."""
+    return await _cache.get(path)
+
+
+def stats() -> dict:
+    return _cache.stats()
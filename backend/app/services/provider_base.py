@@ -5,7 +5,17 @@ All providers (Gemini, Kimi, Banana Pro, etc.) must implement this interface.
 This enables hot-swapping providers without changing the generation pipeline.
 """
 
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from app.config import PROVIDER_MAX_INPUT_SIDE
+
+if TYPE_CHECKING:
+    from app.services.prepared_input import PreparedInput
+
+DEFAULT_MAX_INPUT_SIDE = 2048
 
 
 class ImageProvider(ABC):
@@ -17,6 +27,34 @@ class ImageProvider(ABC):
         """Provider name (e.g., 'gemini', 'kimi', 'banana_pro')."""
         ...
 
+    @property
+    def model(self) -> str:
+        """Model identifier used for generation (part of result cache keys)."""
+        return "default"
+
+    def is_configured(self) -> bool:
+        """Whether the provider has the credentials it needs to be called."""
+        return True
+
+    @property
+    def max_input_side(self) -> int:
+        """Longest input side worth sending; larger product images are downscaled."""
+        return PROVIDER_MAX_INPUT_SIDE.get(self.name, DEFAULT_MAX_INPUT_SIDE)
+
+    async def generate_prepared(
+        self,
+        prepared: PreparedInput,
+        prompt: str,
+        aspect_ratio: str = "1:1",
+    ) -> bytes:
+        """Generate from a shared PreparedInput (see prepared_input.py).
+
+        The default sends the prepared payload bytes through generate();
+        providers override this to use richer cached payloads.
+        """
+        payload = await prepared.payload(self.max_input_side)
+        return await self.generate(payload.data, prompt, aspect_ratio)
+
     @abstractmethod
     async def generate(
         self,
@@ -1,6 +1,15 @@
 """
 Provider registry: register and look up image generation providers.
 
+Each registered provider also has a ProviderHealth record — a rolling
+window of outcomes and latencies plus a circuit breaker:
+
+- closed:    requests flow normally
+- open:      error rate or consecutive failures crossed the threshold;
+             requests fail fast (or are rerouted) for CIRCUIT_OPEN_SECONDS
+- half_open: cool-down elapsed; a limited number of probe requests are let
+             through — success closes the circuit, failure re-opens it
+
 Usage:
     from app.services.provider_registry import ProviderRegistry
 
@@ -9,23 +18,165 @@ Usage:
 """
 
 import logging
+import time
+from collections import deque
+from enum import Enum
 from typing import Optional
 
+from app.config import (
+    CIRCUIT_CONSECUTIVE_FAILURES,
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_HALF_OPEN_PROBES,
+    CIRCUIT_MIN_SAMPLES,
+    CIRCUIT_OPEN_SECONDS,
+    CIRCUIT_WINDOW_SECONDS,
+)
 from app.services.provider_base import ImageProvider
 
 logger = logging.getLogger(__name__)
 
+# Max outcomes kept per provider (older ones also age out of the window)
+HEALTH_SAMPLE_SIZE = 500
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, provider: str):
+        super().__init__(f"Provider '{provider}' is temporarily unavailable (circuit open)")
+        self.provider = provider
+
+
+class ProviderHealth:
+    """Rolling success rate / latency and circuit state for one provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.half_open_in_flight = 0
+        self.total_successes = 0
+        self.total_failures = 0
+        self.rejected = 0
+        # (timestamp, ok, latency_seconds)
+        self._outcomes: deque[tuple[float, bool, float]] = deque(maxlen=HEALTH_SAMPLE_SIZE)
+
+    def _trim(self) -> None:
+        cutoff = time.monotonic() - CIRCUIT_WINDOW_SECONDS
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def error_rate(self) -> tuple[float, int]:
+        """(error_rate, sample_count) over the rolling window."""
+        self._trim()
+        n = len(self._outcomes)
+        if n == 0:
+            return 0.0, 0
+        return sum(1 for _, ok, _ in self._outcomes if not ok) / n, n
+
+    def _refresh(self) -> None:
+        if self.state == CircuitState.OPEN and time.monotonic() - self.opened_at >= CIRCUIT_OPEN_SECONDS:
+            self.state = CircuitState.HALF_OPEN
+            self.half_open_in_flight = 0
+            logger.info(f"Circuit for {self.name} half-open: probing")
+
+    def is_available(self) -> bool:
+        """Whether a request would currently be let through (no side effects)."""
+        self._refresh()
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.HALF_OPEN:
+            return self.half_open_in_flight < CIRCUIT_HALF_OPEN_PROBES
+        return False
+
+    def try_acquire(self) -> bool:
+        """Admit a request. Must be paired with record() or release()."""
+        if not self.is_available():
+            self.rejected += 1
+            return False
+        if self.state == CircuitState.HALF_OPEN:
+            self.half_open_in_flight += 1
+        return True
+
+    def release(self) -> None:
+        """Finish an admitted request without counting an outcome."""
+        if self.state == CircuitState.HALF_OPEN and self.half_open_in_flight > 0:
+            self.half_open_in_flight -= 1
+
+    def _open(self, reason: str) -> None:
+        self.state = CircuitState.OPEN
+        self.opened_at = time.monotonic()
+        self.half_open_in_flight = 0
+        logger.warning(f"Circuit for {self.name} opened: {reason}")
+
+    def record(self, ok: bool, latency: float) -> None:
+        self._outcomes.append((time.monotonic(), ok, latency))
+        was_half_open = self.state == CircuitState.HALF_OPEN
+        self.release()
+
+        if ok:
+            self.total_successes += 1
+            self.consecutive_failures = 0
+            if was_half_open:
+                self.state = CircuitState.CLOSED
+                self._outcomes.clear()
+                logger.info(f"Circuit for {self.name} closed: probe succeeded")
+            return
+
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if was_half_open:
+            self._open("probe failed")
+        elif self.state == CircuitState.CLOSED:
+            rate, n = self.error_rate()
+            if self.consecutive_failures >= CIRCUIT_CONSECUTIVE_FAILURES:
+                self._open(f"{self.consecutive_failures} consecutive failures")
+            elif n >= CIRCUIT_MIN_SAMPLES and rate >= CIRCUIT_ERROR_RATE:
+                self._open(f"error rate {rate:.0%} over {n} calls")
+
+    def snapshot(self) -> dict:
+        self._refresh()
+        rate, n = self.error_rate()
+        latencies = sorted(lat for _, ok, lat in self._outcomes if ok)
+        k = len(latencies)
+        return {
+            "state": self.state.value,
+            "success_rate": round(1 - rate, 3) if n else None,
+            "samples": n,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_seconds": {
+                "p50": round(latencies[k // 2], 2) if k else None,
+                "p95": round(latencies[min(k - 1, int(k * 0.95))], 2) if k else None,
+            },
+            "open_for_seconds": (
+                round(max(0.0, CIRCUIT_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1)
+                if self.state == CircuitState.OPEN else 0.0
+            ),
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+        }
+
 
 class ProviderRegistry:
     """Central registry for image generation providers."""
 
     _providers: dict[str, ImageProvider] = {}
+    _health: dict[str, ProviderHealth] = {}
     _default: Optional[str] = None
 
     @classmethod
     def register(cls, provider: ImageProvider, is_default: bool = False) -> None:
         """Register an image provider."""
         cls._providers[provider.name] = provider
+        cls._health.setdefault(provider.name, ProviderHealth(provider.name))
         if is_default or cls._default is None:
             cls._default = provider.name
         logger.info(f"Registered provider: {provider.name} (default={is_default})")
@@ -48,3 +199,38 @@ class ProviderRegistry:
     def list_providers(cls) -> list[str]:
         """List all registered provider names."""
         return list(cls._providers.keys())
+
+    @classmethod
+    def health(cls, name: str) -> ProviderHealth:
+        """Health / circuit-breaker record for a provider."""
+        if name not in cls._health:
+            cls._health[name] = ProviderHealth(name)
+        return cls._health[name]
+
+    @classmethod
+    def is_available(cls, name: str) -> bool:
+        """Registered, configured and not circuit-open."""
+        provider = cls._providers.get(name)
+        return provider is not None and provider.is_configured() and cls.health(name).is_available()
+
+    @classmethod
+    def health_snapshot(cls) -> dict[str, dict]:
+        return {
+            name: {
+                "default": name == cls._default,
+                "configured": provider.is_configured(),
+                **cls.health(name).snapshot(),
+            }
+            for name, provider in cls._providers.items()
+        }
+
+
+def register_builtin_providers() -> None:
+    """Register Gemini (default) and Kimi. Safe to call more than once."""
+    from app.services.gemini_service import GeminiProvider
+    from app.services.kimi_service import KimiProvider
+
+    if "gemini" not in ProviderRegistry._providers:
+        ProviderRegistry.register(GeminiProvider(), is_default=True)
+    if "kimi" not in ProviderRegistry._providers:
+        ProviderRegistry.register(KimiProvider())
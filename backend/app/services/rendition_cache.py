@@ -0,0 +1,198 @@
+"""
+On-disk cache of resized platform renditions of generated images.
+
+Each download for a platform (PLATFORM_SPECS, or an export's custom
+size) used to decode and resize every output again. Renditions are now
+rendered once per (output content hash, width x height, format) and kept
+under RENDITION_CACHE_DIR with least-recently-used eviction
+(RENDITION_CACHE_MAX_BYTES), so repeat downloads only read files.
+
+get_many() renders every missing target of a source in a single call on
+the "export" process pool, so the source is decoded once however many
+platform sizes are requested. Concurrent requests for the same source
+wait for that render and then read the cache.
+
+Composite grids (get_composite) are cached the same way, keyed by the
+content hashes of their images and the layout parameters.
+
+Sources are logical output paths, resolved to the stored master (see
+output_storage.py). Keys are content-addressed, so a changed output never
+serves a stale rendition. regenerate / select-variant additionally call invalidate()
+to drop the renditions of the image being replaced.
+
+Usage:
+    png_bytes = await rendition_cache.get(Path(r.output_path), 800, 800)
+    shopee, story = await rendition_cache.get_many(path, [(800, 800, "png"), (1080, 1920, "png")])
+    await rendition_cache.invalidate(output_path)  # before overwriting it
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+import aiofiles.os
+
+from app.config import RENDITION_CACHE_DIR, RENDITION_CACHE_MAX_BYTES
+from app.services import executors, image_export, output_storage
+from app.services.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Source digests remembered by (path, size, mtime_ns)
+DIGEST_MEMO_SIZE = 10_000
+
+_cache = ResultCache(RENDITION_CACHE_DIR, RENDITION_CACHE_MAX_BYTES, suffix=".bin")
+_digests: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+# One render at a time per source content; later callers then hit the cache
+_source_locks: dict[str, asyncio.Lock] = {}
+
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def source_digest(source: Path) -> str | None:
+    """sha256 of an output file (memoized), or None if it does not exist."""
+    try:
+        st = await aiofiles.os.stat(source)
+    except FileNotFoundError:
+        return None
+    memo_key = (str(source), st.st_size, st.st_mtime_ns)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        digest = await executors.run("default", _hash_file, source)
+        _digests[memo_key] = digest
+        while len(_digests) > DIGEST_MEMO_SIZE:
+            _digests.popitem(last=False)
+    else:
+        _digests.move_to_end(memo_key)
+    return digest
+
+
+def rendition_key(digest: str, width: int, height: int, fmt: str) -> str:
+    return f"{digest}_{width}x{height}.{fmt}"
+
+
+Target = tuple[int, int, str]  # (width, height, format)
+
+
+async def get_many(
+    source: Path,
+    targets: list[Target],
+    timings: dict | None = None,
+) -> list[bytes | None]:
+    """Renditions of ``source`` for every target, decoding it at most once.
+
+    Cached targets are read from disk; the missing ones are rendered
+    together in one export worker call. Decode / render times and cache
+    hits are added to ``timings`` when given. All None if the source is gone.
+    """
+    source = await output_storage.locate(source)
+    digest = await source_digest(source) if source is not None else None
+    if digest is None:
+        return [None] * len(targets)
+
+    lock = _source_locks.setdefault(digest, asyncio.Lock())
+    try:
+        async with lock:
+            return await _fill(source, digest, targets, timings)
+    finally:
+        if not lock.locked() and _source_locks.get(digest) is lock:
+            del _source_locks[digest]
+
+
+async def _fill(source: Path, digest: str, targets: list[Target], timings: dict | None) -> list[bytes | None]:
+    keys = [rendition_key(digest, *target) for target in targets]
+    results: list[bytes | None] = [await _cache.get(key) for key in keys]
+    missing = [i for i, data in enumerate(results) if data is None]
+    _cache.hits += len(targets) - len(missing)
+    _cache.misses += len(missing)
+    if timings is not None:
+        timings["cache_hits"] = timings.get("cache_hits", 0) + len(targets) - len(missing)
+    if not missing:
+        return results
+
+    rendered = await executors.run_in_process(
+        "export", image_export.render_targets, source, [targets[i] for i in missing]
+    )
+    if rendered is None:
+        return [None] * len(targets)
+    images, render_timings = rendered
+    for i, data in zip(missing, images):
+        results[i] = data
+        try:
+            await _cache.put(keys[i], data)
+        except Exception as e:
+            logger.warning(f"Failed to store rendition {keys[i]}: {e}")
+    if timings is not None:
+        timings["decodes"] = timings.get("decodes", 0) + 1
+        timings["decode_ms"] = timings.get("decode_ms", 0.0) + render_timings["decode_ms"]
+        timings["render_ms"] = timings.get("render_ms", 0.0) + sum(render_timings["render_ms"])
+    return results
+
+
+async def get(source: Path, width: int, height: int, fmt: str = "png") -> bytes | None:
+    """Rendition of ``source`` fitted into width x height; None if it is gone."""
+    return (await get_many(source, [(width, height, fmt)]))[0]
+
+
+async def get_composite(
+    sources: list[Path],
+    layout: str,
+    cell: int,
+    gap: int,
+    bg: tuple[int, int, int],
+    fmt: str = "png",
+) -> Path | None:
+    """Cached composite of ``sources`` (see image_export.render_composite).
+
+    Keyed by the sources' content hashes in order plus every layout
+    parameter, so any change to an output yields a new composite. Returns
+    the cached file, or None if no source could be rendered.
+    """
+    sources = [stored for source in sources if (stored := await output_storage.locate(source))]
+    digests = [await source_digest(source) for source in sources]
+    h = hashlib.sha256()
+    for part in (*[d or "" for d in digests], layout, str(cell), str(gap), "%02x%02x%02x" % bg, fmt):
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    key = f"{h.hexdigest()}.composite.{fmt}"
+
+    async def render() -> bytes:
+        data = await executors.run_in_process(
+            "export", image_export.render_composite, sources, layout, cell, gap, bg, fmt
+        )
+        if data is None:
+            raise FileNotFoundError("no readable images for composite")
+        return data
+
+    try:
+        return await _cache.get_path(key, render)
+    except FileNotFoundError:
+        return None
+
+
+async def invalidate(source: Path) -> int:
+    """Drop cached renditions of ``source``'s current content."""
+    source = await output_storage.locate(source) or source
+    digest = await source_digest(source)
+    for memo_key in [k for k in _digests if k[0] == str(source)]:
+        del _digests[memo_key]
+    if digest is None:
+        return 0
+    removed = await _cache.discard(lambda key: key.startswith(digest))
+    if removed:
+        logger.info(f"Invalidated {removed} renditions of {source.name}")
+    return removed
+
+
+def stats() -> dict:
+    return {**_cache.stats(), "memoized_digests": len(_digests)}
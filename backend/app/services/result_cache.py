@@ -0,0 +1,288 @@
+"""
+Content-addressed cache for provider generation results.
+
+The key is a hash of everything that determines the provider request:
+the input image's content hash, the fully assembled prompt (style injection + colour
+coherence prefix), aspect ratio, model and provider. Results are stored
+as files under OUTPUT_DIR/.cache, bounded by RESULT_CACHE_MAX_BYTES with
+least-recently-used eviction.
+
+Identical requests that arrive while one is already in flight share that
+single provider call (singleflight) instead of each hitting the API.
+A result served by another provider than the one asked for (failover,
+hedge) is stored under that provider's key via ``store_key``.
+
+Usage:
+    key = result_cache.make_key(prepared.digest, prompt, "1:1", model, "gemini")
+    image_bytes, hit = await result_cache.get_or_generate(key, producer)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from app.config import RESULT_CACHE_DIR, RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_BYTES
+from app.services import executors
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(
+    image_digest: str,
+    prompt: str,
+    aspect_ratio: str,
+    model: str,
+    provider: str,
+) -> str:
+    """Content hash identifying a single provider request.
+
+    ``image_digest`` is the sha256 hex digest of the product image.
+    """
+    h = hashlib.sha256()
+    for part in (image_digest, prompt, aspect_ratio, model, provider):
+        h.update(b"\0")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResultCache:
+    """LRU, size-bounded on-disk store with in-flight request coalescing."""
+
+    def __init__(self, cache_dir: Path, max_bytes: int, suffix: str = ".png"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._index: OrderedDict[str, int] = OrderedDict()  # key -> size, LRU order
+        self._total_bytes = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._inflight: dict[str, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _scan(self) -> list[tuple[str, int, float]]:
+        entries = []
+        if self.cache_dir.exists():
+            for p in self.cache_dir.glob(f"*/*{self.suffix}"):
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                entries.append((p.stem, st.st_size, st.st_mtime))
+        entries.sort(key=lambda e: e[2])  # oldest first
+        return entries
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for key, size, _mtime in await executors.run("default", self._scan):
+                self._index[key] = size
+                self._total_bytes += size
+            self._loaded = True
+            logger.info(
+                f"Result cache loaded: {len(self._index)} entries, "
+                f"{self._total_bytes / 1024 / 1024:.1f} MB"
+            )
+
+    @staticmethod
+    def _read(path: Path) -> bytes | None:
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # persist recency across restarts
+            return data
+        except OSError:
+            return None
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _unlink(paths: list[Path]) -> None:
+        for p in paths:
+            p.unlink(missing_ok=True)
+
+    async def get(self, key: str) -> bytes | None:
+        await self._ensure_loaded()
+        if key not in self._index:
+            return None
+        data = await executors.run("default", self._read, self._path(key))
+        if data is None:
+            self._total_bytes -= self._index.pop(key, 0)
+            return None
+        self._index.move_to_end(key)
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        await self._ensure_loaded()
+        if len(data) > self.max_bytes:
+            return
+        await executors.run("default", self._write, self._path(key), data)
+        self._total_bytes -= self._index.pop(key, 0)
+        self._index[key] = len(data)
+        self._total_bytes += len(data)
+
+        evicted: list[Path] = []
+        while self._total_bytes > self.max_bytes and self._index:
+            old_key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            evicted.append(self._path(old_key))
+        if evicted:
+            self.evictions += len(evicted)
+            await executors.run("default", self._unlink, evicted)
+
+    async def discard(self, match: Callable[[str], bool]) -> int:
+        """Remove every entry whose key satisfies ``match``."""
+        await self._ensure_loaded()
+        keys = [key for key in self._index if match(key)]
+        for key in keys:
+            self._total_bytes -= self._index.pop(key)
+        if keys:
+            await executors.run("default", self._unlink, [self._path(key) for key in keys])
+        return len(keys)
+
+    async def _produce(
+        self,
+        key: str,
+        producer: Callable[[], Awaitable[bytes]],
+        store_key: Callable[[], str | None] | None,
+    ) -> bytes:
+        data = await producer()
+        if store_key is not None:
+            key = store_key()
+            if key is None:
+                return data
+        try:
+            await self.put(key, data)
+        except Exception as e:
+            logger.warning(f"Failed to store result cache entry {key[:12]}: {e}")
+        return data
+
+    async def get_or_generate(
+        self,
+        key: str,
+        producer: Callable[[], Awaitable[bytes]],
+        store_key: Callable[[], str | None] | None = None,
+        on_join: Callable[[], Awaitable[None]] | None = None,
+    ) -> tuple[bytes, bool]:
+        """Return (image_bytes, cache_hit), calling ``producer`` at most once per key.
+
+        ``store_key``, called once ``producer`` returns, gives the key the
+        result is stored under (``key`` if not given, not stored if None).
+        ``on_join`` runs when this call joins one already in flight (its own
+        ``producer`` never runs).
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+
+        flight = self._inflight.get(key)
+        joined = flight is not None
+        if flight is None:
+            self.misses += 1
+            flight = _Flight(asyncio.create_task(self._produce(key, producer, store_key)))
+            self._inflight[key] = flight
+
+            def _done(_task: asyncio.Task, key: str = key, flight: _Flight = flight) -> None:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+
+            flight.task.add_done_callback(_done)
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            if joined and on_join is not None:
+                await on_join()
+            return await asyncio.shield(flight.task), False
+        finally:
+            flight.waiters -= 1
+            # Abort the provider call only once nobody is waiting for it
+            if flight.waiters == 0 and not flight.task.done():
+                # Unregister first so a caller arriving before the done
+                # callback runs starts a new call instead of joining this one
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+
+    async def get_path(
+        self,
+        key: str,
+        producer: Callable[[], Awaitable[bytes]],
+    ) -> Path | None:
+        """Like get_or_generate(), but return the cached file to serve directly.
+
+        None if the entry could not be stored (e.g. larger than the cache).
+        """
+        await self._ensure_loaded()
+        if key in self._index:
+            self.hits += 1
+            self._index.move_to_end(key)
+            path = self._path(key)
+            try:
+                await executors.run("default", os.utime, path)  # persist recency
+                return path
+            except FileNotFoundError:
+                self._total_bytes -= self._index.pop(key, 0)
+                self.hits -= 1
+        await self.get_or_generate(key, producer)
+        return self._path(key) if key in self._index else None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "in_flight": len(self._inflight),
+        }
+
+
+_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+
+async def get_or_generate(
+    key: str,
+    producer: Callable[[], Awaitable[bytes]],
+    use_cache: bool = True,
+    store_key: Callable[[], str | None] | None = None,
+    on_join: Callable[[], Awaitable[None]] | None = None,
+) -> tuple[bytes, bool]:
+    """Cached provider call. ``use_cache=False`` always calls the provider."""
+    if not use_cache or not RESULT_CACHE_ENABLED:
+        return await producer(), False
+    return await _cache.get_or_generate(key, producer, store_key, on_join)
+
+
+def stats() -> dict:
+    return {"enabled": RESULT_CACHE_ENABLED, **_cache.stats()}
@@ -0,0 +1,275 @@
+"""
+Retry policy engine for provider calls.
+
+- Errors are classified as retryable (timeouts, connection errors, 408 /
+  429 / 5xx, empty responses) or not (bad request, auth, missing key).
+- Retryable errors back off exponentially with full jitter, honouring a
+  provider's Retry-After header when one is present.
+- Outcomes feed each provider's circuit breaker (ProviderRegistry health).
+  When the preferred provider's circuit is open, the next registered,
+  configured and available ImageProvider is used instead; if none is
+  available the call fails fast without waiting on a timeout.
+- Every attempt is recorded so the effect of retries on tail latency can
+  be inspected via stats().
+
+Usage:
+    image_bytes = await retry_engine.execute("gemini", attempt)
+
+where ``attempt`` is ``async (provider: ImageProvider) -> bytes``; whatever
+it returns is passed through.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+import httpx
+
+from app.config import RETRY_BASE_DELAY, RETRY_MAX_ATTEMPTS, RETRY_MAX_DELAY
+from app.services.provider_base import ImageProvider
+from app.services.provider_registry import CircuitOpenError, ProviderRegistry
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Exception class names raised by provider SDKs for transport-level failures
+_TRANSIENT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+# Number of attempt / call records kept for stats
+RECORD_SAMPLE_SIZE = 1000
+
+
+def _status_code(exc: BaseException) -> int | None:
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether another attempt could plausibly succeed."""
+    if isinstance(exc, CircuitOpenError):
+        return False  # Rerouting already happened; nothing left to try
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError, ConnectionError)):
+        return True
+    if type(exc).__name__ in _TRANSIENT_ERROR_NAMES:
+        return True
+    code = _status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    if "API Key" in str(exc):
+        return False  # Missing key — retrying cannot help
+    # e.g. "No image returned" — the model occasionally answers with text only
+    return isinstance(exc, RuntimeError)
+
+
+@dataclass(slots=True)
+class RetryPolicy:
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+
+    def backoff(self, attempt: int, exc: BaseException | None = None) -> float:
+        """Full-jitter exponential backoff before attempt ``attempt + 1``."""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        hinted = _retry_after(exc) if exc is not None else None
+        if hinted is not None:
+            delay = max(delay, min(hinted, self.max_delay))
+        return delay
+
+
+@dataclass(slots=True)
+class AttemptRecord:
+    provider: str
+    attempt: int
+    ok: bool
+    latency: float
+    delay_before: float
+    error: str | None = None
+
+
+async def guarded_call(
+    provider: ImageProvider,
+    call: Callable[[ImageProvider], Awaitable[bytes]],
+) -> bytes:
+    """Call a provider through its circuit breaker, recording the outcome.
+
+    Only retryable (transient / server-side) errors count against the
+    provider's health; request errors such as a bad prompt do not.
+    """
+    health = ProviderRegistry.health(provider.name)
+    if not health.try_acquire():
+        raise CircuitOpenError(provider.name)
+    started = time.monotonic()
+    try:
+        result = await call(provider)
+    except asyncio.CancelledError:
+        health.release()
+        raise
+    except Exception as e:
+        if is_retryable(e):
+            health.record(False, time.monotonic() - started)
+        else:
+            health.release()
+        raise
+    health.record(True, time.monotonic() - started)
+    return result
+
+
+class RetryEngine:
+    """Executes provider calls under a RetryPolicy with cross-provider failover."""
+
+    def __init__(self, policy: RetryPolicy | None = None):
+        self.policy = policy or RetryPolicy()
+        self._attempts: deque[AttemptRecord] = deque(maxlen=RECORD_SAMPLE_SIZE)
+        # (attempt_count, total_latency, ok) per logical call
+        self._calls: deque[tuple[int, float, bool]] = deque(maxlen=RECORD_SAMPLE_SIZE)
+        self.failovers = 0
+
+    def choose_provider(self, preferred: str, exclude: set[str] | None = None) -> ImageProvider:
+        """Preferred provider unless its circuit is open and an available alternative exists.
+
+        A preferred provider that is not configured (no API key) is returned
+        as is, so the call fails fast with that error; silently sending its
+        templates to another provider would hide the misconfiguration.
+        """
+        exclude = exclude or set()
+        if preferred not in exclude and not ProviderRegistry.get(preferred).is_configured():
+            logger.warning(f"Provider {preferred} is not configured; not failing over to another provider")
+            return ProviderRegistry.get(preferred)
+        names = [preferred] + [n for n in ProviderRegistry.list_providers() if n != preferred]
+        for name in names:
+            if name not in exclude and ProviderRegistry.is_available(name):
+                return ProviderRegistry.get(name)
+        return ProviderRegistry.get(preferred)
+
+    async def execute(
+        self,
+        preferred: str,
+        attempt_fn: Callable[[ImageProvider], Awaitable[T]],
+        policy: RetryPolicy | None = None,
+    ) -> T:
+        policy = policy or self.policy
+        started = time.monotonic()
+        delay = 0.0
+        last_exc: BaseException | None = None
+
+        for attempt in range(1, policy.max_attempts + 1):
+            provider = self.choose_provider(preferred)
+            if provider.name != preferred:
+                self.failovers += 1
+                logger.warning(
+                    f"Failing over {preferred} → {provider.name} (attempt {attempt}, "
+                    f"{preferred} circuit {ProviderRegistry.health(preferred).state.value})"
+                )
+
+            attempt_start = time.monotonic()
+            try:
+                result = await attempt_fn(provider)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                latency = time.monotonic() - attempt_start
+                retryable = is_retryable(e)
+                self._attempts.append(AttemptRecord(
+                    provider.name, attempt, False, latency, delay, f"{type(e).__name__}: {e}"[:200],
+                ))
+                last_exc = e
+                if not retryable or attempt == policy.max_attempts:
+                    logger.error(
+                        f"{provider.name} attempt {attempt}/{policy.max_attempts} failed "
+                        f"({'non-retryable' if not retryable else 'giving up'}): {e}"
+                    )
+                    break
+                delay = policy.backoff(attempt, e)
+                logger.warning(
+                    f"{provider.name} attempt {attempt}/{policy.max_attempts} failed: {e} — "
+                    f"retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            latency = time.monotonic() - attempt_start
+            self._attempts.append(AttemptRecord(provider.name, attempt, True, latency, delay))
+            self._calls.append((attempt, time.monotonic() - started, True))
+            return result
+
+        self._calls.append((attempt, time.monotonic() - started, False))
+        assert last_exc is not None
+        raise last_exc
+
+    def stats(self) -> dict:
+        def percentiles(values: list[float]) -> dict:
+            values = sorted(values)
+            n = len(values)
+            if not n:
+                return {"count": 0}
+            return {
+                "count": n,
+                "p50": round(values[n // 2], 2),
+                "p95": round(values[min(n - 1, int(n * 0.95))], 2),
+                "p99": round(values[min(n - 1, int(n * 0.99))], 2),
+                "max": round(values[-1], 2),
+            }
+
+        providers: dict[str, dict] = {}
+        for rec in self._attempts:
+            p = providers.setdefault(rec.provider, {"attempts": 0, "failures": 0, "retries": 0})
+            p["attempts"] += 1
+            p["failures"] += 0 if rec.ok else 1
+            p["retries"] += 1 if rec.attempt > 1 else 0
+        for name, p in providers.items():
+            p["circuit"] = ProviderRegistry.health(name).state.value
+
+        return {
+            "policy": {
+                "max_attempts": self.policy.max_attempts,
+                "base_delay": self.policy.base_delay,
+                "max_delay": self.policy.max_delay,
+            },
+            "providers": providers,
+            "failovers": self.failovers,
+            "call_latency_seconds": {
+                "first_attempt": percentiles([t for a, t, ok in self._calls if ok and a == 1]),
+                "after_retry": percentiles([t for a, t, ok in self._calls if ok and a > 1]),
+                "failed": percentiles([t for a, t, ok in self._calls if not ok]),
+            },
+            "recent_attempts": [
+                {
+                    "provider": r.provider,
+                    "attempt": r.attempt,
+                    "ok": r.ok,
+                    "latency": round(r.latency, 2),
+                    "delay_before": round(r.delay_before, 2),
+                    "error": r.error,
+                }
+                for r in list(self._attempts)[-20:]
+            ],
+        }
+
+
+# Process-wide engine shared by every generation path
+retry_engine = RetryEngine()
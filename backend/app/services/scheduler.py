@@ -0,0 +1,223 @@
+"""
+Process-wide generation scheduler.
+
+Every provider call (run_generation, regenerate_single, generate_variants,
+batch SKUs) acquires a slot here instead of creating its own semaphore, so
+the total number of in-flight provider requests is bounded per provider no
+matter how many tasks are running.
+
+Waiting requests are ordered by:
+1. Priority class — interactive work is always dispatched before batch work.
+2. Per-user round robin — within a class, each user with queued work gets
+   one slot in turn, so one large job cannot starve everyone else.
+
+Usage:
+    from app.services.scheduler import Priority, scheduler
+
+    async with scheduler.slot("gemini", user_id, Priority.INTERACTIVE):
+        image_bytes = await provider.generate(...)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator
+
+from app.config import MAX_CONCURRENT_GENERATIONS, PROVIDER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Number of recent wait samples kept per provider for wait-time stats
+WAIT_SAMPLE_SIZE = 500
+
+
+class Priority(IntEnum):
+    """Scheduling class — lower value is dispatched first."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class _Waiter:
+    __slots__ = ("future", "user_key", "priority", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, user_key: str, priority: Priority):
+        self.future = future
+        self.user_key = user_key
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class _ProviderQueue:
+    """Slots and fair waiting queues for a single provider."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # priority -> user_key -> waiters (OrderedDict order = round-robin order)
+        self.queues: dict[Priority, OrderedDict[str, deque[_Waiter]]] = {
+            p: OrderedDict() for p in Priority
+        }
+        self.dispatched = 0
+        self.wait_samples: deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def depth(self, priority: Priority | None = None) -> int:
+        classes = [priority] if priority is not None else list(Priority)
+        return sum(len(q) for p in classes for q in self.queues[p].values())
+
+    def enqueue(self, waiter: _Waiter) -> None:
+        users = self.queues[waiter.priority]
+        users.setdefault(waiter.user_key, deque()).append(waiter)
+
+    def remove(self, waiter: _Waiter) -> None:
+        users = self.queues[waiter.priority]
+        pending = users.get(waiter.user_key)
+        if not pending:
+            return
+        try:
+            pending.remove(waiter)
+        except ValueError:
+            return
+        if not pending:
+            del users[waiter.user_key]
+
+    def next_waiter(self) -> _Waiter | None:
+        """Pop the next waiter: highest priority class, then round-robin by user."""
+        for priority in Priority:
+            users = self.queues[priority]
+            while users:
+                user_key, pending = next(iter(users.items()))
+                waiter = pending.popleft()
+                if pending:
+                    users.move_to_end(user_key)
+                else:
+                    del users[user_key]
+                if not waiter.future.done():
+                    return waiter
+        return None
+
+
+class GenerationScheduler:
+    """Fair-share, priority-aware concurrency limiter for provider calls."""
+
+    def __init__(
+        self,
+        provider_limits: dict[str, int] | None = None,
+        default_limit: int = MAX_CONCURRENT_GENERATIONS,
+    ):
+        self._provider_limits = dict(provider_limits or {})
+        self._default_limit = default_limit
+        self._queues: dict[str, _ProviderQueue] = {}
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            limit = self._provider_limits.get(provider, self._default_limit)
+            queue = _ProviderQueue(max(1, limit))
+            self._queues[provider] = queue
+        return queue
+
+    def set_limit(self, provider: str, limit: int) -> None:
+        """Change a provider's concurrency cap at runtime."""
+        self._provider_limits[provider] = limit
+        queue = self._queue(provider)
+        queue.limit = max(1, limit)
+        self._dispatch(queue)
+
+    async def acquire(
+        self,
+        provider: str,
+        user_id: str | None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> float:
+        """Wait for a slot on ``provider``. Returns seconds spent waiting."""
+        queue = self._queue(provider)
+        user_key = user_id or "anonymous"
+
+        if queue.active < queue.limit and queue.depth() == 0:
+            queue.active += 1
+            queue.dispatched += 1
+            queue.wait_samples.append(0.0)
+            return 0.0
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), user_key, priority)
+        queue.enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Slot was granted just as we were cancelled — hand it on
+                self.release(provider)
+            else:
+                queue.remove(waiter)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        queue.wait_samples.append(waited)
+        return waited
+
+    def release(self, provider: str) -> None:
+        queue = self._queue(provider)
+        queue.active = max(0, queue.active - 1)
+        self._dispatch(queue)
+
+    def _dispatch(self, queue: _ProviderQueue) -> None:
+        while queue.active < queue.limit:
+            waiter = queue.next_waiter()
+            if waiter is None:
+                return
+            queue.active += 1
+            queue.dispatched += 1
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        provider: str,
+        user_id: str | None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> AsyncIterator[float]:
+        """Hold a provider slot for the duration of the block."""
+        waited = await self.acquire(provider, user_id, priority)
+        if waited > 1.0:
+            logger.info(
+                f"Scheduler: waited {waited:.1f}s for {provider} slot "
+                f"(user={user_id or 'anonymous'}, priority={priority.name.lower()})"
+            )
+        try:
+            yield waited
+        finally:
+            self.release(provider)
+
+    def stats(self) -> dict:
+        """Queue depth, utilisation and wait-time summary per provider."""
+        snapshot: dict[str, dict] = {}
+        for name, queue in self._queues.items():
+            samples = sorted(queue.wait_samples)
+            n = len(samples)
+            snapshot[name] = {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queued": {p.name.lower(): queue.depth(p) for p in Priority},
+                "queued_users": len({
+                    user for p in Priority for user in queue.queues[p]
+                }),
+                "dispatched": queue.dispatched,
+                "wait_seconds": {
+                    "avg": round(sum(samples) / n, 3) if n else 0.0,
+                    "p50": round(samples[n // 2], 3) if n else 0.0,
+                    "p95": round(samples[min(n - 1, int(n * 0.95))], 3) if n else 0.0,
+                    "max": round(samples[-1], 3) if n else 0.0,
+                },
+            }
+        return snapshot
+
+
+# Process-wide singleton shared by every generation path
+scheduler = GenerationScheduler(provider_limits=PROVIDER_CONCURRENCY)
@@ -0,0 +1,212 @@
+"""
+Non-blocking file I/O for uploads, generated outputs and batch extraction.
+
+Every read / write goes through aiofiles (or the "storage" thread pool for ZIP
+extraction), so a slow volume no longer stalls the event loop and every
+SSE stream with it. Writes are atomic: data goes to a temp file in the
+same directory which is then renamed over the target, so readers never
+see a half-written PNG.
+
+Durability is controlled by STORAGE_FSYNC:
+- "off"    — rely on the OS page cache (default)
+- "always" — fsync each file before the rename
+- "batch"  — written paths are fsynced together every
+             STORAGE_FSYNC_INTERVAL_MS; ``await sync()`` is a barrier
+             for callers that need them on disk now (e.g. before a job
+             is marked completed)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import uuid
+import zipfile
+from pathlib import Path
+from typing import BinaryIO
+
+import aiofiles
+import aiofiles.os
+
+from app.config import STORAGE_FSYNC, STORAGE_FSYNC_INTERVAL_MS
+from app.services import executors
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+
+def _fsync_paths(paths: list[Path]) -> None:
+    dirs: set[Path] = set()
+    for p in paths:
+        try:
+            fd = os.open(p, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        dirs.add(p.parent)
+    for d in dirs:  # persist the renames themselves
+        fd = os.open(d, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _FsyncBatcher:
+    """Collects written paths and fsyncs them together."""
+
+    def __init__(self, interval_ms: int):
+        self.interval = interval_ms / 1000
+        self._pending: set[Path] = set()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def add(self, path: Path) -> None:
+        self._pending.add(path)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._delayed())
+
+    async def _delayed(self) -> None:
+        await asyncio.sleep(self.interval)
+        try:
+            await self.sync()
+        except Exception as e:
+            logger.error(f"Batched fsync failed: {e}")
+
+    async def sync(self) -> None:
+        async with self._lock:
+            if not self._pending:
+                return
+            paths, self._pending = list(self._pending), set()
+            await executors.run("default", _fsync_paths, paths)
+
+
+_batcher = _FsyncBatcher(STORAGE_FSYNC_INTERVAL_MS)
+
+
+async def _discard(tmp: Path) -> None:
+    try:
+        await aiofiles.os.remove(tmp)
+    except FileNotFoundError:
+        pass
+
+
+def _after_write(path: Path) -> None:
+    if STORAGE_FSYNC == "batch":
+        _batcher.add(path)
+
+
+async def read_bytes(path: Path) -> bytes:
+    async with aiofiles.open(path, "rb") as f:
+        return await f.read()
+
+
+async def write_bytes(path: Path, data: bytes) -> None:
+    """Atomically write ``data`` to ``path`` without blocking the event loop."""
+    path = Path(path)
+    tmp = _tmp_path(path)
+    try:
+        async with aiofiles.open(tmp, "wb") as f:
+            await f.write(data)
+            if STORAGE_FSYNC == "always":
+                await f.flush()
+                await executors.run("default", os.fsync, f.fileno())
+        await aiofiles.os.replace(tmp, path)
+    except BaseException:
+        await _discard(tmp)
+        raise
+    _after_write(path)
+
+
+async def copy(src: Path, dst: Path) -> None:
+    """Atomically copy ``src`` to ``dst`` (replaces shutil.copy2 on the loop)."""
+    dst = Path(dst)
+    tmp = _tmp_path(dst)
+    try:
+        async with aiofiles.open(src, "rb") as fin, aiofiles.open(tmp, "wb") as fout:
+            while chunk := await fin.read(COPY_CHUNK_SIZE):
+                await fout.write(chunk)
+            if STORAGE_FSYNC == "always":
+                await fout.flush()
+                await executors.run("default", os.fsync, fout.fileno())
+        await aiofiles.os.replace(tmp, dst)
+    except BaseException:
+        await _discard(tmp)
+        raise
+    _after_write(dst)
+
+
+ZipSource = bytes | Path | BinaryIO
+
+
+def _open_zip(zip_source: ZipSource) -> zipfile.ZipFile:
+    if isinstance(zip_source, bytes):
+        zip_source = io.BytesIO(zip_source)
+    return zipfile.ZipFile(zip_source)
+
+
+def _index_members(zip_source: ZipSource) -> dict[str, str]:
+    index: dict[str, str] = {}
+    with _open_zip(zip_source) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            base = name.rsplit("/", 1)[-1]
+            if info.is_dir() or not base or base.startswith(".") or name.startswith("__MACOSX/"):
+                continue
+            current = index.get(base)
+            if current is None or name.count("/") < current.count("/"):
+                index[base] = name  # the shallowest member wins
+    return index
+
+
+async def index_zip_members(zip_source: ZipSource) -> dict[str, str]:
+    """Map each file's basename to its member name, reading only the ZIP directory.
+
+    Raises zipfile.BadZipFile for invalid archives.
+    """
+    return await executors.run("storage", _index_members, zip_source)
+
+
+def _extract_members(zip_source: ZipSource, members: dict[str, Path]) -> None:
+    with _open_zip(zip_source) as zf:
+        for name, dest in members.items():
+            tmp = _tmp_path(dest)
+            try:
+                with zf.open(name) as src, open(tmp, "wb") as out:
+                    while chunk := src.read(COPY_CHUNK_SIZE):
+                        out.write(chunk)
+                    if STORAGE_FSYNC == "always":
+                        out.flush()
+                        os.fsync(out.fileno())
+                os.replace(tmp, dest)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+
+
+async def extract_zip_members(zip_source: ZipSource, members: dict[str, Path]) -> None:
+    """Extract ``{member_name: dest_path}`` from a ZIP off the event loop.
+
+    ``zip_source`` may be the archive's bytes, a path, or a seekable file
+    (e.g. an upload's spooled temp file); members are streamed to disk in
+    COPY_CHUNK_SIZE pieces, so memory stays bounded whatever the ZIP size.
+    """
+    await executors.run("storage", _extract_members, zip_source, members)
+    for dest in members.values():
+        _after_write(dest)
+
+
+async def sync() -> None:
+    """Durability barrier: fsync everything written so far (batch mode)."""
+    if STORAGE_FSYNC == "batch":
+        await _batcher.sync()
@@ -0,0 +1,140 @@
+"""
+Per-task event bus for generation progress.
+
+Generation runs as a background job that publishes its progress events
+here; SSE connections are only subscribers. Each bus keeps a bounded
+replay buffer (TASK_EVENT_REPLAY_SIZE) of numbered events, so a viewer
+that connects late — or reconnects with ``Last-Event-ID`` — receives
+what it missed without restarting or blocking the job. Any number of
+subscribers can attach; a publish is one JSON encode, one append and one
+wake-up, whatever the subscriber count.
+
+Events marked ``"snapshot": True`` carry the full state. A new
+subscriber, or one whose Last-Event-ID has fallen out of the buffer,
+starts from the latest snapshot and then receives deltas.
+
+Usage:
+    bus = task_events.create(task_id)
+    bus.publish({"event": "progress", ...})
+    ...
+    async for item in bus.subscribe(last_event_id, heartbeat=15):
+        ...  # BusEvent, or None when ``heartbeat`` seconds pass idle
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import AsyncIterator
+
+from app.config import TASK_EVENT_REPLAY_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class BusEvent:
+    __slots__ = ("seq", "event", "data", "snapshot")
+
+    def __init__(self, seq: int, event: dict):
+        self.seq = seq
+        self.event = event
+        self.data = json.dumps(event, ensure_ascii=False)  # encoded once for all subscribers
+        self.snapshot = bool(event.get("snapshot"))
+
+
+class TaskEventBus:
+    def __init__(self, task_id: str, replay_size: int = TASK_EVENT_REPLAY_SIZE):
+        self.task_id = task_id
+        self._events: deque[BusEvent] = deque(maxlen=replay_size)
+        self._seq = 0
+        self._changed = asyncio.Event()
+        self.closed = False
+        self.subscribers = 0
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def publish(self, event: dict) -> int:
+        """Publish an event, stamping it with the next sequence number."""
+        self._seq += 1
+        event["seq"] = self._seq
+        self._events.append(BusEvent(self._seq, event))
+        # Wake current subscribers; later waits use a fresh Event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return self._seq
+
+    def close(self) -> None:
+        """No more events will be published; subscribers finish after draining."""
+        self.closed = True
+        self._changed.set()
+
+    def _start_cursor(self, last_event_id: int | None) -> int:
+        cursor = last_event_id or 0
+        if cursor > self._seq:
+            cursor = 0  # ID from a previous run / process
+        oldest = self._events[0].seq if self._events else self._seq + 1
+        if cursor == 0 or cursor < oldest - 1:
+            # Fresh subscriber or a gap — begin at the latest snapshot
+            for item in reversed(self._events):
+                if item.snapshot:
+                    return item.seq - 1
+        return cursor
+
+    async def subscribe(
+        self,
+        last_event_id: int | None = None,
+        heartbeat: float | None = None,
+    ) -> AsyncIterator[BusEvent | None]:
+        """Yield events after ``last_event_id`` until the bus closes.
+
+        With ``heartbeat`` set, yields None after that many idle seconds so
+        the caller can send a keep-alive.
+        """
+        cursor = self._start_cursor(last_event_id)
+        self.subscribers += 1
+        try:
+            while True:
+                changed = self._changed
+                for item in list(self._events):
+                    if item.seq > cursor:
+                        cursor = item.seq
+                        yield item
+                if self.closed:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.subscribers -= 1
+
+
+_buses: dict[str, TaskEventBus] = {}
+
+
+def create(task_id: str) -> TaskEventBus:
+    bus = TaskEventBus(task_id)
+    _buses[task_id] = bus
+    return bus
+
+
+def get(task_id: str) -> TaskEventBus | None:
+    return _buses.get(task_id)
+
+
+def drop(task_id: str) -> None:
+    bus = _buses.pop(task_id, None)
+    if bus is not None:
+        bus.close()
+
+
+def stats() -> dict:
+    return {
+        "buses": len(_buses),
+        "open": sum(1 for b in _buses.values() if not b.closed),
+        "subscribers": sum(b.subscribers for b in _buses.values()),
+    }
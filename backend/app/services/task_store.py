@@ -0,0 +1,133 @@
+"""
+In-memory store for generation tasks.
+
+Tasks that are still in progress are pinned: they are never evicted, no
+matter how many tasks exist, so a large batch cannot push a live task
+out from under its job or its SSE viewers. Finished tasks are kept in
+least-recently-used order within a count limit (TASK_STORE_MAX_TASKS)
+and an approximate memory budget (TASK_STORE_MAX_BYTES); an evicted task
+is simply re-read from the DB on its next lookup.
+
+Whether a task is pinned is re-checked lazily — finished tasks move to
+the LRU side on the next insert or ``refresh()``, and an LRU entry that
+became busy again (e.g. a regenerate) is pinned instead of evicted.
+
+Usage:
+    store = TaskStore(is_pinned=lambda t: t.status == "running", sizeof=estimate)
+    store[task.task_id] = task
+    task = store.get(task_id)  # None if never seen or evicted
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import Any, Callable
+
+from app.config import TASK_STORE_MAX_BYTES, TASK_STORE_MAX_TASKS
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStore:
+    def __init__(
+        self,
+        is_pinned: Callable[[Any], bool],
+        sizeof: Callable[[Any], int],
+        on_release: Callable[[str], None] | None = None,
+        max_tasks: int = TASK_STORE_MAX_TASKS,
+        max_bytes: int = TASK_STORE_MAX_BYTES,
+    ):
+        self.is_pinned = is_pinned
+        self.sizeof = sizeof
+        self.on_release = on_release  # called when a task stops being live
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self._pinned: dict[str, Any] = {}
+        self._lru: OrderedDict[str, tuple[Any, int]] = OrderedDict()  # id -> (task, bytes)
+        self._lru_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, task_id: str) -> Any | None:
+        task = self._pinned.get(task_id)
+        if task is not None:
+            self.hits += 1
+            return task
+        entry = self._lru.get(task_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._lru.move_to_end(task_id)
+        return entry[0]
+
+    def __setitem__(self, task_id: str, task: Any) -> None:
+        self._remove(task_id)
+        if self.is_pinned(task):
+            self._pinned[task_id] = task
+        else:
+            self._add_lru(task_id, task)
+        self._settle()
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._pinned or task_id in self._lru
+
+    def __len__(self) -> int:
+        return len(self._pinned) + len(self._lru)
+
+    def pop(self, task_id: str, default: Any = None) -> Any:
+        task = self._remove(task_id)
+        return default if task is None else task
+
+    def refresh(self, task_id: str) -> None:
+        """Re-check a task after its status changed (e.g. its job finished)."""
+        task = self._remove(task_id)
+        if task is not None:
+            self[task_id] = task
+
+    def _remove(self, task_id: str) -> Any | None:
+        task = self._pinned.pop(task_id, None)
+        if task is not None:
+            return task
+        entry = self._lru.pop(task_id, None)
+        if entry is None:
+            return None
+        self._lru_bytes -= entry[1]
+        return entry[0]
+
+    def _add_lru(self, task_id: str, task: Any) -> None:
+        nbytes = self.sizeof(task)
+        self._lru[task_id] = (task, nbytes)
+        self._lru_bytes += nbytes
+
+    def _settle(self) -> None:
+        # Finished tasks leave the pinned set
+        for task_id in [tid for tid, t in self._pinned.items() if not self.is_pinned(t)]:
+            self._add_lru(task_id, self._pinned.pop(task_id))
+            if self.on_release:
+                self.on_release(task_id)
+
+        # Evict least recently used finished tasks while over budget
+        while self._lru and (len(self._lru) > self.max_tasks or self._lru_bytes > self.max_bytes):
+            task_id, (task, nbytes) = self._lru.popitem(last=False)
+            self._lru_bytes -= nbytes
+            if self.is_pinned(task):
+                self._pinned[task_id] = task  # busy again — keep it
+                continue
+            self.evictions += 1
+            if self.on_release:
+                self.on_release(task_id)
+
+    def stats(self) -> dict:
+        return {
+            "pinned": len(self._pinned),
+            "cached": len(self._lru),
+            "cached_bytes": self._lru_bytes,
+            "max_tasks": self.max_tasks,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,147 @@
+"""
+On-demand thumbnails of generated outputs.
+
+The history page and result grids loaded full-size outputs (often 1–3 MB
+PNGs) just to show a tile. /api/outputs/{task_id}/{file}?w=256&fmt=webp
+(app.routers.outputs) serves a downscaled copy instead. Requested widths
+round up to one of THUMBNAIL_WIDTHS so a handful of sizes are cached per
+output; thumbnails live under THUMBNAIL_CACHE_DIR with least-recently-used
+eviction, keyed by the output's content hash — a regenerated output gets
+new thumbnails and the old ones age out.
+
+Cache misses render on the dedicated "thumbnail" thread pool (Pillow
+releases the GIL while decoding, resampling and encoding), so they never
+queue behind exports. Once THUMBNAIL_MAX_PENDING renders are waiting,
+get() returns None and the caller serves the original (when it is in the
+requested format) or a 503 instead of letting the queue grow without bound.
+
+The same cache holds full-size PNGs materialized from stored masters
+(get(source, None, "png"), see output_storage.py).
+
+URLs built with a version (the output's mtime, see versioned_url) can be
+cached as immutable: the version changes whenever the file does.
+
+Usage:
+    url = await thumbnails.versioned_url(task_id, template_id)
+    path = await thumbnails.get(OUTPUT_DIR / task_id / "hero.png", 256, "webp")
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+from pathlib import Path
+from urllib.parse import urlencode
+
+import aiofiles.os
+
+from app.config import (
+    OUTPUT_DIR,
+    THUMBNAIL_CACHE_DIR,
+    THUMBNAIL_CACHE_MAX_BYTES,
+    THUMBNAIL_DEFAULT_WIDTH,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_MAX_PENDING,
+    THUMBNAIL_WIDTHS,
+)
+from app.services import executors, image_export, output_storage, rendition_cache
+from app.services.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+_cache = ResultCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, suffix=".bin")
+_pending = 0
+_shed = 0
+
+
+class _Overloaded(Exception):
+    pass
+
+
+def snap_width(width: int) -> int:
+    """Smallest configured thumbnail width >= ``width`` (the largest if none)."""
+    i = bisect.bisect_left(THUMBNAIL_WIDTHS, width)
+    return THUMBNAIL_WIDTHS[min(i, len(THUMBNAIL_WIDTHS) - 1)]
+
+
+def output_url(
+    task_id: str,
+    filename: str,
+    width: int | None = None,
+    fmt: str | None = None,
+    version: str | None = None,
+) -> str:
+    """URL of an output, or of its thumbnail when ``width`` / ``fmt`` is given."""
+    params = {k: v for k, v in (("w", width), ("fmt", fmt), ("v", version)) if v is not None}
+    url = f"/api/outputs/{task_id}/{filename}"
+    return f"{url}?{urlencode(params)}" if params else url
+
+
+def thumbnail_url(task_id: str, template_id: str) -> str:
+    """Unversioned default-size thumbnail URL (revalidated by ETag)."""
+    return output_url(task_id, f"{template_id}.png", THUMBNAIL_DEFAULT_WIDTH, THUMBNAIL_FORMAT)
+
+
+async def output_version(path: Path) -> str | None:
+    """Version token of an output (its stored file's mtime), or None if it is gone."""
+    stored = await output_storage.locate(path)
+    if stored is None:
+        return None
+    try:
+        st = await aiofiles.os.stat(stored)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns:x}"
+
+
+async def versioned_url(
+    task_id: str,
+    template_id: str,
+    width: int | None = THUMBNAIL_DEFAULT_WIDTH,
+    fmt: str | None = THUMBNAIL_FORMAT,
+) -> str:
+    """Like thumbnail_url(), plus the output's version so it may be cached forever.
+
+    ``width`` and ``fmt`` None give the versioned full-size URL.
+    """
+    filename = f"{template_id}.png"
+    version = await output_version(OUTPUT_DIR / task_id / filename)
+    return output_url(task_id, filename, width, fmt, version)
+
+
+async def get(source: Path, width: int | None, fmt: str) -> Path | None:
+    """Cached thumbnail file of ``source``; None when too many renders are queued.
+
+    Raises FileNotFoundError if ``source`` does not exist.
+    """
+    global _shed
+    stored = await output_storage.locate(source)
+    digest = await rendition_cache.source_digest(stored) if stored is not None else None
+    if digest is None:
+        raise FileNotFoundError(source)
+    key = f"{digest}_{width or 'full'}.{fmt}"
+
+    async def render() -> bytes:
+        global _pending
+        if _pending >= THUMBNAIL_MAX_PENDING:
+            raise _Overloaded()
+        _pending += 1
+        try:
+            data = await executors.run("thumbnail", image_export.render_thumbnail, stored, width, fmt)
+        finally:
+            _pending -= 1
+        if data is None:
+            raise FileNotFoundError(source)
+        return data
+
+    try:
+        return await _cache.get_path(key, render)
+    except _Overloaded:
+        _shed += 1
+        if _shed % 100 == 1:
+            logger.warning(f"Thumbnail renders saturated ({_pending} pending); serving originals")
+        return None
+
+
+def stats() -> dict:
+    return {**_cache.stats(), "pending": _pending, "shed": _shed}
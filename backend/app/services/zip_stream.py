@@ -0,0 +1,132 @@
+"""
+Streaming ZIP writer for downloads.
+
+Instead of building the whole archive in a BytesIO before sending a
+byte, stream_zip() yields the archive as each entry is finished, so the
+first bytes go out as soon as the first image is ready and memory holds
+only a few entries at a time, whatever the number of images.
+
+Entry data is produced by a callable run on the "export" executor (or
+by an async callable, e.g. a rendition cache lookup); up to ``window``
+entries are produced in parallel (e.g. platform resizes) while earlier
+ones are being written. Entries are still written in
+order. Formats that are already compressed (PNG, JPEG, WebP) are
+ZIP_STORED — deflating them costs CPU for no gain; anything else is
+deflated.
+
+Usage:
+    entries = [ZipEntry("a.png", lambda: render(path)) for path in paths]
+    return StreamingResponse(stream_zip(entries), media_type="application/zip")
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import io
+import logging
+import time
+import zipfile
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Iterable
+
+from app.config import EXECUTOR_WORKERS
+from app.services import executors
+
+logger = logging.getLogger(__name__)
+
+STORED_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp", ".avif", ".zip")
+
+
+@dataclass(slots=True)
+class ZipEntry:
+    arcname: str
+    # Sync callables run in a worker thread; async ones on the loop. None skips the entry.
+    produce: Callable[[], bytes | None] | Callable[[], Awaitable[bytes | None]]
+
+    def start(self) -> asyncio.Future:
+        if inspect.iscoroutinefunction(self.produce):
+            return asyncio.ensure_future(self.produce())
+        return asyncio.ensure_future(executors.run("export", self.produce))
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable write target that hands out what was written so far.
+
+    zipfile detects the missing seek() and writes data descriptors, so
+    each entry is final as soon as it is written.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _compress_type(arcname: str) -> int:
+    return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+
+def _write_entry(zf: zipfile.ZipFile, arcname: str, data: bytes) -> None:
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+    info.compress_type = _compress_type(arcname)
+    info.external_attr = 0o644 << 16
+    zf.writestr(info, data)
+
+
+async def stream_zip(
+    entries: Iterable[ZipEntry],
+    window: int = EXECUTOR_WORKERS["export"],
+) -> AsyncIterator[bytes]:
+    """Yield a ZIP archive of ``entries`` chunk by chunk."""
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w")
+    pending: deque[tuple[str, asyncio.Future]] = deque()
+    source = iter(entries)
+    written = 0
+
+    def fill() -> None:
+        while len(pending) < max(1, window):
+            entry = next(source, None)
+            if entry is None:
+                return
+            pending.append((entry.arcname, entry.start()))
+
+    try:
+        fill()
+        while pending:
+            arcname, produced = pending.popleft()
+            data = await produced
+            fill()
+            if data is None:
+                continue
+            # CRC + (for non-image entries) deflate off the loop as well
+            await executors.run("default", _write_entry, zf, arcname, data)
+            written += 1
+            yield sink.drain()
+        zf.close()
+        yield sink.drain()
+    except Exception as e:
+        logger.error(f"ZIP stream failed after {written} entries: {e}")
+        raise
+    finally:
+        for _, produced in pending:
+            produced.cancel()
+        if zf.fp is not None:
+            zf.close()  # abandoned stream: finish into the sink, which is dropped
@@ -0,0 +1,57 @@
+"""
+Generation worker process.
+
+Claims generation and batch work items from the DB-backed queue (see
+app.services.job_queue) and runs them. Run any number of these next to
+the API processes when JOB_QUEUE_MODE=queue:
+
+    python -m app.worker
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s: %(message)s")
+logging.getLogger("app").setLevel(logging.INFO)
+
+# Import templates package to trigger registration of all product types
+import app.templates  # noqa: F401, E402
+
+from app.database import init_db  # noqa: E402
+from app.services import batch_runner, executors, generation_service, http_pool, job_queue  # noqa: E402
+from app.services.job_persistence import write_behind  # noqa: E402
+
+logger = logging.getLogger("app.worker")
+
+
+async def _run_batch(batch_id: str, payload: dict) -> None:
+    await batch_runner.run_batch(batch_id)
+
+
+async def main() -> None:
+    await init_db()
+
+    job_queue.register_handler("generation", generation_service.run_queued_generation)
+    job_queue.register_handler("batch", _run_batch)
+    job_queue.register_failure_hook("generation", generation_service.fail_job)
+    job_queue.register_failure_hook("batch", batch_runner.fail_batch)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await job_queue.Worker().run(stop)
+    finally:
+        await write_behind.close()
+        await http_pool.close_all()
+        executors.shutdown_all()
+        logger.info("Worker stopped")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -88,7 +88,8 @@ function GenerateContent() {
                 const completedImages = (event.results || []).filter(
                   (r) => r.status === "completed",
                 );
-                const firstUrl = completedImages.find((r) => r.url)?.url || undefined;
+                const first = completedImages.find((r) => r.url);
+                const firstUrl = first?.thumbnail_url || first?.url || undefined;
                 saveToHistory({
                   taskId: recoveryTaskId,
                   productType,
@@ -228,7 +229,8 @@ function GenerateContent() {
             const completedImages = (event.results || []).filter(
               (r) => r.status === "completed",
             );
-            const firstUrl = completedImages.find((r) => r.url)?.url || undefined;
+            const first = completedImages.find((r) => r.url);
+            const firstUrl = first?.thumbnail_url || first?.url || undefined;
             saveToHistory({
               taskId: task.task_id,
               productType,
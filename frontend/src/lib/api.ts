@@ -145,21 +145,37 @@ export function subscribeToGeneration(
   let retryCount = 0;
   let currentSource: EventSource | null = null;
   let closed = false;
+  let lastEventId = "";
+  // Protocol v2 sends per-image deltas; keep the full list here so callers
+  // still receive complete `results` on every event.
+  const results = new Map<string, GeneratedImage>();
 
   function connect() {
     if (closed) return;
 
     // Add token as query param for SSE (EventSource can't set custom headers)
+    const params = new URLSearchParams();
     const token = getToken();
-    const tokenParam = token ? `?token=${encodeURIComponent(token)}` : "";
-    const eventSource = new EventSource(`${API_BASE}/generate/${taskId}/status${tokenParam}`);
+    if (token) params.set("token", token);
+    // Resume after the last event we saw instead of replaying from the start
+    if (lastEventId) params.set("resume_from", lastEventId);
+    params.set("protocol", "2");
+    const query = params.toString() ? `?${params.toString()}` : "";
+    const eventSource = new EventSource(`${API_BASE}/generate/${taskId}/status${query}`);
     currentSource = eventSource;
 
     eventSource.onmessage = (e) => {
       try {
         const data: SSEEvent = JSON.parse(e.data);
+        if (e.lastEventId) lastEventId = e.lastEventId;
         retryCount = 0; // Reset retry count on successful message
-        onEvent(data);
+        if (data.results) {
+          results.clear();
+          for (const r of data.results) results.set(r.template_id, r);
+        } else if (data.image) {
+          results.set(data.image.template_id, data.image);
+        }
+        onEvent(results.size ? { ...data, results: Array.from(results.values()) } : data);
 
         if (data.event === "completed" || data.event === "error") {
           closed = true;
@@ -299,6 +315,7 @@ export async function compositeGrid(
     cell_size?: number;
     gap?: number;
     bg_color?: string;
+    format?: "png" | "jpeg" | "webp";
   } = {},
 ): Promise<Blob> {
   const res = await authFetch(`${API_BASE}/composite/${taskId}`, {
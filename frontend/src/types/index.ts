@@ -83,6 +83,7 @@ export interface GeneratedImage {
   template_name: string;
   status: ImageStatus;
   url: string | null;
+  thumbnail_url?: string | null;
   error: string | null;
 }
 
@@ -101,6 +102,11 @@ export interface SSEEvent {
   total?: number;
   status?: string;
   results?: GeneratedImage[];
+  // Protocol v2: sequence number, snapshot marker and per-image delta
+  v?: number;
+  seq?: number;
+  snapshot?: boolean;
+  image?: GeneratedImage;
 }
 
 export interface PlatformSpec {